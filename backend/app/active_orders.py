@@ -0,0 +1,116 @@
+import os, json, asyncio, logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+# Read-модель активных заказов в памяти: обновляется из orders_create и webhook'а Taxomet,
+# при старте пересобирается из БД. Терминальные статусы — коды Taxomet, после которых
+# заказ из активных убирается. Заказ, так и не дошедший до терминального статуса, вытесняется
+# по возрасту (ACTIVE_ORDERS_MAX_AGE_HOURS, как и в LOAD_SQL) — раз в ACTIVE_ORDERS_EVICT_SECONDS.
+ORDER_TERMINAL_STATUSES = [int(x) for x in os.getenv("ORDER_TERMINAL_STATUSES","4,5").split(",") if x.strip()]
+ACTIVE_ORDERS_MAX_AGE_HOURS = int(os.getenv("ACTIVE_ORDERS_MAX_AGE_HOURS","24"))
+ACTIVE_ORDERS_EVICT_SECONDS = float(os.getenv("ACTIVE_ORDERS_EVICT_SECONDS","300"))
+
+log = logging.getLogger("taxi.active_orders")
+
+COLUMNS = ("extern_id, taxomet_order_id, tg_user_id, vk_user_id, status, driver_id, driver_title, fix_price, "
+           "from_address, to_addresses, created_at, updated_at")
+
+LOAD_SQL = f"""
+SELECT {COLUMNS}
+FROM orders
+WHERE created_at > now() - ($1::text || ' hours')::interval
+  AND status <> ALL($2::int[])
+"""
+
+by_extern: dict[str, dict[str, Any]] = {}
+by_taxomet: dict[int, str] = {}
+by_user: dict[int, set[str]] = {}
+
+stats: dict[str, int] = {"evicted": 0}
+
+
+def is_terminal(status: int) -> bool:
+  return status in ORDER_TERMINAL_STATUSES
+
+
+def _order(row) -> dict[str, Any]:
+  o = dict(row)
+  if isinstance(o.get("to_addresses"), str):
+    o["to_addresses"] = json.loads(o["to_addresses"])
+  if o.get("fix_price") is not None:
+    o["fix_price"] = float(o["fix_price"])
+  return o
+
+
+def remove(extern_id: str):
+  o = by_extern.pop(extern_id, None)
+  if not o:
+    return
+  if o.get("taxomet_order_id"):
+    by_taxomet.pop(o["taxomet_order_id"], None)
+  ids = by_user.get(o.get("tg_user_id"))
+  if ids is not None:
+    ids.discard(extern_id)
+    if not ids:
+      by_user.pop(o["tg_user_id"], None)
+
+
+def evict_stale(now: Optional[datetime] = None) -> int:
+  cutoff = (now or datetime.now(timezone.utc)) - timedelta(hours=ACTIVE_ORDERS_MAX_AGE_HOURS)
+  stale = [e for e, o in by_extern.items() if o.get("created_at") is not None and o["created_at"] <= cutoff]
+  for extern_id in stale:
+    remove(extern_id)
+  stats["evicted"] += len(stale)
+  return len(stale)
+
+
+def apply(row):
+  o = _order(row)
+  extern_id = o["extern_id"]
+  if is_terminal(o["status"]):
+    remove(extern_id)
+    return
+  old = by_extern.get(extern_id)
+  if old and old.get("taxomet_order_id") != o.get("taxomet_order_id"):
+    by_taxomet.pop(old.get("taxomet_order_id"), None)
+  by_extern[extern_id] = o
+  if o.get("taxomet_order_id"):
+    by_taxomet[o["taxomet_order_id"]] = extern_id
+  if o.get("tg_user_id") is not None:
+    by_user.setdefault(o["tg_user_id"], set()).add(extern_id)
+
+
+async def load(conn):
+  rows = await conn.fetch(LOAD_SQL, ACTIVE_ORDERS_MAX_AGE_HOURS, ORDER_TERMINAL_STATUSES)
+  by_extern.clear(); by_taxomet.clear(); by_user.clear()
+  for r in rows:
+    apply(r)
+
+
+def get(extern_id: Optional[str] = None, taxomet_order_id: Optional[int] = None) -> Optional[dict[str, Any]]:
+  if extern_id is None and taxomet_order_id is not None:
+    extern_id = by_taxomet.get(taxomet_order_id)
+  return by_extern.get(extern_id) if extern_id else None
+
+
+def for_user(tg_user_id: int) -> list[dict[str, Any]]:
+  return [by_extern[e] for e in by_user.get(tg_user_id, ()) if e in by_extern]
+
+
+async def run():
+  if ACTIVE_ORDERS_EVICT_SECONDS <= 0:
+    return
+  while True:
+    await asyncio.sleep(ACTIVE_ORDERS_EVICT_SECONDS)
+    n = evict_stale()
+    if n:
+      log.info("evicted %d stale active orders", n)
+
+
+async def reload(conn, extern_id: str):
+  # изменение пришло от другого воркера (LISTEN/NOTIFY) — перечитываем один заказ
+  row = await conn.fetchrow(f"SELECT {COLUMNS} FROM orders WHERE extern_id=$1", extern_id)
+  if row:
+    apply(row)
+  else:
+    remove(extern_id)
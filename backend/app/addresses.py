@@ -0,0 +1,125 @@
+import os, json, re
+from typing import Any, Iterable, Optional
+
+# Локальный индекс адресов (pg_trgm). Наполняется ответами геокодера и адресами заказов,
+# в /api/geo/search опрашивается первым; апстрим — только если локально мало результатов.
+GEO_LOCAL_MIN_RESULTS = int(os.getenv("GEO_LOCAL_MIN_RESULTS","3"))
+GEO_LOCAL_MIN_SIMILARITY = float(os.getenv("GEO_LOCAL_MIN_SIMILARITY","0.5"))
+
+# оператор <% отсекает по pg_trgm.word_similarity_threshold (по умолчанию 0.6) — порог ниже
+# выставляется на время запроса (SET LOCAL: пул asyncpg делает RESET ALL при возврате соединения)
+PG_TRGM_DEFAULT_THRESHOLD = 0.6
+
+SCHEMA = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE IF NOT EXISTS addresses(
+  id BIGSERIAL PRIMARY KEY,
+  norm TEXT NOT NULL UNIQUE,
+  display_name TEXT NOT NULL,
+  lat DOUBLE PRECISION NOT NULL,
+  lon DOUBLE PRECISION NOT NULL,
+  raw JSONB,
+  source TEXT NOT NULL DEFAULT 'geocoder',
+  hits INT NOT NULL DEFAULT 0,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_addresses_norm_trgm ON addresses USING GIN (norm gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_addresses_norm_prefix ON addresses(norm text_pattern_ops);
+"""
+
+SEARCH_SQL = """
+SELECT id, display_name, lat, lon, raw,
+       word_similarity($1, norm) AS sim,
+       norm LIKE $2 AS is_prefix
+FROM addresses
+WHERE norm LIKE $2 OR $1 <% norm
+ORDER BY is_prefix DESC, sim DESC, hits DESC
+LIMIT $3
+"""
+
+UPSERT_SQL = """
+INSERT INTO addresses(norm, display_name, lat, lon, raw, source, hits)
+VALUES($1,$2,$3,$4,$5::jsonb,$6,$7)
+ON CONFLICT(norm) DO UPDATE
+   SET lat=EXCLUDED.lat, lon=EXCLUDED.lon,
+       raw=COALESCE(EXCLUDED.raw, addresses.raw),
+       hits=addresses.hits + EXCLUDED.hits,
+       updated_at=now()
+"""
+
+
+def normalize(text: str) -> str:
+  s = (text or "").lower().replace("ё", "е")
+  s = re.sub(r"[^\w]+", " ", s)
+  return " ".join(s.split())
+
+
+def _like_prefix(norm: str) -> str:
+  return norm.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _to_nominatim(row) -> dict[str, Any]:
+  # сохранённый ответ геокодера отдаём как есть — фронт и бот его уже понимают
+  if row["raw"]:
+    item = json.loads(row["raw"])
+    item["display_name"] = row["display_name"]
+    item["lat"] = str(row["lat"])
+    item["lon"] = str(row["lon"])
+    return item
+  return {
+    "place_id": f"local:{row['id']}",
+    "lat": str(row["lat"]),
+    "lon": str(row["lon"]),
+    "display_name": row["display_name"],
+    "address": {},
+  }
+
+
+async def ensure_schema(conn):
+  await conn.execute(SCHEMA)
+
+
+async def search(conn, q: str, limit: int) -> list[dict[str, Any]]:
+  norm = normalize(q)
+  if not norm:
+    return []
+  if GEO_LOCAL_MIN_SIMILARITY < PG_TRGM_DEFAULT_THRESHOLD:
+    async with conn.transaction():
+      await conn.execute("SELECT set_config('pg_trgm.word_similarity_threshold', $1, true)",
+                         str(GEO_LOCAL_MIN_SIMILARITY))
+      rows = await conn.fetch(SEARCH_SQL, norm, _like_prefix(norm), limit)
+  else:
+    rows = await conn.fetch(SEARCH_SQL, norm, _like_prefix(norm), limit)
+  return [_to_nominatim(r) for r in rows if r["is_prefix"] or r["sim"] >= GEO_LOCAL_MIN_SIMILARITY]
+
+
+def is_enough(items: list, limit: int) -> bool:
+  return len(items) >= max(1, min(limit, GEO_LOCAL_MIN_RESULTS))
+
+
+async def remember_geocoder(conn, items: Iterable[dict[str, Any]]):
+  rows = []
+  for it in items:
+    name = (it or {}).get("display_name") or ""
+    norm = normalize(name)
+    try:
+      lat, lon = float(it.get("lat")), float(it.get("lon"))
+    except (TypeError, ValueError):
+      continue
+    if norm:
+      rows.append((norm, name, lat, lon, json.dumps(it, ensure_ascii=False), "geocoder", 0))
+  if rows:
+    await conn.executemany(UPSERT_SQL, rows)
+
+
+async def remember_points(conn, points: Iterable[tuple[str, Optional[float], Optional[float]]], source: str = "order"):
+  # адреса из заказов: только с координатами, каждое использование повышает вес
+  rows = []
+  for name, lat, lon in points:
+    norm = normalize(name)
+    if norm and lat is not None and lon is not None:
+      rows.append((norm, name, float(lat), float(lon), None, source, 1))
+  if rows:
+    await conn.executemany(UPSERT_SQL, rows)
@@ -0,0 +1,108 @@
+import os, time, asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any
+
+from fastapi import HTTPException
+
+from . import coord
+
+# Admission control перед Taxomet: не больше TAXOMET_CONCURRENCY одновременных вызовов,
+# остальные ждут в ограниченной FIFO-очереди. У каждого запроса есть дедлайн: если по оценке
+# (очередь впереди * среднее время вызова) он не успеет — отказываем сразу, а не после ожидания.
+TAXOMET_CONCURRENCY = int(os.getenv("TAXOMET_CONCURRENCY","8"))
+TAXOMET_QUEUE_MAX = int(os.getenv("TAXOMET_QUEUE_MAX","64"))
+TAXOMET_DEADLINE_SECONDS = float(os.getenv("TAXOMET_DEADLINE_SECONDS","20"))
+
+
+class Admission:
+  def __init__(self, limit: int, queue_max: int):
+    self.limit = limit
+    self.queue_max = queue_max
+    self.active = 0
+    self.waiters: deque[asyncio.Future] = deque()
+    self.service_ewma = 1.0  # сек, среднее время одного вызова
+    self.stats: dict[str, Any] = {
+      "admitted": 0,
+      "rejected_queue_full": 0,
+      "rejected_deadline": 0,
+      "wait_ms_last": 0.0,
+      "wait_ms_ewma": 0.0,
+      "wait_ms_max": 0.0,
+      "service_ms_ewma": 1000.0,
+    }
+
+  def snapshot(self) -> dict[str, Any]:
+    return {**self.stats, "active": self.active, "queued": len(self.waiters), "limit": self.limit}
+
+  def _estimated_wait(self) -> float:
+    if self.active < self.limit and not self.waiters:
+      return 0.0
+    return (len(self.waiters) // self.limit + 1) * self.service_ewma
+
+  def _reject(self, kind: str, detail: str):
+    self.stats[kind] += 1
+    raise HTTPException(status_code=503, detail=detail,
+                        headers={"Retry-After": str(max(1, int(self._estimated_wait() + 0.5)))})
+
+  def _release(self):
+    # слот передаём следующему живому ожидающему, иначе освобождаем
+    while self.waiters:
+      fut = self.waiters.popleft()
+      if not fut.done():
+        fut.set_result(None)
+        return
+    self.active -= 1
+
+  @asynccontextmanager
+  async def slot(self, deadline: float):
+    t0 = time.monotonic()
+    remaining = deadline - t0
+    if remaining <= 0 or self._estimated_wait() + self.service_ewma > remaining:
+      self._reject("rejected_deadline", "taxomet busy: deadline can't be met")
+
+    if self.active < self.limit and not self.waiters:
+      self.active += 1
+    else:
+      if len(self.waiters) >= self.queue_max:
+        self._reject("rejected_queue_full", "taxomet busy: queue full")
+      fut = asyncio.get_running_loop().create_future()
+      self.waiters.append(fut)
+      try:
+        await asyncio.wait_for(asyncio.shield(fut), remaining)
+      except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        if fut.done() and not fut.cancelled():
+          # слот успели передать в момент таймаута/отмены — вернуть его
+          self._release()
+        else:
+          fut.cancel()
+        if isinstance(e, asyncio.CancelledError):
+          raise
+        self._reject("rejected_deadline", "taxomet busy: deadline expired in queue")
+
+    wait_ms = (time.monotonic() - t0) * 1000
+    self.stats["admitted"] += 1
+    self.stats["wait_ms_last"] = round(wait_ms, 2)
+    self.stats["wait_ms_ewma"] = round(self.stats["wait_ms_ewma"] * 0.9 + wait_ms * 0.1, 2)
+    self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], round(wait_ms, 2))
+
+    t1 = time.monotonic()
+    try:
+      yield deadline - t1
+    finally:
+      self.service_ewma = self.service_ewma * 0.8 + (time.monotonic() - t1) * 0.2
+      self.stats["service_ms_ewma"] = round(self.service_ewma * 1000, 2)
+      self._release()
+
+
+# лимиты общие на сервис — делим между воркерами
+taxomet = Admission(int(coord.worker_share(TAXOMET_CONCURRENCY)), int(coord.worker_share(TAXOMET_QUEUE_MAX)))
+
+
+def request_deadline(request) -> float:
+  # клиент может передать свой бюджет: x-deadline-ms (относительно момента прихода)
+  try:
+    budget = float(request.headers.get("x-deadline-ms","")) / 1000
+  except ValueError:
+    budget = TAXOMET_DEADLINE_SECONDS
+  return time.monotonic() + min(budget, TAXOMET_DEADLINE_SECONDS)
@@ -0,0 +1,126 @@
+import os, asyncio, hashlib, logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable
+
+# Координация воркеров uvicorn (WEB_CONCURRENCY > 1) через Postgres:
+#  - DDL при старте — под advisory lock и только если схема поменялась (хэш DDL в app_meta);
+#  - фоновые задачи в одном экземпляре (dispatch, обслуживание секций) — у лидера,
+#    лидер = держатель session-level advisory lock на выделенном соединении;
+#  - изменения активных заказов — рассылка через LISTEN/NOTIFY.
+# Состояние в памяти либо своё у каждого воркера (кэши, read-модель активных заказов, буфер истории),
+# либо общее через Postgres с единственным обработчиком-лидером (статусы заказов, дайджесты групп).
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY","1")))
+LEADER_RETRY_SECONDS = float(os.getenv("LEADER_RETRY_SECONDS","5"))
+
+LOCK_SCHEMA = 4172_0001
+LOCK_LEADER = 4172_0002
+LOCK_DRIVER_SYNC = 4172_0003
+
+ORDERS_CHANNEL = "active_orders"
+
+log = logging.getLogger("taxi.coord")
+
+state: dict[str, Any] = {"pid": os.getpid(), "workers": WEB_CONCURRENCY, "leader": False}
+
+# ссылки на задачи обработчиков NOTIFY: без них задачу может собрать GC
+_listen_tasks: set[asyncio.Task] = set()
+
+META_SQL = """
+CREATE TABLE IF NOT EXISTS app_meta(
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+
+def worker_share(total: float, minimum: float = 1) -> float:
+  # доля общего бюджета (соединения, лимиты) на один воркер
+  return max(minimum, total / WEB_CONCURRENCY)
+
+
+def schema_hash(*parts: str) -> str:
+  return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+@asynccontextmanager
+async def schema_lock(conn, ddl_hash: str):
+  # yield True — этот воркер должен применить DDL; остальные ждут на локе и пропускают
+  await conn.execute("SELECT pg_advisory_lock($1)", LOCK_SCHEMA)
+  try:
+    await conn.execute(META_SQL)
+    applied = await conn.fetchval("SELECT value FROM app_meta WHERE key='schema_hash'")
+    yield applied != ddl_hash
+    if applied != ddl_hash:
+      await conn.execute(
+        "INSERT INTO app_meta(key, value) VALUES('schema_hash', $1) "
+        "ON CONFLICT(key) DO UPDATE SET value=EXCLUDED.value, updated_at=now()",
+        ddl_hash
+      )
+  finally:
+    await conn.execute("SELECT pg_advisory_unlock($1)", LOCK_SCHEMA)
+
+
+async def run_leader(connect: Callable[[], Awaitable[Any]], tasks: list[Callable[[], Awaitable[None]]]):
+  # пока держим lock — крутим задачи лидера; потеряли соединение — гасим их и пробуем снова
+  while True:
+    conn = None
+    running: list[asyncio.Task] = []
+    try:
+      conn = await connect()
+      while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", LOCK_LEADER):
+        await asyncio.sleep(LEADER_RETRY_SECONDS)
+      state["leader"] = True
+      log.info("worker %s is leader", state["pid"])
+      running = [asyncio.create_task(t()) for t in tasks]
+      while True:
+        await asyncio.sleep(LEADER_RETRY_SECONDS)
+        await conn.fetchval("SELECT 1")
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      log.exception("leader connection lost")
+    finally:
+      state["leader"] = False
+      for t in running:
+        t.cancel()
+      if conn is not None:
+        try:
+          await conn.close()
+        except Exception:
+          pass
+    await asyncio.sleep(LEADER_RETRY_SECONDS)
+
+
+async def listen(connect: Callable[[], Awaitable[Any]], channel: str, on_message: Callable[[str], Awaitable[None]]):
+  # выделенное соединение под LISTEN; при обрыве переподключаемся
+  async def _handle(payload: str):
+    try:
+      await on_message(payload)
+    except Exception:
+      log.exception("%s handler failed: %s", channel, payload)
+
+  def _cb(conn, pid, chan, payload):
+    t = asyncio.get_running_loop().create_task(_handle(payload))
+    _listen_tasks.add(t)
+    t.add_done_callback(_listen_tasks.discard)
+
+  while True:
+    conn = None
+    try:
+      conn = await connect()
+      await conn.add_listener(channel, _cb)
+      while True:
+        await asyncio.sleep(LEADER_RETRY_SECONDS)
+        await conn.fetchval("SELECT 1")
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      log.exception("listen %s connection lost", channel)
+    finally:
+      if conn is not None:
+        try:
+          await conn.close()
+        except Exception:
+          pass
+    await asyncio.sleep(LEADER_RETRY_SECONDS)
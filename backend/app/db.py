@@ -0,0 +1,78 @@
+import os, asyncio, logging
+from typing import Any
+
+from . import coord, tracing
+
+# Прогрев пула asyncpg: при старте открываем DB_WARMUP_CONNECTIONS соединений, и каждое новое
+# соединение (init-хук пула) сразу готовит горячие запросы — разбор/план/типы (geography и т.п.)
+# попадают в кэш statement'ов asyncpg до первого живого запроса.
+# Подготовка = выполнение: чтения — с аргументами, дающими пустой результат,
+# записи — внутри транзакции, которая откатывается.
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE","4"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE","10"))
+# общий бюджет соединений на все воркеры; у воркера кроме пула ещё 2 служебных (лидер, LISTEN)
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET","0"))
+if DB_CONNECTION_BUDGET:
+  DB_POOL_MAX_SIZE = int(coord.worker_share(DB_CONNECTION_BUDGET, 4)) - 2
+DB_POOL_MIN_SIZE = min(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE)
+DB_WARMUP_CONNECTIONS = int(os.getenv("DB_WARMUP_CONNECTIONS", str(DB_POOL_MIN_SIZE)))
+# строка подключения для CLI и пула users: DB_DSN или POSTGRES_*
+DB_DSN = os.getenv("DB_DSN","")
+POSTGRES_HOST = os.getenv("POSTGRES_HOST","postgres")
+POSTGRES_PORT = int(os.getenv("POSTGRES_PORT","5432"))
+POSTGRES_DB = os.getenv("POSTGRES_DB","taxi")
+POSTGRES_USER = os.getenv("POSTGRES_USER","taxi")
+POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD","")
+
+log = logging.getLogger("taxi.db")
+
+_hot_reads: list[tuple[str, tuple]] = []
+_hot_writes: list[tuple[str, tuple]] = []
+
+state: dict[str, Any] = {"ready": False, "warm_connections": 0, "warm_errors": 0}
+
+
+def dsn() -> str:
+  if DB_DSN:
+    return DB_DSN
+  return f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+
+
+def hot_read(sql: str, *warm_args) -> str:
+  _hot_reads.append((sql, warm_args))
+  return sql
+
+
+def hot_write(sql: str, *warm_args) -> str:
+  _hot_writes.append((sql, warm_args))
+  return sql
+
+
+async def init_connection(conn):
+  if tracing.ENABLED:
+    # спаны запросов — из колбэка asyncpg, без обёрток вокруг каждого execute/fetch
+    conn.add_query_logger(tracing.on_query)
+  try:
+    for sql, args in _hot_reads:
+      await conn.fetch(sql, *args)
+    if _hot_writes:
+      tr = conn.transaction()
+      await tr.start()
+      try:
+        for sql, args in _hot_writes:
+          await conn.execute(sql, *args)
+      finally:
+        await tr.rollback()
+    state["warm_connections"] += 1
+  except Exception:
+    # холодное соединение лучше, чем упавший пул
+    state["warm_errors"] += 1
+    log.exception("connection warmup failed")
+
+
+async def warmup(pool, n: int = DB_WARMUP_CONNECTIONS):
+  # одновременно держим n соединений, чтобы пул их действительно открыл (и прогнал init)
+  n = min(n, pool.get_max_size())
+  conns = await asyncio.gather(*(pool.acquire() for _ in range(n)))
+  for c in conns:
+    await pool.release(c)
@@ -0,0 +1,177 @@
+import os, time, asyncio, logging
+from typing import Any
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial import cKDTree
+
+from . import coord, eta, jsonfast
+
+# Пакетный матчинг: ожидающие заказы (status=0) x онлайн-водители.
+# Малые наборы — венгерский алгоритм по полной матрице ETA,
+# большие — жадно по рёбрам-кандидатам из KD-дерева (k ближайших водителей на заказ).
+DISPATCH_TICK_SECONDS = float(os.getenv("DISPATCH_TICK_SECONDS","5"))  # 0 — выключено
+DISPATCH_TICK_BUDGET_MS = float(os.getenv("DISPATCH_TICK_BUDGET_MS","500"))
+DISPATCH_HUNGARIAN_MAX_CELLS = int(os.getenv("DISPATCH_HUNGARIAN_MAX_CELLS","250000"))
+DISPATCH_CANDIDATES_K = int(os.getenv("DISPATCH_CANDIDATES_K","8"))
+DISPATCH_MAX_ETA_SECONDS = float(os.getenv("DISPATCH_MAX_ETA_SECONDS","1800"))
+DISPATCH_PENDING_MAX_AGE_MINUTES = int(os.getenv("DISPATCH_PENDING_MAX_AGE_MINUTES","60"))
+DRIVER_ONLINE_TTL_SECONDS = int(os.getenv("DRIVER_ONLINE_TTL_SECONDS","60"))
+
+log = logging.getLogger("taxi.dispatch")
+
+PENDING_SQL = """
+SELECT id, extern_id, taxomet_order_id, from_lat, from_lon
+FROM orders
+WHERE status=0 AND from_lat IS NOT NULL AND from_lon IS NOT NULL
+  AND created_at > now() - ($1::text || ' minutes')::interval
+ORDER BY created_at
+LIMIT 5000
+"""
+
+ONLINE_SQL = """
+SELECT driver_id, ST_Y(geom::geometry) AS lat, ST_X(geom::geometry) AS lon
+FROM driver_locations
+WHERE updated_at > now() - ($1::text || ' seconds')::interval
+"""
+
+SNAPSHOT_SQL = """
+INSERT INTO app_meta(key, value) VALUES('dispatch', $1)
+ON CONFLICT(key) DO UPDATE SET value=EXCLUDED.value, updated_at=now()
+"""
+
+state: dict[str, Any] = {
+  "proposals": [],
+  "last": None,
+  "ticks": 0,
+  "errors": 0,
+  "over_budget": 0,
+}
+
+
+def _xyz(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+  # точки на единичной сфере: евклидова близость = близость по дуге
+  la, lo = np.radians(lats), np.radians(lons)
+  return np.column_stack((np.cos(la) * np.cos(lo), np.cos(la) * np.sin(lo), np.sin(la)))
+
+
+def _hungarian(o_lat, o_lon, d_lat, d_lon):
+  dist, cost = eta.eta_matrix(o_lat, o_lon, d_lat, d_lon)
+  big = DISPATCH_MAX_ETA_SECONDS * 10 + 1
+  masked = np.where(cost <= DISPATCH_MAX_ETA_SECONDS, cost, big)
+  rows, cols = linear_sum_assignment(masked)
+  keep = cost[rows, cols] <= DISPATCH_MAX_ETA_SECONDS
+  rows, cols = rows[keep], cols[keep]
+  return rows, cols, dist[rows, cols], cost[rows, cols]
+
+
+def _greedy(o_lat, o_lon, d_lat, d_lon):
+  k = min(DISPATCH_CANDIDATES_K, len(d_lat))
+  tree = cKDTree(_xyz(d_lat, d_lon))
+  _, idx = tree.query(_xyz(o_lat, o_lon), k=k)
+  idx = idx.reshape(len(o_lat), k)
+  oi = np.repeat(np.arange(len(o_lat)), k)
+  di = idx.ravel()
+  dist, cost = eta.eta_pairs(o_lat[oi], o_lon[oi], d_lat[di], d_lon[di])
+
+  order = np.argsort(cost, kind="stable")
+  used_o = np.zeros(len(o_lat), dtype=bool)
+  used_d = np.zeros(len(d_lat), dtype=bool)
+  picked = []
+  for e in order.tolist():
+    if cost[e] > DISPATCH_MAX_ETA_SECONDS:
+      break
+    o, d = oi[e], di[e]
+    if used_o[o] or used_d[d]:
+      continue
+    used_o[o] = used_d[d] = True
+    picked.append(e)
+  picked = np.array(picked, dtype=np.int64)
+  return oi[picked], di[picked], dist[picked], cost[picked]
+
+
+def solve(orders: list, drivers: list) -> tuple[list[dict[str, Any]], str]:
+  if not orders or not drivers:
+    return [], "empty"
+  o_lat = np.array([o["from_lat"] for o in orders], dtype=np.float64)
+  o_lon = np.array([o["from_lon"] for o in orders], dtype=np.float64)
+  d_lat = np.array([d["lat"] for d in drivers], dtype=np.float64)
+  d_lon = np.array([d["lon"] for d in drivers], dtype=np.float64)
+
+  if len(orders) * len(drivers) <= DISPATCH_HUNGARIAN_MAX_CELLS:
+    method = "hungarian"
+    rows, cols, dist, cost = _hungarian(o_lat, o_lon, d_lat, d_lon)
+  else:
+    method = "greedy_kdtree"
+    rows, cols, dist, cost = _greedy(o_lat, o_lon, d_lat, d_lon)
+
+  out = []
+  for r, c, dm, es in zip(rows.tolist(), cols.tolist(), dist.tolist(), cost.tolist()):
+    o = orders[r]
+    out.append({
+      "order_id": o["id"],
+      "extern_id": o["extern_id"],
+      "taxomet_order_id": o["taxomet_order_id"],
+      "driver_id": drivers[c]["driver_id"],
+      "distance_m": int(dm),
+      "eta_seconds": int(es),
+    })
+  out.sort(key=lambda p: p["eta_seconds"])
+  return out, method
+
+
+async def tick(pool):
+  t0 = time.perf_counter()
+  async with pool.acquire() as conn:
+    orders = [dict(r) for r in await conn.fetch(PENDING_SQL, DISPATCH_PENDING_MAX_AGE_MINUTES)]
+    drivers = [dict(r) for r in await conn.fetch(ONLINE_SQL, DRIVER_ONLINE_TTL_SECONDS)] if orders else []
+  t1 = time.perf_counter()
+  # численная часть — в отдельном потоке, event loop не блокируем
+  proposals, method = await asyncio.to_thread(solve, orders, drivers)
+  t2 = time.perf_counter()
+
+  fetch_ms = (t1 - t0) * 1000
+  solve_ms = (t2 - t1) * 1000
+  state["proposals"] = proposals
+  state["ticks"] += 1
+  state["last"] = {
+    "at": time.time(),
+    "method": method,
+    "orders": len(orders),
+    "drivers": len(drivers),
+    "assigned": len(proposals),
+    "fetch_ms": round(fetch_ms, 2),
+    "solve_ms": round(solve_ms, 2),
+  }
+  if fetch_ms + solve_ms > DISPATCH_TICK_BUDGET_MS:
+    state["over_budget"] += 1
+    log.warning("dispatch tick over budget: %s", state["last"])
+  if coord.WEB_CONCURRENCY > 1:
+    # считает только лидер — остальным воркерам снимок через БД
+    async with pool.acquire() as conn:
+      await conn.execute(SNAPSHOT_SQL, jsonfast.dumps({"proposals": proposals, "metrics": metrics()}).decode())
+
+
+async def run(pool):
+  if DISPATCH_TICK_SECONDS <= 0:
+    return
+  while True:
+    try:
+      await tick(pool)
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      state["errors"] += 1
+      log.exception("dispatch tick failed")
+    await asyncio.sleep(DISPATCH_TICK_SECONDS)
+
+
+def metrics() -> dict[str, Any]:
+  return {k: state[k] for k in ("last", "ticks", "errors", "over_budget")}
+
+
+async def snapshot(conn) -> dict[str, Any]:
+  if coord.state["leader"] or coord.WEB_CONCURRENCY == 1:
+    return {"proposals": state["proposals"], "metrics": metrics()}
+  raw = await conn.fetchval("SELECT value FROM app_meta WHERE key='dispatch'")
+  return jsonfast.loads(raw) if raw else {"proposals": [], "metrics": metrics()}
@@ -0,0 +1,44 @@
+import os
+from collections import OrderedDict
+from typing import Optional
+
+# Отпечаток последнего записанного профиля водителя (tg_id, телефон, имя).
+# Пинг координат приходит каждые несколько секунд почти всегда с тем же профилем:
+# если отпечаток не изменился, строку drivers не трогаем (ни мёртвых версий, ни WAL).
+# Кэш свой у каждого воркера; после рестарта первый пинг каждого водителя пишет профиль заново.
+DRIVER_PROFILE_CACHE_MAX = int(os.getenv("DRIVER_PROFILE_CACHE_MAX","100000"))
+
+stats: dict[str, int] = {"written": 0, "skipped": 0, "cached": 0}
+
+_last: OrderedDict[int, tuple] = OrderedDict()
+
+
+def fingerprint(driver_id: int, tg_id: int, phone: Optional[str], name: Optional[str]) -> tuple:
+  # в upsert phone/name через COALESCE: None = «оставить как было»
+  prev = _last.get(driver_id)
+  if prev is not None:
+    phone = prev[1] if phone is None else phone
+    name = prev[2] if name is None else name
+  return (tg_id, phone, name)
+
+
+def unchanged(driver_id: int, fp: tuple) -> bool:
+  if _last.get(driver_id) == fp:
+    _last.move_to_end(driver_id)
+    stats["skipped"] += 1
+    return True
+  return False
+
+
+def remember(driver_id: int, fp: tuple):
+  stats["written"] += 1
+  _last[driver_id] = fp
+  _last.move_to_end(driver_id)
+  if len(_last) > DRIVER_PROFILE_CACHE_MAX:
+    _last.popitem(last=False)
+  stats["cached"] = len(_last)
+
+
+def forget(driver_id: int):
+  _last.pop(driver_id, None)
+  stats["cached"] = len(_last)
@@ -0,0 +1,207 @@
+import os, time, asyncio, hashlib, logging
+from typing import Any, Awaitable, Callable, Optional
+
+from . import coord
+from .users import normalize_phone
+
+# Синхронизация списка водителей с Taxomet (фоновая задача лидера).
+# Каждая строка ростера сводится к хэшу полей; в drivers хранится хэш последней применённой версии.
+# Применяются только изменившиеся строки: COPY во временную таблицу и три set-based запроса
+# (обновить по taxomet_id, привязать по телефону водителя из бота, вставить новых).
+# Водители, пропавшие из ростера, помечаются on_roster=false (не удаляются: на них ссылаются
+# координаты и история). У водителя только из ростера driver_id = -taxomet_id: реальные
+# driver_id из бота — положительные tg_id, пересечений нет. Когда такой водитель начинает
+# слать координаты из бота (своя строка driver_id = tg_id), каждый запуск синхронизации
+# сливает заглушку в строку бота по телефону — независимо от того, менялся ли ростер.
+DRIVER_SYNC_SECONDS = float(os.getenv("DRIVER_SYNC_SECONDS","600"))
+DRIVER_SYNC_TIMEOUT_SECONDS = float(os.getenv("DRIVER_SYNC_TIMEOUT_SECONDS","60"))
+TAXOMET_DRIVERS_PATH = os.getenv("TAXOMET_DRIVERS_PATH","/get_drivers")
+
+STAGE_COLUMNS = ["taxomet_id", "phone", "name", "car", "roster_hash"]
+
+log = logging.getLogger("taxi.driver_sync")
+
+stats: dict[str, Any] = {"runs": 0, "errors": 0, "busy": 0, "last": None}
+
+SCHEMA = """
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS taxomet_id BIGINT;
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS car TEXT;
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS roster_hash TEXT;
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS on_roster BOOLEAN NOT NULL DEFAULT false;
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS roster_synced_at TIMESTAMPTZ;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_drivers_taxomet_id ON drivers(taxomet_id);
+CREATE INDEX IF NOT EXISTS idx_drivers_phone ON drivers(phone);
+"""
+
+STAGE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS driver_sync_stage(
+  taxomet_id BIGINT, phone TEXT, name TEXT, car TEXT, roster_hash TEXT
+) ON COMMIT DROP;
+"""
+
+LOCAL_SQL = "SELECT taxomet_id, roster_hash FROM drivers WHERE taxomet_id IS NOT NULL AND on_roster"
+
+UPDATE_SQL = """
+UPDATE drivers d
+SET phone = COALESCE(s.phone, d.phone), name = COALESCE(s.name, d.name), car = s.car,
+    roster_hash = s.roster_hash, on_roster = true, roster_synced_at = now()
+FROM driver_sync_stage s
+WHERE d.taxomet_id = s.taxomet_id
+"""
+
+# водитель уже писал координаты из бота (driver_id = tg_id), но ещё не связан с Taxomet
+LINK_SQL = """
+WITH m AS (
+  SELECT DISTINCT ON (s.taxomet_id) d.driver_id, s.*
+  FROM driver_sync_stage s
+  JOIN drivers d ON d.phone = s.phone AND d.taxomet_id IS NULL
+  WHERE NOT EXISTS (SELECT 1 FROM drivers x WHERE x.taxomet_id = s.taxomet_id)
+  ORDER BY s.taxomet_id, d.tg_id IS NULL, d.driver_id
+)
+UPDATE drivers d
+SET taxomet_id = m.taxomet_id, phone = COALESCE(m.phone, d.phone), name = COALESCE(m.name, d.name), car = m.car,
+    roster_hash = m.roster_hash, on_roster = true, roster_synced_at = now()
+FROM m
+WHERE d.driver_id = m.driver_id
+"""
+
+INSERT_SQL = """
+INSERT INTO drivers(driver_id, taxomet_id, phone, name, car, roster_hash, on_roster, roster_synced_at)
+SELECT -s.taxomet_id, s.taxomet_id, s.phone, s.name, s.car, s.roster_hash, true, now()
+FROM driver_sync_stage s
+WHERE NOT EXISTS (SELECT 1 FROM drivers x WHERE x.taxomet_id = s.taxomet_id)
+ON CONFLICT (driver_id) DO NOTHING
+"""
+
+# заглушка -taxomet_id + строка бота с тем же телефоном -> одна строка (бота).
+# Пары однозначные: у заглушки — одна строка бота, у строки бота — одна заглушка
+PLACEHOLDERS_SQL = """
+WITH pairs AS (
+  SELECT p.driver_id AS placeholder_id, d.driver_id,
+         row_number() OVER (PARTITION BY p.driver_id ORDER BY d.tg_id IS NULL, d.driver_id) AS p_rank,
+         row_number() OVER (PARTITION BY d.driver_id ORDER BY p.driver_id DESC) AS d_rank
+  FROM drivers p
+  JOIN drivers d ON d.phone = p.phone AND d.taxomet_id IS NULL AND d.driver_id > 0
+  WHERE p.driver_id < 0 AND p.taxomet_id = -p.driver_id
+)
+DELETE FROM drivers p
+USING pairs m
+WHERE p.driver_id = m.placeholder_id AND m.p_rank = 1 AND m.d_rank = 1
+RETURNING m.driver_id, p.taxomet_id, p.name, p.car, p.roster_hash, p.on_roster
+"""
+
+ADOPT_SQL = """
+UPDATE drivers
+SET taxomet_id = $2, name = COALESCE($3, name), car = $4, roster_hash = $5, on_roster = $6, roster_synced_at = now()
+WHERE driver_id = $1
+"""
+
+REMOVE_SQL = """
+UPDATE drivers SET on_roster = false, roster_hash = NULL, roster_synced_at = now()
+WHERE taxomet_id = ANY($1::bigint[]) AND on_roster
+"""
+
+
+def _text(v: Any) -> Optional[str]:
+  if v is None:
+    return None
+  v = str(v).strip()
+  return v or None
+
+
+def _phone(v: Any) -> Optional[str]:
+  try:
+    return normalize_phone(str(v or ""))
+  except ValueError:
+    return None
+
+
+def roster_rows(data: Any) -> list[tuple]:
+  # ответ Taxomet: {"result": 1, "drivers": [...]} (или "data"), либо сразу список
+  if isinstance(data, dict):
+    if "result" in data and str(data.get("result")) != "1":
+      raise RuntimeError(f"taxomet drivers error: {str(data)[:300]}")
+    items = data.get("drivers") if data.get("drivers") is not None else data.get("data")
+  else:
+    items = data
+  if not isinstance(items, list):
+    raise RuntimeError("taxomet drivers: no list in response")
+
+  rows: dict[int, tuple] = {}
+  for it in items:
+    if not isinstance(it, dict):
+      continue
+    raw_id = it.get("driver_id", it.get("id"))
+    try:
+      taxomet_id = int(raw_id)
+    except (TypeError, ValueError):
+      continue
+    phone = _phone(it.get("phone"))
+    name = _text(it.get("name") or it.get("fio"))
+    car = _text(it.get("car") or it.get("auto"))
+    h = hashlib.md5("\x1f".join(x or "" for x in (phone, name, car)).encode()).hexdigest()
+    rows[taxomet_id] = (taxomet_id, phone, name, car, h)
+  return list(rows.values())
+
+
+def _count(status: str) -> int:
+  # статус команды asyncpg: "UPDATE 12" / "INSERT 0 12"
+  try:
+    return int(status.rsplit(" ", 1)[-1])
+  except ValueError:
+    return 0
+
+
+async def sync(pool, fetch: Callable[[], Awaitable[Any]]) -> dict[str, Any]:
+  t0 = time.monotonic()
+  remote = roster_rows(await fetch())
+  fetch_ms = round((time.monotonic() - t0) * 1000, 1)
+
+  rep: dict[str, Any] = {"scanned": len(remote), "changed": 0, "updated": 0, "linked": 0, "inserted": 0,
+                         "merged": 0, "removed": 0, "fetch_ms": fetch_ms}
+  async with pool.acquire() as conn:
+    async with conn.transaction():
+      # ручной запуск с другого воркера не пересекается с плановым
+      if not await conn.fetchval("SELECT pg_try_advisory_xact_lock($1)", coord.LOCK_DRIVER_SYNC):
+        stats["busy"] += 1
+        return {"ok": False, "busy": True}
+      local = {r["taxomet_id"]: r["roster_hash"] for r in await conn.fetch(LOCAL_SQL)}
+      changed = [r for r in remote if local.get(r[0]) != r[4]]
+      # пустой ростер — скорее сбой на стороне Taxomet, чем увольнение всего парка
+      removed = list(local.keys() - {r[0] for r in remote}) if remote else []
+      rep["changed"] = len(changed)
+      if changed:
+        await conn.execute(STAGE_SQL)
+        await conn.copy_records_to_table("driver_sync_stage", records=changed, columns=STAGE_COLUMNS)
+        rep["updated"] = _count(await conn.execute(UPDATE_SQL))
+        rep["linked"] = _count(await conn.execute(LINK_SQL))
+        rep["inserted"] = _count(await conn.execute(INSERT_SQL))
+      # заглушки — до пометки пропавших: removed считается по taxomet_id, а он переезжает
+      adopted = await conn.fetch(PLACEHOLDERS_SQL)
+      if adopted:
+        await conn.executemany(ADOPT_SQL, [tuple(r) for r in adopted])
+      rep["merged"] = len(adopted)
+      if removed:
+        rep["removed"] = _count(await conn.execute(REMOVE_SQL, removed))
+
+  rep["duration_ms"] = round((time.monotonic() - t0) * 1000, 1)
+  rep["at"] = int(time.time())
+  stats["runs"] += 1
+  stats["last"] = rep
+  return {"ok": True, **rep}
+
+
+async def run(pool, fetch: Callable[[], Awaitable[Any]]):
+  if DRIVER_SYNC_SECONDS <= 0:
+    return
+  while True:
+    try:
+      rep = await sync(pool, fetch)
+      if rep.get("changed") or rep.get("removed") or rep.get("merged"):
+        log.info("driver roster sync: %s", rep)
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      stats["errors"] += 1
+      log.exception("driver roster sync failed")
+    await asyncio.sleep(DRIVER_SYNC_SECONDS)
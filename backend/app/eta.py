@@ -0,0 +1,97 @@
+import os, json, time
+from typing import Any, Optional
+
+import numpy as np
+
+# Оценка времени подачи: гаверсинус (векторно, NumPy) * коэффициент извилистости дорог / скорость.
+# Зоны — JSON-список: [{"name":"pkc","lat":53.02,"lon":158.65,"radius_m":15000,"road_factor":1.4,"speed_kmh":28}, ...]
+ETA_ROAD_FACTOR = float(os.getenv("ETA_ROAD_FACTOR","1.35"))
+ETA_SPEED_KMH = float(os.getenv("ETA_SPEED_KMH","30"))
+ETA_AREAS = json.loads(os.getenv("ETA_AREAS","") or "[]")
+ETA_CACHE_TTL_SECONDS = float(os.getenv("ETA_CACHE_TTL_SECONDS","3"))
+# ячейка кэша ~ 0.002° (~200 м по широте)
+ETA_CACHE_CELL_DEG = float(os.getenv("ETA_CACHE_CELL_DEG","0.002"))
+ETA_CACHE_MAX_ENTRIES = int(os.getenv("ETA_CACHE_MAX_ENTRIES","5000"))
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat1, lon1, lat2, lon2) -> np.ndarray:
+  # всё в градусах; массивы любой совместимой формы (broadcasting)
+  lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+  a = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2
+  return 2.0 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def area_model(lat: float, lon: float) -> tuple[float, float]:
+  # (road_factor, speed м/с) для зоны точки подачи; первая подходящая зона
+  for a in ETA_AREAS:
+    d = float(haversine_m(lat, lon, a["lat"], a["lon"]))
+    if d <= float(a.get("radius_m", 0)):
+      return float(a.get("road_factor", ETA_ROAD_FACTOR)), float(a.get("speed_kmh", ETA_SPEED_KMH)) / 3.6
+  return ETA_ROAD_FACTOR, ETA_SPEED_KMH / 3.6
+
+
+def eta_seconds(pickup_lat: float, pickup_lon: float, lats, lons) -> tuple[np.ndarray, np.ndarray]:
+  # -> (distance_m, eta_s) для всех кандидатов одним проходом
+  factor, speed = area_model(pickup_lat, pickup_lon)
+  dist = haversine_m(pickup_lat, pickup_lon, lats, lons)
+  return dist, dist * factor / speed
+
+
+########################
+# Кэш по ячейке точки подачи
+########################
+_cache: dict[tuple, tuple[float, Any]] = {}
+
+
+def cell_key(lat: float, lon: float, *extra) -> tuple:
+  return (round(lat / ETA_CACHE_CELL_DEG), round(lon / ETA_CACHE_CELL_DEG)) + extra
+
+
+def cell_center(lat: float, lon: float) -> tuple[float, float]:
+  return round(lat / ETA_CACHE_CELL_DEG) * ETA_CACHE_CELL_DEG, round(lon / ETA_CACHE_CELL_DEG) * ETA_CACHE_CELL_DEG
+
+
+def cell_margin_m() -> float:
+  # от любой точки ячейки до её центра не дальше полудиагонали (градус долготы не длиннее широты)
+  return ETA_CACHE_CELL_DEG * 0.5 * 111320.0 * 2 ** 0.5 * 1.01
+
+
+def cache_get(key: tuple) -> Optional[Any]:
+  hit = _cache.get(key)
+  if hit and hit[0] > time.monotonic():
+    return hit[1]
+  return None
+
+
+def cache_put(key: tuple, value: Any):
+  now = time.monotonic()
+  if len(_cache) >= ETA_CACHE_MAX_ENTRIES:
+    for k in [k for k, (exp, _) in _cache.items() if exp <= now]:
+      del _cache[k]
+    if len(_cache) >= ETA_CACHE_MAX_ENTRIES:
+      _cache.clear()
+  _cache[key] = (now + ETA_CACHE_TTL_SECONDS, value)
+
+
+def _sec_per_meter(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+  # road_factor / speed для каждой точки подачи
+  model = np.array([area_model(a, b) for a, b in zip(lats.tolist(), lons.tolist())], dtype=np.float64).reshape(-1, 2)
+  return model[:, 0] / model[:, 1]
+
+
+def eta_matrix(o_lats, o_lons, d_lats, d_lons) -> tuple[np.ndarray, np.ndarray]:
+  # заказы x водители: (distance_m, eta_s)
+  o_lats = np.asarray(o_lats, dtype=np.float64)
+  o_lons = np.asarray(o_lons, dtype=np.float64)
+  dist = haversine_m(o_lats[:, None], o_lons[:, None], np.asarray(d_lats)[None, :], np.asarray(d_lons)[None, :])
+  return dist, dist * _sec_per_meter(o_lats, o_lons)[:, None]
+
+
+def eta_pairs(o_lats, o_lons, d_lats, d_lons) -> tuple[np.ndarray, np.ndarray]:
+  # то же для пар одинаковой длины (кандидаты из пространственного индекса)
+  o_lats = np.asarray(o_lats, dtype=np.float64)
+  o_lons = np.asarray(o_lons, dtype=np.float64)
+  dist = haversine_m(o_lats, o_lons, d_lats, d_lons)
+  return dist, dist * _sec_per_meter(o_lats, o_lons)
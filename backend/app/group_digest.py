@@ -0,0 +1,115 @@
+import os, asyncio, logging
+from typing import Any, Optional
+
+from . import tg
+
+# Уведомления в группы (TG_NOTIFY_GROUP_ID, TG_ADMIN_GROUP_ID) копятся в окне GROUP_DIGEST_SECONDS
+# и уходят одним сообщением-дайджестом на группу (Telegram режет группы на ~20 сообщений в минуту).
+# События с ключом (например, статус заказа) в пределах окна заменяют друг друга — в дайджест
+# попадает последнее. Срочные события отправляются сразу, мимо окна.
+# Очередь общая для всех воркеров — таблица group_digest_queue; дайджест собирает и отправляет только
+# лидер (coord.run_leader), иначе группа получала бы по дайджесту от каждого воркера.
+GROUP_DIGEST_SECONDS = float(os.getenv("GROUP_DIGEST_SECONDS","30"))  # 0 — без батчинга
+GROUP_DIGEST_MAX_EVENTS = int(os.getenv("GROUP_DIGEST_MAX_EVENTS","500"))
+TG_MESSAGE_LIMIT = 4096
+
+log = logging.getLogger("taxi.group_digest")
+
+# pos — место в дайджесте: у события с ключом обновляется вместе с текстом (в конец).
+# У событий без ключа key NULL — уникальный индекс их не склеивает
+SCHEMA = """
+CREATE SEQUENCE IF NOT EXISTS group_digest_pos;
+CREATE TABLE IF NOT EXISTS group_digest_queue(
+  id BIGSERIAL PRIMARY KEY,
+  chat_id BIGINT NOT NULL,
+  key TEXT,
+  text TEXT NOT NULL,
+  pos BIGINT NOT NULL DEFAULT nextval('group_digest_pos')
+);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_group_digest_queue_key ON group_digest_queue(chat_id, key);
+"""
+
+ADD_SQL = """
+INSERT INTO group_digest_queue(chat_id, key, text) VALUES($1, $2, $3)
+ON CONFLICT (chat_id, key) DO UPDATE SET text = EXCLUDED.text, pos = nextval('group_digest_pos')
+RETURNING (xmax = 0) AS inserted
+"""
+
+TAKE_SQL = "DELETE FROM group_digest_queue RETURNING chat_id, text, pos"
+
+RETURN_SQL = "INSERT INTO group_digest_queue(chat_id, text, pos) VALUES($1, $2, $3)"
+
+_urgent: set[asyncio.Task] = set()
+stats: dict[str, Any] = {"events": 0, "urgent": 0, "replaced": 0, "dropped": 0, "digests": 0, "messages": 0, "failed": 0}
+
+
+async def add(conn, chat_id: int, text: str, key: Optional[str] = None, urgent: bool = False):
+  if not chat_id:
+    return
+  stats["events"] += 1
+  if urgent or GROUP_DIGEST_SECONDS <= 0:
+    stats["urgent"] += 1
+    t = asyncio.get_running_loop().create_task(tg.send(chat_id, text[:TG_MESSAGE_LIMIT]))
+    _urgent.add(t)
+    t.add_done_callback(_urgent.discard)
+    return
+  if not await conn.fetchval(ADD_SQL, chat_id, key, text):
+    stats["replaced"] += 1
+
+
+def split(entries: list[str], limit: int = TG_MESSAGE_LIMIT) -> list[str]:
+  # режем по границам событий; событие длиннее лимита — по символам
+  out: list[str] = []
+  cur = ""
+  for e in entries:
+    while len(e) > limit:
+      if cur:
+        out.append(cur)
+        cur = ""
+      out.append(e[:limit])
+      e = e[limit:]
+    if cur and len(cur) + 2 + len(e) > limit:
+      out.append(cur)
+      cur = ""
+    cur = f"{cur}\n\n{e}" if cur else e
+  if cur:
+    out.append(cur)
+  return out
+
+
+async def flush(pool):
+  async with pool.acquire() as conn:
+    rows = await conn.fetch(TAKE_SQL)
+  queues: dict[int, list] = {}
+  for r in sorted(rows, key=lambda r: r["pos"]):
+    queues.setdefault(r["chat_id"], []).append(r)
+  for chat_id, q in queues.items():
+    if len(q) > GROUP_DIGEST_MAX_EVENTS:
+      stats["dropped"] += len(q) - GROUP_DIGEST_MAX_EVENTS
+      q = q[-GROUP_DIGEST_MAX_EVENTS:]
+    stats["digests"] += 1
+    parts = split([r["text"] for r in q])
+    for i, part in enumerate(parts):
+      if await tg.send(chat_id, part):
+        stats["messages"] += 1
+        continue
+      # не ушло (лимит/сеть) — неотправленный хвост вернётся в начало следующего дайджеста
+      stats["failed"] += 1
+      first = q[0]["pos"]
+      async with pool.acquire() as conn:
+        await conn.executemany(RETURN_SQL, [(chat_id, parts[j], first - (len(parts) - j)) for j in range(i, len(parts))])
+      break
+
+
+async def run(pool):
+  # задача лидера
+  if GROUP_DIGEST_SECONDS <= 0:
+    return
+  while True:
+    await asyncio.sleep(GROUP_DIGEST_SECONDS)
+    try:
+      await flush(pool)
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      log.exception("group digest flush failed")
@@ -0,0 +1,139 @@
+import os, time, asyncio, logging
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+# История координат водителей: таблица, секционированная по суткам (UTC).
+# Пинги копятся в памяти и пишутся пачками через COPY; ретеншн — DROP целых секций.
+HISTORY_FLUSH_SECONDS = float(os.getenv("HISTORY_FLUSH_SECONDS","2"))
+HISTORY_FLUSH_ROWS = int(os.getenv("HISTORY_FLUSH_ROWS","2000"))
+HISTORY_BUFFER_MAX = int(os.getenv("HISTORY_BUFFER_MAX","200000"))
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS","30"))
+HISTORY_PARTITIONS_AHEAD = int(os.getenv("HISTORY_PARTITIONS_AHEAD","2"))
+HISTORY_MAINTENANCE_SECONDS = float(os.getenv("HISTORY_MAINTENANCE_SECONDS","3600"))
+
+TABLE = "driver_location_history"
+COLUMNS = ["driver_id", "ts", "lat", "lon"]
+
+log = logging.getLogger("taxi.history")
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {TABLE}(
+  driver_id BIGINT NOT NULL,
+  ts TIMESTAMPTZ NOT NULL,
+  lat DOUBLE PRECISION NOT NULL,
+  lon DOUBLE PRECISION NOT NULL
+) PARTITION BY RANGE (ts);
+CREATE INDEX IF NOT EXISTS idx_dlh_driver_ts ON {TABLE}(driver_id, ts);
+"""
+
+PARTITIONS_SQL = """
+SELECT c.relname
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+JOIN pg_class p ON p.oid = i.inhparent
+WHERE p.relname = $1
+"""
+
+# границы по ts дают partition pruning: читаются только секции нужных суток
+TRACK_SQL = f"""
+SELECT ts, lat, lon
+FROM {TABLE}
+WHERE driver_id=$1 AND ts >= $2 AND ts < $3
+ORDER BY ts
+LIMIT $4
+"""
+
+_rows: list[tuple] = []
+stats: dict[str, Any] = {"buffered": 0, "flushed": 0, "dropped": 0, "flushes": 0, "last_flush_ms": None}
+
+
+def _part_name(day: datetime) -> str:
+  return f"{TABLE}_p{day:%Y%m%d}"
+
+
+async def ensure_schema(conn):
+  await conn.execute(SCHEMA)
+  await ensure_partitions(conn)
+
+
+async def ensure_partitions(conn):
+  today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+  for i in range(-1, HISTORY_PARTITIONS_AHEAD + 1):
+    day = today + timedelta(days=i)
+    await conn.execute(
+      f"CREATE TABLE IF NOT EXISTS {_part_name(day)} PARTITION OF {TABLE} "
+      f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+    )
+
+
+async def drop_expired(conn) -> list[str]:
+  cutoff = (datetime.now(timezone.utc) - timedelta(days=HISTORY_RETENTION_DAYS)).strftime("%Y%m%d")
+  dropped = []
+  for r in await conn.fetch(PARTITIONS_SQL, TABLE):
+    name = r["relname"]
+    suffix = name.rsplit("_p", 1)[-1]
+    if suffix.isdigit() and suffix < cutoff:
+      await conn.execute(f"DROP TABLE IF EXISTS {name}")
+      dropped.append(name)
+  return dropped
+
+
+def add(driver_id: int, lat: float, lon: float):
+  if len(_rows) >= HISTORY_BUFFER_MAX:
+    # БД недоступна долго — теряем самые старые точки, а не память
+    del _rows[:HISTORY_FLUSH_ROWS]
+    stats["dropped"] += HISTORY_FLUSH_ROWS
+  _rows.append((driver_id, datetime.now(timezone.utc), lat, lon))
+  stats["buffered"] = len(_rows)
+
+
+async def flush(pool):
+  global _rows
+  if not _rows:
+    return
+  batch, _rows = _rows, []
+  t0 = time.perf_counter()
+  try:
+    async with pool.acquire() as conn:
+      try:
+        await conn.copy_records_to_table(TABLE, records=batch, columns=COLUMNS)
+      except Exception:
+        # например, полночь и секции на новые сутки ещё нет
+        await ensure_partitions(conn)
+        await conn.copy_records_to_table(TABLE, records=batch, columns=COLUMNS)
+  except Exception:
+    log.exception("history flush failed, %d rows returned to buffer", len(batch))
+    _rows = batch + _rows
+    stats["buffered"] = len(_rows)
+    return
+  stats["flushed"] += len(batch)
+  stats["flushes"] += 1
+  stats["last_flush_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+  stats["buffered"] = len(_rows)
+
+
+async def run_flusher(pool):
+  while True:
+    deadline = time.monotonic() + HISTORY_FLUSH_SECONDS
+    while time.monotonic() < deadline and len(_rows) < HISTORY_FLUSH_ROWS:
+      await asyncio.sleep(0.1)
+    await flush(pool)
+
+
+async def run_maintenance(pool):
+  while True:
+    try:
+      async with pool.acquire() as conn:
+        await ensure_partitions(conn)
+        dropped = await drop_expired(conn)
+      if dropped:
+        log.info("history partitions dropped: %s", dropped)
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      log.exception("history maintenance failed")
+    await asyncio.sleep(HISTORY_MAINTENANCE_SECONDS)
+
+
+async def track(conn, driver_id: int, since: datetime, until: datetime, limit: int):
+  return await conn.fetch(TRACK_SQL, driver_id, since, until, limit)
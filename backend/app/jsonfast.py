@@ -0,0 +1,41 @@
+import decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse, Response
+
+# Быстрая сериализация: orjson вместо jsonable_encoder + stdlib json.
+# Горячие обработчики возвращают FastJSONResponse/raw() напрямую — так FastAPI
+# не прогоняет ответ через jsonable_encoder.
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(o):
+  if isinstance(o, decimal.Decimal):
+    return float(o)
+  raise TypeError
+
+
+def dumps(obj: Any) -> bytes:
+  return orjson.dumps(obj, default=_default, option=OPTIONS)
+
+
+loads = orjson.loads
+
+
+class FastJSONResponse(ORJSONResponse):
+  def render(self, content: Any) -> bytes:
+    return dumps(content)
+
+
+def raw(body: bytes, status_code: int = 200) -> Response:
+  # уже готовый JSON (ответ апстрима, кэш) — без разбора и повторной сборки
+  return Response(content=body, status_code=status_code, media_type="application/json")
+
+
+def records(rows) -> list[dict[str, Any]]:
+  # asyncpg Record -> dict: ключи берём один раз, значения — кортежем
+  if not rows:
+    return []
+  keys = tuple(rows[0].keys())
+  return [dict(zip(keys, r.values())) for r in rows]
@@ -1,13 +1,17 @@
-import os, json, uuid
+import os, json, uuid, asyncio, base64, inspect
+from datetime import datetime, timedelta, timezone
 from typing import Any, Optional
 
 import asyncpg
 import httpx
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, HTTPException, BackgroundTasks, Query
+from fastapi.responses import PlainTextResponse, Response
 from pydantic import BaseModel
 
+from . import active_orders, addresses, admission, coord, db, dispatch, driver_profiles, driver_sync, eta, history, jsonfast, group_digest, nearby_feed, order_status, osm, ratelimit, tg, tracing, vk_events
+from . import users
 from .users import router as users_router
+from .jsonfast import FastJSONResponse
 
 ENV = os.getenv("ENV", "prod")
 
@@ -28,10 +32,15 @@ GEO_TILES_STYLE_URL = os.getenv("GEO_TILES_STYLE_URL","")
 # Nearby
 DRIVER_ONLINE_TTL_SECONDS = int(os.getenv("DRIVER_ONLINE_TTL_SECONDS","60"))
 NEARBY_RADIUS_METERS = int(os.getenv("NEARBY_RADIUS_METERS","5"))
+# верхняя граница radius_m: дальше лента бессмысленна, а packed-заголовок держит только u32
+NEARBY_RADIUS_MAX_METERS = int(os.getenv("NEARBY_RADIUS_MAX_METERS","50000"))
 
 # Groups
 TG_ADMIN_GROUP_ID = int(os.getenv("TG_ADMIN_GROUP_ID","0"))
 TG_NOTIFY_GROUP_ID = int(os.getenv("TG_NOTIFY_GROUP_ID","0"))
+# что уходит в группы сразу, мимо дайджеста
+GROUP_URGENT_STATUSES = [int(x) for x in os.getenv("GROUP_URGENT_STATUSES","").split(",") if x.strip()]
+GROUP_URGENT_NEW_ORDERS = os.getenv("GROUP_URGENT_NEW_ORDERS","0") == "1"
 
 # Taxomet
 TAXOMET_BASE_URL = os.getenv("TAXOMET_BASE_URL","").rstrip("/")
@@ -41,12 +50,15 @@ TAXOMET_UNIT_ID = os.getenv("TAXOMET_UNIT_ID","1")
 TAXOMET_TARIF_ID = os.getenv("TAXOMET_TARIF_ID","-1")
 TAXOMET_WEBHOOK_SECRET = os.getenv("TAXOMET_WEBHOOK_SECRET","")
 
-# VK (задел)
+# VK
 VK_CONFIRMATION = os.getenv("VK_CONFIRMATION","")
 VK_SECRET = os.getenv("VK_SECRET","")
 
-app = FastAPI(title="Taxi Backend", version="1.0.0")
+app = FastAPI(title="Taxi Backend", version="1.0.0", default_response_class=FastJSONResponse)
 app.include_router(users_router)
+app.add_middleware(ratelimit.RateLimitMiddleware)
+# внешним: отказы лимитера тоже попадают в трассу
+app.add_middleware(tracing.TracingMiddleware)
 
 
 def must_internal(request: Request):
@@ -56,53 +68,44 @@ def must_internal(request: Request):
     raise HTTPException(status_code=401, detail="internal token invalid")
 
 
-async def _ensure_users_schema(pool):
+async def _ensure_users_schema(conn):
     # устойчиво: минимальный CREATE + ALTER + индексы
-    async with pool.acquire() as conn:
-        await conn.execute("CREATE TABLE IF NOT EXISTS users (id BIGSERIAL PRIMARY KEY);")
-
-        # columns (NULL допустимы)
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS tg_id BIGINT;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS vk_id BIGINT;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS phone VARCHAR(32);")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS full_name TEXT;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS role VARCHAR(16);")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ DEFAULT now();")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT now();")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS ui_chat_id BIGINT;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS ui_message_id BIGINT;")
-
-
-        # ВАЖНО:
-        # раньше могли быть partial unique indexes с WHERE ... — они НЕ подходят для ON CONFLICT (tg_id)/(vk_id).
-        # Поэтому: DROP + CREATE нормальных UNIQUE по tg_id/vk_id (NULL'ов может быть много — это норм).
-        await conn.execute("DROP INDEX IF EXISTS uq_users_tg_id;")
-        await conn.execute("DROP INDEX IF EXISTS uq_users_vk_id;")
-
-        await conn.execute("CREATE UNIQUE INDEX uq_users_tg_id ON users(tg_id);")
-        await conn.execute("CREATE UNIQUE INDEX uq_users_vk_id ON users(vk_id);")
-
-        # обычные индексы (опционально)
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_tg_id ON users(tg_id);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_vk_id ON users(vk_id);")
-
-async def tg_send(chat_id: int, text: str):
-  if not TG_BOT_TOKEN or not chat_id:
-    return
-  url = f"https://api.telegram.org/bot{TG_BOT_TOKEN}/sendMessage"
-  payload = {"chat_id": chat_id, "text": text, "disable_web_page_preview": True}
-  try:
-    async with httpx.AsyncClient(timeout=15) as client:
-      await client.post(url, json=payload)
-  except Exception:
-    return
-
-
-async def taxomet_get(path: str, params: dict[str, Any]) -> dict[str, Any]:
+    await conn.execute("CREATE TABLE IF NOT EXISTS users (id BIGSERIAL PRIMARY KEY);")
+
+    # columns (NULL допустимы)
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS tg_id BIGINT;")
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS vk_id BIGINT;")
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS phone VARCHAR(32);")
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS full_name TEXT;")
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS username TEXT;")
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS role VARCHAR(16);")
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ DEFAULT now();")
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT now();")
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS ui_chat_id BIGINT;")
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS ui_message_id BIGINT;")
+
+
+    # ВАЖНО:
+    # раньше могли быть partial unique indexes с WHERE ... — они НЕ подходят для ON CONFLICT (tg_id)/(vk_id).
+    # Поэтому: DROP + CREATE нормальных UNIQUE по tg_id/vk_id (NULL'ов может быть много — это норм).
+    await conn.execute("DROP INDEX IF EXISTS uq_users_tg_id;")
+    await conn.execute("DROP INDEX IF EXISTS uq_users_vk_id;")
+
+    await conn.execute("CREATE UNIQUE INDEX uq_users_tg_id ON users(tg_id);")
+    await conn.execute("CREATE UNIQUE INDEX uq_users_vk_id ON users(vk_id);")
+
+    # обычные индексы (опционально)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_tg_id ON users(tg_id);")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_vk_id ON users(vk_id);")
+
+async def taxomet_get(path: str, params: dict[str, Any], timeout: float = 30) -> dict[str, Any]:
   if not TAXOMET_BASE_URL:
     raise HTTPException(status_code=500, detail="TAXOMET_BASE_URL not set")
-  async with httpx.AsyncClient(timeout=30) as client:
-    r = await client.get(f"{TAXOMET_BASE_URL}{path}", params=params)
+  async with httpx.AsyncClient(timeout=timeout) as client:
+    with tracing.span(f"taxomet{path}", "client", **{"http.path": path}) as s:
+      r = await client.get(f"{TAXOMET_BASE_URL}{path}", params=params)
+      if s:
+        s.set(**{"http.status": r.status_code})
     r.raise_for_status()
     try:
       return r.json()
@@ -110,6 +113,14 @@ async def taxomet_get(path: str, params: dict[str, Any]) -> dict[str, Any]:
       return {"raw": r.text}
 
 
+async def _taxomet_drivers() -> dict[str, Any]:
+  return await taxomet_get(driver_sync.TAXOMET_DRIVERS_PATH, {
+    "operator_login": TAXOMET_OPERATOR_LOGIN,
+    "operator_password": TAXOMET_OPERATOR_PASSWORD,
+    "unit_id": TAXOMET_UNIT_ID,
+  }, timeout=driver_sync.DRIVER_SYNC_TIMEOUT_SECONDS)
+
+
 SCHEMA = """
 CREATE EXTENSION IF NOT EXISTS postgis;
 
@@ -152,18 +163,106 @@ CREATE TABLE IF NOT EXISTS orders(
   updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 CREATE INDEX IF NOT EXISTS idx_orders_taxomet ON orders(taxomet_order_id);
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS from_lat DOUBLE PRECISION;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS from_lon DOUBLE PRECISION;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS vk_user_id BIGINT;
+CREATE INDEX IF NOT EXISTS idx_orders_pending ON orders(created_at) WHERE status=0;
+
+-- списки заказов: keyset (created_at, id), страница дочитывается из heap (<= 100 строк).
+-- Без INCLUDE: from_address — неограниченный текст (длинный адрес не влезет в btree-кортеж
+-- и уронит INSERT уже созданного в Taxomet заказа), а status/driver_id/fix_price меняет вебхук —
+-- в индексе они лишают эти UPDATE'ы HOT. Фильтр status = ANY(...) — по heap.
+DROP INDEX IF EXISTS idx_orders_user_page;
+DROP INDEX IF EXISTS idx_orders_page;
+DROP INDEX IF EXISTS idx_orders_status_page;
+CREATE INDEX IF NOT EXISTS idx_orders_user_keyset ON orders(tg_user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_keyset ON orders(created_at DESC, id DESC);
 """
 
 
+DDL_HASH = coord.schema_hash(
+  SCHEMA, order_status.SCHEMA, group_digest.SCHEMA, driver_sync.SCHEMA, addresses.SCHEMA, osm.SCHEMA, history.SCHEMA,
+  inspect.getsource(_ensure_users_schema)
+)
+
+
+async def _connect():
+  return await asyncpg.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS)
+
+
+async def _on_order_changed(extern_id: str):
+  async with app.state.pool.acquire() as conn:
+    await active_orders.reload(conn, extern_id)
+
+
+async def _publish_order(conn, extern_id: str):
+  # остальные воркеры обновят свою read-модель активных заказов
+  if coord.WEB_CONCURRENCY > 1:
+    await conn.execute("SELECT pg_notify($1, $2)", coord.ORDERS_CHANNEL, extern_id)
+
+
 @app.on_event("startup")
 async def startup():
+  # DDL — отдельным соединением до создания пула: init-хук пула готовит запросы к уже существующим таблицам.
+  # Воркеры стартуют одновременно: DDL применяет один (под advisory lock), остальные — только если схема поменялась
+  conn = await _connect()
+  try:
+    async with coord.schema_lock(conn, DDL_HASH) as apply_ddl:
+      if apply_ddl:
+        await conn.execute(SCHEMA)
+        await conn.execute(order_status.SCHEMA)
+        await conn.execute(group_digest.SCHEMA)
+        await conn.execute(driver_sync.SCHEMA)
+        await addresses.ensure_schema(conn)
+        await osm.ensure_schema(conn)
+        await history.ensure_schema(conn)
+        await _ensure_users_schema(conn)
+      else:
+        await history.ensure_partitions(conn)
+  finally:
+    await conn.close()
+
   app.state.pool = await asyncpg.create_pool(
     host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS,
-    min_size=1, max_size=10
+    min_size=db.DB_POOL_MIN_SIZE, max_size=db.DB_POOL_MAX_SIZE, init=db.init_connection
   )
+  # один пул на воркер — users работает через него же
+  users.set_pool(app.state.pool)
+  await db.warmup(app.state.pool)
   async with app.state.pool.acquire() as conn:
-    await conn.execute(SCHEMA)
-  await _ensure_users_schema(app.state.pool)
+    await active_orders.load(conn)
+  # общий клиент с keep-alive к геокодеру (без TLS-рукопожатия на каждый запрос)
+  app.state.geo_client = httpx.AsyncClient(timeout=20)
+  pool = app.state.pool
+  app.state.tasks = [
+    # буфер истории у каждого воркера свой
+    asyncio.create_task(history.run_flusher(pool)),
+    asyncio.create_task(vk_events.run()),
+    asyncio.create_task(tracing.run()),
+    asyncio.create_task(active_orders.run()),
+    # задачи в одном экземпляре на все воркеры
+    asyncio.create_task(coord.run_leader(_connect, [
+      lambda: dispatch.run(pool),
+      lambda: history.run_maintenance(pool),
+      lambda: order_status.run(pool),
+      lambda: group_digest.run(pool),
+    ] + ([lambda: driver_sync.run(pool, _taxomet_drivers)] if TAXOMET_BASE_URL else []))),
+  ]
+  if coord.WEB_CONCURRENCY > 1:
+    app.state.tasks.append(asyncio.create_task(coord.listen(_connect, coord.ORDERS_CHANNEL, _on_order_changed)))
+  db.state["ready"] = True
+
+
+@app.on_event("shutdown")
+async def shutdown():
+  for t in app.state.tasks:
+    t.cancel()
+  # недописанный хвост истории
+  await history.flush(app.state.pool)
+  await app.state.geo_client.aclose()
+  await tg.close()
+  await vk_events.close()
+  await tracing.close()
 
 
 @app.get("/api/health")
@@ -171,23 +270,67 @@ async def health():
   return {"ok": True, "env": ENV}
 
 
+@app.get("/api/ready")
+async def ready():
+  # Caddy шлёт трафик только после прогрева пула
+  if not db.state["ready"]:
+    return FastJSONResponse(status_code=503, content={"ok": False, "ready": False})
+  return {"ok": True, "ready": True, "warm_connections": db.state["warm_connections"]}
+
+
 ########################
 # GEO proxy
 ########################
+async def _remember_geocoder(body: bytes):
+  # разбор ответа апстрима — уже после отдачи клиенту
+  try:
+    data = jsonfast.loads(body)
+    items = data if isinstance(data, list) else [data]
+    async with app.state.pool.acquire() as conn:
+      await addresses.remember_geocoder(conn, [x for x in items if isinstance(x, dict) and x.get("display_name")])
+  except Exception:
+    return
+
+
+async def _geo_upstream(path: str, params: dict[str, Any]) -> bytes:
+  with tracing.span(f"geo{path}", "client", **{"http.path": path}) as s:
+    r = await app.state.geo_client.get(f"{GEO_BASE_URL}{path}", params=params)
+    if s:
+      s.set(**{"http.status": r.status_code})
+  r.raise_for_status()
+  return r.content
+
+
 @app.get("/api/geo/search")
-async def geo_search(q: str, limit: int = 5):
-  async with httpx.AsyncClient(timeout=20) as client:
-    r = await client.get(f"{GEO_BASE_URL}/search", params={"q": q, "format": "json", "limit": limit, "addressdetails": 1})
-    r.raise_for_status()
-    return JSONResponse(content=r.json())
+async def geo_search(q: str, background: BackgroundTasks, limit: int = 5):
+  # сначала локальный индекс; апстрим — только если там мало
+  async with app.state.pool.acquire() as conn:
+    local = await addresses.search(conn, q, limit)
+  if addresses.is_enough(local, limit):
+    return FastJSONResponse(content=local)
+
+  try:
+    body = await _geo_upstream("/search", {"q": q, "format": "json", "limit": limit, "addressdetails": 1})
+  except Exception:
+    if local:
+      return FastJSONResponse(content=local)
+    raise
+  # байты апстрима отдаём как есть, без json-разбора/сборки
+  background.add_task(_remember_geocoder, body)
+  return jsonfast.raw(body)
 
 
 @app.get("/api/geo/reverse")
-async def geo_reverse(lat: float, lon: float):
-  async with httpx.AsyncClient(timeout=20) as client:
-    r = await client.get(f"{GEO_BASE_URL}/reverse", params={"lat": lat, "lon": lon, "format": "json", "addressdetails": 1})
-    r.raise_for_status()
-    return JSONResponse(content=r.json())
+async def geo_reverse(lat: float, lon: float, background: BackgroundTasks):
+  # офлайн: KNN по импортированной OSM-выгрузке (app/osm.py); апстрим — только если рядом ничего нет
+  async with app.state.pool.acquire() as conn:
+    local = await osm.reverse(conn, lat, lon)
+  if local:
+    return FastJSONResponse(content=local)
+
+  body = await _geo_upstream("/reverse", {"lat": lat, "lon": lon, "format": "json", "addressdetails": 1})
+  background.add_task(_remember_geocoder, body)
+  return jsonfast.raw(body)
 
 
 ########################
@@ -202,44 +345,92 @@ class DriverLocationIn(BaseModel):
   name: Optional[str] = None
 
 
+# горячие запросы: прогреваются на каждом новом соединении пула (db.init_connection)
+DRIVER_UPSERT_SQL = db.hot_write(
+  "INSERT INTO drivers(driver_id, tg_id, phone, name) VALUES($1,$2,$3,$4) "
+  "ON CONFLICT(driver_id) DO UPDATE SET tg_id=EXCLUDED.tg_id, phone=COALESCE(EXCLUDED.phone, drivers.phone), name=COALESCE(EXCLUDED.name, drivers.name)",
+  -1, -1, None, None
+)
+LOCATION_UPSERT_SQL = db.hot_write(
+  "INSERT INTO driver_locations(driver_id, geom, updated_at) VALUES($1, ST_SetSRID(ST_MakePoint($2,$3),4326)::geography, now()) "
+  "ON CONFLICT(driver_id) DO UPDATE SET geom=EXCLUDED.geom, updated_at=now()",
+  -1, 0.0, 0.0
+)
+NEARBY_SQL = db.hot_read(
+  """
+  SELECT l.driver_id,
+         ST_Y(l.geom::geometry) AS lat,
+         ST_X(l.geom::geometry) AS lon,
+         EXTRACT(EPOCH FROM (now() - l.updated_at))::int AS age_seconds
+  FROM driver_locations l
+  WHERE l.updated_at > now() - ($3::text || ' seconds')::interval
+    AND ST_DWithin(l.geom, ST_SetSRID(ST_MakePoint($1,$2),4326)::geography, $4)
+  ORDER BY l.updated_at DESC
+  LIMIT 200
+  """,
+  0.0, 0.0, 0, 0
+)
+
+
 @app.post("/api/drivers/location")
 async def driver_location(payload: DriverLocationIn, request: Request):
   must_internal(request)
   pool = app.state.pool
+  fp = driver_profiles.fingerprint(payload.driver_id, payload.tg_id, payload.phone, payload.name)
   async with pool.acquire() as conn:
-    await conn.execute(
-      "INSERT INTO drivers(driver_id, tg_id, phone, name) VALUES($1,$2,$3,$4) "
-      "ON CONFLICT(driver_id) DO UPDATE SET tg_id=EXCLUDED.tg_id, phone=COALESCE(EXCLUDED.phone, drivers.phone), name=COALESCE(EXCLUDED.name, drivers.name)",
-      payload.driver_id, payload.tg_id, payload.phone, payload.name
-    )
-    await conn.execute(
-      "INSERT INTO driver_locations(driver_id, geom, updated_at) VALUES($1, ST_SetSRID(ST_MakePoint($2,$3),4326)::geography, now()) "
-      "ON CONFLICT(driver_id) DO UPDATE SET geom=EXCLUDED.geom, updated_at=now()",
-      payload.driver_id, payload.lon, payload.lat
-    )
+    if not driver_profiles.unchanged(payload.driver_id, fp):
+      await conn.execute(DRIVER_UPSERT_SQL, payload.driver_id, payload.tg_id, payload.phone, payload.name)
+      driver_profiles.remember(payload.driver_id, fp)
+    try:
+      await conn.execute(LOCATION_UPSERT_SQL, payload.driver_id, payload.lon, payload.lat)
+    except asyncpg.ForeignKeyViolationError:
+      # строку drivers удалили мимо этого воркера — отпечаток устарел, пишем профиль заново
+      driver_profiles.forget(payload.driver_id)
+      await conn.execute(DRIVER_UPSERT_SQL, payload.driver_id, payload.tg_id, payload.phone, payload.name)
+      driver_profiles.remember(payload.driver_id, fp)
+      await conn.execute(LOCATION_UPSERT_SQL, payload.driver_id, payload.lon, payload.lat)
+  history.add(payload.driver_id, payload.lat, payload.lon)
   return {"ok": True}
 
 
+@app.post("/api/drivers/sync")
+async def drivers_sync(request: Request):
+  # внеплановая сверка ростера (например, после массового найма в Taxomet)
+  must_internal(request)
+  return await driver_sync.sync(app.state.pool, _taxomet_drivers)
+
+
+@app.get("/api/drivers/{driver_id}/track")
+async def driver_track(driver_id: int, request: Request, since: Optional[datetime] = None,
+                       until: Optional[datetime] = None, limit: int = Query(20000, ge=1, le=100000)):
+  must_internal(request)
+  until = until or datetime.now(timezone.utc)
+  since = since or until - timedelta(hours=24)
+  async with app.state.pool.acquire() as conn:
+    rows = await history.track(conn, driver_id, since, until, limit)
+  return FastJSONResponse(content={"ok": True, "driver_id": driver_id, "points": jsonfast.records(rows)})
+
+
 @app.get("/api/drivers/nearby")
-async def drivers_nearby(lat: float, lon: float, radius_m: int = NEARBY_RADIUS_METERS):
-  pool = app.state.pool
-  async with pool.acquire() as conn:
-    rows = await conn.fetch(
-      """
-      SELECT d.driver_id, d.name, d.phone,
-             ST_Y(l.geom::geometry) AS lat,
-             ST_X(l.geom::geometry) AS lon,
-             EXTRACT(EPOCH FROM (now() - l.updated_at))::int AS age_seconds
-      FROM driver_locations l
-      JOIN drivers d ON d.driver_id = l.driver_id
-      WHERE l.updated_at > now() - ($3::text || ' seconds')::interval
-        AND ST_DWithin(l.geom, ST_SetSRID(ST_MakePoint($1,$2),4326)::geography, $4)
-      ORDER BY l.updated_at DESC
-      LIMIT 200
-      """,
-      lon, lat, DRIVER_ONLINE_TTL_SECONDS, radius_m
-    )
-  return {"ok": True, "radius_m": radius_m, "drivers": [dict(r) for r in rows]}
+async def drivers_nearby(lat: float, lon: float,
+                         radius_m: int = Query(NEARBY_RADIUS_METERS, ge=1, le=NEARBY_RADIUS_MAX_METERS),
+                         format: str = "json"):
+  # публичная лента: без имён/телефонов; format=json|columnar|packed (см. nearby_feed.py)
+  if format not in nearby_feed.FORMATS:
+    raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(nearby_feed.FORMATS)}")
+  media_type = nearby_feed.MEDIA_TYPES[format]
+
+  # частые опросы из одной ячейки подачи берут машины из короткого кэша ячейки: выборка — от центра
+  # ячейки с запасом на полудиагональ, радиус, расстояния и ETA — от точки самого вызывающего
+  cache_key = eta.cell_key(lat, lon, radius_m)
+  rows = eta.cache_get(cache_key)
+  if rows is None:
+    clat, clon = eta.cell_center(lat, lon)
+    async with app.state.pool.acquire() as conn:
+      rows = await conn.fetch(NEARBY_SQL, clon, clat, DRIVER_ONLINE_TTL_SECONDS, radius_m + eta.cell_margin_m())
+    eta.cache_put(cache_key, rows)
+  body = nearby_feed.encode(nearby_feed.within(rows, lat, lon, radius_m), lat, lon, radius_m, format)
+  return Response(content=body, media_type=media_type)
 
 
 ########################
@@ -250,7 +441,9 @@ class OrderCreateIn(BaseModel):
   client_name: Optional[str] = ""
   comment: Optional[str] = ""
   extern_id: str
-  tg_user_id: int
+  # заказчик — из Telegram или из VK
+  tg_user_id: Optional[int] = None
+  vk_user_id: Optional[int] = None
 
   from_address: str
   from_lat: Optional[float] = None
@@ -264,6 +457,9 @@ class OrderCreateIn(BaseModel):
 @app.post("/api/orders/create")
 async def orders_create(payload: OrderCreateIn, request: Request):
   must_internal(request)
+  if payload.tg_user_id is None and payload.vk_user_id is None:
+    raise HTTPException(status_code=400, detail="tg_user_id or vk_user_id required")
+  ratelimit.enforce_user("orders", payload.tg_user_id if payload.tg_user_id is not None else f"vk:{payload.vk_user_id}")
   if len(payload.to_addresses) < 1:
     raise HTTPException(status_code=400, detail="to_addresses must contain at least 1 (destination)")
 
@@ -287,15 +483,29 @@ async def orders_create(payload: OrderCreateIn, request: Request):
     lat_arr.append(payload.from_lat); lon_arr.append(payload.from_lon)
   else:
     lat_arr.append(""); lon_arr.append("")
+  # промежуточные точки могут быть без координат (геокодер не нашёл) — тогда пусто
+  to_lats = payload.to_lats or []
+  to_lons = payload.to_lons or []
   for i in range(len(payload.to_addresses)):
-    lat_arr.append(payload.to_lats[i] if payload.to_lats else "")
-    lon_arr.append(payload.to_lons[i] if payload.to_lons else "")
+    la = to_lats[i] if i < len(to_lats) else None
+    lo = to_lons[i] if i < len(to_lons) else None
+    if la is not None and lo is not None:
+      lat_arr.append(la); lon_arr.append(lo)
+    else:
+      lat_arr.append(""); lon_arr.append("")
 
   if any(x != "" for x in lat_arr) and any(x != "" for x in lon_arr):
     params["lat[]"] = lat_arr
     params["lon[]"] = lon_arr
 
-  data = await taxomet_get("/add_order", params)
+  # очередь с дедлайном перед Taxomet; соединение из пула берём только после его ответа.
+  # В трассе ожидание очереди = спан admission минус вложенный спан вызова
+  with tracing.span("taxomet.admission"):
+    async with admission.taxomet.slot(admission.request_deadline(request)) as remaining:
+      try:
+        data = await taxomet_get("/add_order", params, timeout=max(remaining, 1.0))
+      except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="taxomet timeout")
   if str(data.get("result")) != "1":
     raise HTTPException(status_code=400, detail={"taxomet": data})
 
@@ -303,15 +513,29 @@ async def orders_create(payload: OrderCreateIn, request: Request):
 
   pool = app.state.pool
   async with pool.acquire() as conn:
-    await conn.execute(
-      """
-      INSERT INTO orders(extern_id, taxomet_order_id, tg_user_id, phone, client_name, from_address, to_addresses, status)
-      VALUES($1,$2,$3,$4,$5,$6,$7,0)
+    row = await conn.fetchrow(
+      f"""
+      INSERT INTO orders(extern_id, taxomet_order_id, tg_user_id, phone, client_name, from_address, to_addresses, status, from_lat, from_lon, vk_user_id)
+      VALUES($1,$2,$3,$4,$5,$6,$7,0,$8,$9,$10)
       ON CONFLICT(extern_id) DO UPDATE SET taxomet_order_id=EXCLUDED.taxomet_order_id, updated_at=now()
+      RETURNING {active_orders.COLUMNS}
       """,
       payload.extern_id, taxomet_order_id, payload.tg_user_id, payload.phone,
-      payload.client_name, payload.from_address, json.dumps(payload.to_addresses)
+      payload.client_name, payload.from_address, json.dumps(payload.to_addresses),
+      payload.from_lat, payload.from_lon, payload.vk_user_id
     )
+    # адреса заказа пополняют локальный индекс автодополнения
+    to_lats = payload.to_lats or []
+    to_lons = payload.to_lons or []
+    points = [(payload.from_address, payload.from_lat, payload.from_lon)]
+    for i, addr in enumerate(payload.to_addresses):
+      points.append((addr, to_lats[i] if i < len(to_lats) else None, to_lons[i] if i < len(to_lons) else None))
+    try:
+      await addresses.remember_points(conn, points)
+    except Exception:
+      pass
+    await _publish_order(conn, payload.extern_id)
+  active_orders.apply(row)
 
   msg = (
     f"🚕 Новый заказ\n"
@@ -322,12 +546,91 @@ async def orders_create(payload: OrderCreateIn, request: Request):
     f"Куда: {', '.join(payload.to_addresses)}\n"
     f"Комментарий: {payload.comment or '-'}"
   )
-  await tg_send(TG_NOTIFY_GROUP_ID, msg)
-  await tg_send(TG_ADMIN_GROUP_ID, msg)
+  async with pool.acquire() as conn:
+    await group_digest.add(conn, TG_NOTIFY_GROUP_ID, msg, urgent=GROUP_URGENT_NEW_ORDERS)
+    await group_digest.add(conn, TG_ADMIN_GROUP_ID, msg, urgent=GROUP_URGENT_NEW_ORDERS)
 
   return {"ok": True, "taxomet_order_id": taxomet_order_id, "extern_id": payload.extern_id}
 
 
+########################
+# Orders: списки (keyset-пагинация)
+########################
+ORDERS_PAGE_COLUMNS = "id, created_at, extern_id, taxomet_order_id, tg_user_id, status, driver_id, fix_price, from_address"
+ORDERS_PAGE_MAX = 100
+
+
+def _cursor_encode(created_at: datetime, order_id: int) -> str:
+  return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{order_id}".encode()).decode().rstrip("=")
+
+
+def _cursor_decode(cursor: str) -> tuple[datetime, int]:
+  try:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    ts, oid = raw.split("|", 1)
+    return datetime.fromisoformat(ts), int(oid)
+  except Exception:
+    raise HTTPException(status_code=400, detail="bad cursor")
+
+
+async def _orders_page(where: list[str], args: list[Any], cursor: Optional[str], limit: int):
+  limit = max(1, min(limit, ORDERS_PAGE_MAX))
+  if cursor:
+    ts, oid = _cursor_decode(cursor)
+    args += [ts, oid]
+    where.append(f"(created_at, id) < (${len(args) - 1}, ${len(args)})")
+  args.append(limit + 1)
+  sql = (
+    f"SELECT {ORDERS_PAGE_COLUMNS} FROM orders"
+    + (f" WHERE {' AND '.join(where)}" if where else "")
+    + f" ORDER BY created_at DESC, id DESC LIMIT ${len(args)}"
+  )
+  async with app.state.pool.acquire() as conn:
+    rows = await conn.fetch(sql, *args)
+  items = jsonfast.records(rows[:limit])
+  next_cursor = None
+  if len(rows) > limit:
+    last = rows[limit - 1]
+    next_cursor = _cursor_encode(last["created_at"], last["id"])
+  return FastJSONResponse(content={"ok": True, "orders": items, "next_cursor": next_cursor})
+
+
+@app.get("/api/orders/active")
+async def orders_active(request: Request, tg_user_id: Optional[int] = None, extern_id: Optional[str] = None,
+                        taxomet_order_id: Optional[int] = None):
+  # из памяти, без обращения к Postgres
+  must_internal(request)
+  if tg_user_id is not None:
+    return FastJSONResponse(content={"ok": True, "orders": active_orders.for_user(tg_user_id)})
+  if extern_id is not None or taxomet_order_id is not None:
+    o = active_orders.get(extern_id, taxomet_order_id)
+    return FastJSONResponse(content={"ok": True, "orders": [o] if o else []})
+  return FastJSONResponse(content={"ok": True, "count": len(active_orders.by_extern),
+                                   "orders": list(active_orders.by_extern.values())})
+
+
+@app.get("/api/orders/by_user/{tg_user_id}")
+async def orders_by_user(tg_user_id: int, request: Request, status: list[int] = Query(default=[]),
+                         cursor: Optional[str] = None, limit: int = 20):
+  must_internal(request)
+  where, args = ["tg_user_id=$1"], [tg_user_id]
+  if status:
+    args.append(status)
+    where.append(f"status = ANY(${len(args)}::int[])")
+  return await _orders_page(where, args, cursor, limit)
+
+
+@app.get("/api/orders")
+async def orders_list(request: Request, status: list[int] = Query(default=[]),
+                      cursor: Optional[str] = None, limit: int = 50):
+  must_internal(request)
+  where, args = [], []
+  if status:
+    args.append(status)
+    where.append(f"status = ANY(${len(args)}::int[])")
+  return await _orders_page(where, args, cursor, limit)
+
+
 ########################
 # Taxomet webhook (statuses)
 ########################
@@ -341,7 +644,7 @@ class TaxometWebhookIn(BaseModel):
 
 
 @app.post("/api/taxomet/webhook")
-async def taxomet_webhook(payload: TaxometWebhookIn, request: Request):
+async def taxomet_webhook(payload: TaxometWebhookIn, request: Request, background: BackgroundTasks):
   if TAXOMET_WEBHOOK_SECRET:
     got = request.headers.get("x-taxomet-secret","")
     if got != TAXOMET_WEBHOOK_SECRET:
@@ -349,46 +652,110 @@ async def taxomet_webhook(payload: TaxometWebhookIn, request: Request):
 
   pool = app.state.pool
   async with pool.acquire() as conn:
-    await conn.execute(
-      """
-      UPDATE orders
-         SET status=$1,
-             driver_id=COALESCE($2, driver_id),
-             driver_title=COALESCE($3, driver_title),
-             fix_price=COALESCE($4, fix_price),
-             updated_at=now()
-       WHERE extern_id=$5
-      """,
-      payload.status, payload.driver_id, payload.driver_title, payload.fix_price, payload.extern_id
-    )
-    row = await conn.fetchrow("SELECT tg_user_id, taxomet_order_id FROM orders WHERE extern_id=$1", payload.extern_id)
+    # статус и очередь правок — одной транзакцией: лок строки orders упорядочивает
+    # вебхуки одного заказа, пришедшие на разные воркеры
+    async with conn.transaction():
+      row = await conn.fetchrow(
+        f"""
+        UPDATE orders
+           SET status=$1,
+               driver_id=COALESCE($2, driver_id),
+               driver_title=COALESCE($3, driver_title),
+               fix_price=COALESCE($4, fix_price),
+               updated_at=now()
+         WHERE extern_id=$5
+        RETURNING {active_orders.COLUMNS}
+        """,
+        payload.status, payload.driver_id, payload.driver_title, payload.fix_price, payload.extern_id
+      )
+      if row:
+        await _publish_order(conn, payload.extern_id)
+        text = order_status.render(dict(row))
+        # одно сообщение о статусе на заказ, правится на месте; частые смены склеиваются (очередь — в БД)
+        if row["tg_user_id"] is not None:
+          await order_status.update(conn, payload.extern_id, {"client": int(row["tg_user_id"])}, text)
+        # ключ status:<заказ> — в дайджесте остаётся последний статус, общий для всех воркеров
+        await group_digest.add(conn, TG_NOTIFY_GROUP_ID, text, key=f"status:{payload.extern_id}",
+                               urgent=payload.status in GROUP_URGENT_STATUSES)
 
   if row:
-    user_id = int(row["tg_user_id"])
-    order_id = int(row["taxomet_order_id"] or payload.order_id)
-    msg = f"🚕 Заказ {order_id}: статус={payload.status}"
-    if payload.driver_title:
-      msg += f"\nВодитель: {payload.driver_title}"
-    await tg_send(user_id, msg)
-    await tg_send(TG_NOTIFY_GROUP_ID, msg)
+    active_orders.apply(row)
+    if row["vk_user_id"] is not None:
+      background.add_task(vk_events.notify, int(row["vk_user_id"]), text)
 
   return {"ok": True}
 
 
 ########################
-# VK callback (задел)
+# Dispatch (предложения назначений)
+########################
+@app.get("/api/dispatch/proposals")
+async def dispatch_proposals(request: Request):
+  must_internal(request)
+  # при нескольких воркерах считает только лидер — снимок берём из БД
+  async with app.state.pool.acquire() as conn:
+    snap = await dispatch.snapshot(conn)
+  return {"ok": True, **snap}
+
+
+########################
+# Tracing
+########################
+@app.post("/api/traces")
+async def traces_ingest(request: Request):
+  # спаны bot_tg — экспортируются вместе со спанами backend'а
+  must_internal(request)
+  body = jsonfast.loads(await request.body())
+  return {"ok": True, "accepted": tracing.ingest(body.get("spans") or []) if tracing.ENABLED else 0}
+
+
+########################
+# Metrics
+########################
+@app.get("/api/metrics")
+async def metrics(request: Request):
+  must_internal(request)
+  return {
+    "ok": True,
+    "taxomet_admission": admission.taxomet.snapshot(),
+    "ratelimit": ratelimit.stats,
+    "dispatch": dispatch.metrics(),
+    "history": history.stats,
+    "driver_sync": driver_sync.stats,
+    "driver_profiles": driver_profiles.stats,
+    "order_status": order_status.stats,
+    "group_digest": group_digest.stats,
+    "telegram": tg.stats,
+    "vk_callback": vk_events.snapshot(),
+    "active_orders": {**active_orders.stats, "active": len(active_orders.by_extern)},
+    "tracing": tracing.stats,
+    "worker": coord.state,
+  }
+
+
+########################
+# VK callback
 ########################
 @app.post("/vk/callback")
 async def vk_callback(request: Request):
-  body = await request.json()
+  # VK ждёт ответ "ok" текстом за несколько секунд — здесь только проверка и постановка в очередь
+  raw = await request.body()
+  try:
+    body = jsonfast.loads(raw)
+  except Exception:
+    raise HTTPException(status_code=400, detail="bad json")
   t = body.get("type","")
   if t == "confirmation":
     if not VK_CONFIRMATION:
       raise HTTPException(status_code=500, detail="VK_CONFIRMATION not set")
-    return JSONResponse(content=VK_CONFIRMATION)
+    return PlainTextResponse(VK_CONFIRMATION)
 
   if VK_SECRET:
     if body.get("secret","") != VK_SECRET:
       raise HTTPException(status_code=401, detail="bad vk secret")
 
-  return JSONResponse(content="ok")
+  if request.headers.get("x-retry-counter"):
+    vk_events.stats["retried_deliveries"] += 1
+  if not vk_events.enqueue(raw):
+    return PlainTextResponse("busy", status_code=503)
+  return PlainTextResponse("ok")
@@ -0,0 +1,74 @@
+import struct
+
+import numpy as np
+
+from . import eta, jsonfast
+
+# Публичная лента машин рядом (без имён и телефонов) в трёх форматах:
+#   json     — массив объектов (как раньше);
+#   columnar — параллельные массивы, координаты в целых микроградусах;
+#   packed   — бинарный, little-endian:
+#     "DRV1" | u16 count | u16 reserved | u32 radius_m
+#     | i64[count] driver_id | i32[count] lat_e6 | i32[count] lon_e6
+#     | u16[count] age_seconds | u16[count] eta_seconds | u32[count] distance_m
+FORMATS = ("json", "columnar", "packed")
+MEDIA_TYPES = {"json": "application/json", "columnar": "application/json", "packed": "application/octet-stream"}
+PACKED_MAGIC = b"DRV1"
+
+# порядок колонок в SQL-запросе ленты
+COLUMNS = ("driver_id", "lat", "lon", "age_seconds")
+
+
+def within(rows, lat: float, lon: float, radius_m: int) -> list:
+  # строки, выбранные вокруг центра ячейки, — отсечка радиусом уже от точки вызывающего
+  if not rows:
+    return []
+  lats = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+  lons = np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows))
+  keep = eta.haversine_m(lat, lon, lats, lons) <= radius_m
+  return [r for r, k in zip(rows, keep.tolist()) if k]
+
+
+def encode(rows, lat: float, lon: float, radius_m: int, fmt: str) -> bytes:
+  n = len(rows)
+  ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=n)
+  lats = np.fromiter((r[1] for r in rows), dtype=np.float64, count=n)
+  lons = np.fromiter((r[2] for r in rows), dtype=np.float64, count=n)
+  ages = np.fromiter((r[3] for r in rows), dtype=np.int64, count=n)
+
+  # ETA подачи одним векторным проходом, ближайшие по времени — первыми
+  dist, secs = eta.eta_seconds(lat, lon, lats, lons) if n else (np.zeros(0), np.zeros(0))
+  order = np.argsort(secs, kind="stable")
+  ids, lats, lons, ages = ids[order], lats[order], lons[order], ages[order]
+  dist, secs = dist[order].astype(np.int64), secs[order].astype(np.int64)
+
+  if fmt == "packed":
+    return b"".join((
+      PACKED_MAGIC,
+      struct.pack("<HHI", n, 0, radius_m),
+      ids.astype("<i8").tobytes(),
+      np.rint(lats * 1e6).astype("<i4").tobytes(),
+      np.rint(lons * 1e6).astype("<i4").tobytes(),
+      np.clip(ages, 0, 65535).astype("<u2").tobytes(),
+      np.clip(secs, 0, 65535).astype("<u2").tobytes(),
+      np.clip(dist, 0, 2**32 - 1).astype("<u4").tobytes(),
+    ))
+
+  if fmt == "columnar":
+    return jsonfast.dumps({
+      "ok": True,
+      "radius_m": radius_m,
+      "count": n,
+      "driver_id": ids,
+      "lat_e6": np.rint(lats * 1e6).astype(np.int64),
+      "lon_e6": np.rint(lons * 1e6).astype(np.int64),
+      "age_seconds": ages,
+      "eta_seconds": secs,
+      "distance_m": dist,
+    })
+
+  drivers = [
+    {"driver_id": i, "lat": la, "lon": lo, "age_seconds": a, "eta_seconds": e, "distance_m": d}
+    for i, la, lo, a, e, d in zip(ids.tolist(), lats.tolist(), lons.tolist(), ages.tolist(), secs.tolist(), dist.tolist())
+  ]
+  return jsonfast.dumps({"ok": True, "radius_m": radius_m, "drivers": drivers})
@@ -0,0 +1,205 @@
+import os, json, asyncio, logging
+from typing import Any
+
+from . import tg
+
+# Статус заказа у клиента в Telegram — одно сообщение на заказ, которое редактируется при смене
+# статуса (в группы статусы идут дайджестом, см. group_digest). Вебхук может прийти на любой воркер,
+# поэтому очередь общая — таблица order_status_outbox (строка на заказ, последний текст побеждает):
+# обновления в пределах ORDER_STATUS_COALESCE_SECONDS склеиваются в одну правку. Разбирает очередь
+# только лидер (coord.run_leader), правки одного заказа идут строго по очереди.
+# Новое сообщение отправляется под «захватом» слота: status_message_id = -1 ставится атомарно,
+# пока он NULL, — второй отправитель (например, старый лидер) слот не получит и дубля не будет.
+ORDER_STATUS_COALESCE_SECONDS = float(os.getenv("ORDER_STATUS_COALESCE_SECONDS","2"))
+ORDER_STATUS_POLL_SECONDS = float(os.getenv("ORDER_STATUS_POLL_SECONDS","0.5"))
+ORDER_STATUS_BATCH = int(os.getenv("ORDER_STATUS_BATCH","50"))
+# правка, упёршаяся в 429 / сбой сети, возвращается в очередь (с retry_after от Telegram)
+ORDER_STATUS_EDIT_RETRIES = int(os.getenv("ORDER_STATUS_EDIT_RETRIES","5"))
+ORDER_STATUS_RETRY_SECONDS = float(os.getenv("ORDER_STATUS_RETRY_SECONDS","5"))
+# захват слота старше этого считается брошенным (процесс умер между захватом и записью message_id)
+ORDER_STATUS_CLAIM_TIMEOUT_SECONDS = int(os.getenv("ORDER_STATUS_CLAIM_TIMEOUT_SECONDS","60"))
+
+log = logging.getLogger("taxi.order_status")
+
+# колонка orders с message_id статусного сообщения для каждого вида чата
+TARGETS = {"client": "status_message_id"}
+CLAIMED = -1
+
+SCHEMA = """
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS status_message_id BIGINT;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS status_claimed_at TIMESTAMPTZ;
+CREATE TABLE IF NOT EXISTS order_status_outbox(
+  extern_id TEXT PRIMARY KEY,
+  chats JSONB NOT NULL,
+  text TEXT NOT NULL,
+  due_at TIMESTAMPTZ NOT NULL,
+  attempts INT NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_order_status_outbox_due ON order_status_outbox(due_at);
+"""
+
+# due_at не сдвигается: окно склейки считается от первого обновления
+UPDATE_SQL = """
+INSERT INTO order_status_outbox(extern_id, chats, text, due_at)
+VALUES($1, $2::jsonb, $3, now() + $4 * interval '1 second')
+ON CONFLICT (extern_id) DO UPDATE
+SET text = EXCLUDED.text, chats = order_status_outbox.chats || EXCLUDED.chats
+RETURNING (xmax = 0) AS inserted
+"""
+
+# повтор после 429/сбоя: если за это время пришёл новый статус, остаётся его текст
+REQUEUE_SQL = """
+INSERT INTO order_status_outbox(extern_id, chats, text, due_at, attempts)
+VALUES($1, $2::jsonb, $3, now() + $4 * interval '1 second', $5)
+ON CONFLICT (extern_id) DO UPDATE
+SET chats = EXCLUDED.chats || order_status_outbox.chats,
+    attempts = GREATEST(order_status_outbox.attempts, EXCLUDED.attempts)
+"""
+
+# заказы, правка которых ещё идёт ($1), не забираем — следующая правка только после неё
+TAKE_SQL = """
+DELETE FROM order_status_outbox o
+WHERE o.extern_id IN (
+  SELECT extern_id FROM order_status_outbox
+  WHERE due_at <= now() AND extern_id <> ALL($1::text[])
+  ORDER BY due_at
+  LIMIT $2
+  FOR UPDATE SKIP LOCKED
+)
+RETURNING o.extern_id, o.chats, o.text, o.attempts
+"""
+
+_inflight: set[str] = set()
+_tasks: set[asyncio.Task] = set()
+stats: dict[str, int] = {"updates": 0, "coalesced": 0, "flushes": 0, "edits": 0, "sends": 0,
+                         "requeued": 0, "given_up": 0, "slot_busy": 0}
+
+
+def render(o: dict[str, Any]) -> str:
+  lines = [f"🚕 Заказ {o.get('taxomet_order_id') or o['extern_id']}: статус={o['status']}"]
+  if o.get("driver_title"):
+    lines.append(f"Водитель: {o['driver_title']}")
+  if o.get("fix_price"):
+    lines.append(f"Цена: {float(o['fix_price']):g}")
+  if o.get("from_address"):
+    lines.append(f"Откуда: {o['from_address']}")
+  return "\n".join(lines)
+
+
+async def update(conn, extern_id: str, chats: dict[str, int], text: str):
+  # chats: вид чата (ключ TARGETS) -> chat_id
+  stats["updates"] += 1
+  if not await conn.fetchval(UPDATE_SQL, extern_id, json.dumps(chats), text, ORDER_STATUS_COALESCE_SECONDS):
+    stats["coalesced"] += 1
+
+
+async def _requeue(conn, extern_id: str, text: str, chats: dict[str, int], attempts: int, delay: float):
+  attempts += 1
+  if attempts > ORDER_STATUS_EDIT_RETRIES:
+    stats["given_up"] += 1
+    log.warning("order status edit given up after %d attempts: %s", attempts - 1, extern_id)
+    return
+  stats["requeued"] += 1
+  await conn.execute(REQUEUE_SQL, extern_id, json.dumps(chats), text,
+                     max(delay, ORDER_STATUS_RETRY_SECONDS), attempts)
+
+
+async def _send_new(pool, extern_id: str, column: str, chat_id: int, text: str) -> bool:
+  # False — слот занят другим отправителем: повторим позже и, скорее всего, уже правкой
+  async with pool.acquire() as conn:
+    claimed = await conn.fetchval(
+      f"UPDATE orders SET {column}=$2, status_claimed_at=now() "
+      f"WHERE extern_id=$1 AND ({column} IS NULL OR ({column}=$2 "
+      f"AND status_claimed_at < now() - $3 * interval '1 second')) RETURNING true",
+      extern_id, CLAIMED, ORDER_STATUS_CLAIM_TIMEOUT_SECONDS
+    )
+  if not claimed:
+    stats["slot_busy"] += 1
+    return False
+  message_id = await tg.send(chat_id, text)
+  async with pool.acquire() as conn:
+    # не ушло — освобождаем слот, следующий статус попробует снова
+    await conn.execute(f"UPDATE orders SET {column}=$2 WHERE extern_id=$1 AND {column}=$3",
+                       extern_id, message_id, CLAIMED)
+  if message_id:
+    stats["sends"] += 1
+  return True
+
+
+async def flush(pool, extern_id: str, chats: dict[str, int], text: str, attempts: int = 0):
+  stats["flushes"] += 1
+  async with pool.acquire() as conn:
+    ids = await conn.fetchrow(
+      "SELECT status_message_id FROM orders WHERE extern_id=$1", extern_id
+    )
+  if ids is None:
+    return
+  retry: dict[str, int] = {}
+  retry_after = 0.0
+  for kind, chat_id in chats.items():
+    if not chat_id:
+      continue
+    column = TARGETS[kind]
+    message_id = ids[column]
+    if message_id == CLAIMED:
+      # новое сообщение ещё отправляется — править будет нечего до записи message_id
+      retry[kind] = chat_id
+      continue
+    if message_id:
+      res, after = await tg.edit(chat_id, message_id, text)
+      if res == tg.EDIT_OK:
+        stats["edits"] += 1
+        continue
+      if res == tg.EDIT_RETRY:
+        retry[kind] = chat_id
+        retry_after = max(retry_after, after)
+        continue
+      if res != tg.EDIT_GONE:
+        continue
+      # сообщение удалили / его больше нельзя править — освобождаем слот под новое
+      async with pool.acquire() as conn:
+        await conn.execute(f"UPDATE orders SET {column}=NULL WHERE extern_id=$1 AND {column}=$2",
+                           extern_id, message_id)
+    if not await _send_new(pool, extern_id, column, chat_id, text):
+      retry[kind] = chat_id
+  if retry:
+    async with pool.acquire() as conn:
+      await _requeue(conn, extern_id, text, retry, attempts, retry_after)
+
+
+async def _flush_one(pool, extern_id: str, chats: dict[str, int], text: str, attempts: int):
+  try:
+    await flush(pool, extern_id, chats, text, attempts)
+  except Exception:
+    log.exception("order status flush failed: %s", extern_id)
+  finally:
+    _inflight.discard(extern_id)
+
+
+async def take(pool) -> int:
+  async with pool.acquire() as conn:
+    rows = await conn.fetch(TAKE_SQL, list(_inflight), ORDER_STATUS_BATCH)
+  for r in rows:
+    _inflight.add(r["extern_id"])
+    t = asyncio.get_running_loop().create_task(
+      _flush_one(pool, r["extern_id"], json.loads(r["chats"]), r["text"], r["attempts"]))
+    _tasks.add(t)
+    t.add_done_callback(_tasks.discard)
+  return len(rows)
+
+
+async def run(pool):
+  # задача лидера: единственный владелец очереди
+  try:
+    while True:
+      try:
+        await take(pool)
+      except asyncio.CancelledError:
+        raise
+      except Exception:
+        log.exception("order status take failed")
+      await asyncio.sleep(ORDER_STATUS_POLL_SECONDS)
+  finally:
+    # лидерство потеряно — недоделанные правки не продолжаем (слоты освободятся по таймауту)
+    for t in list(_tasks):
+      t.cancel()
@@ -0,0 +1,258 @@
+import os, sys, json, time, asyncio, hashlib, argparse
+from typing import Any, Iterator, Optional
+
+# Офлайн reverse-геокодинг: адресные точки и улицы региона из OSM-выгрузки в PostGIS.
+# Импорт:
+#   docker compose exec backend python -m app.osm /data/kamchatka.osm.pbf --replace
+#   docker compose exec backend python -m app.osm /data/addr.geojsonseq
+# .pbf читается через pyosmium, .geojson/.geojsonseq — напрямую (для больших регионов
+# удобнее GeoJSONSeq: ogr2ogr -f GeoJSONSeq addr.geojsonseq region.osm.pbf).
+# Строка адресована ключом (osm_type, osm_id): повторный импорт без --replace обновляет
+# объекты, а не дублирует их. У фич без OSM-идентификатора ключ — хэш содержимого (osm_type='hash').
+GEO_REVERSE_HOUSE_METERS = float(os.getenv("GEO_REVERSE_HOUSE_METERS","60"))
+GEO_REVERSE_STREET_METERS = float(os.getenv("GEO_REVERSE_STREET_METERS","250"))
+OSM_IMPORT_BATCH = int(os.getenv("OSM_IMPORT_BATCH","20000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS osm_addresses(
+  id BIGSERIAL PRIMARY KEY,
+  kind TEXT NOT NULL,
+  housenumber TEXT,
+  street TEXT,
+  city TEXT,
+  postcode TEXT,
+  display_name TEXT NOT NULL,
+  geom GEOGRAPHY(GEOMETRY,4326) NOT NULL
+);
+ALTER TABLE osm_addresses ADD COLUMN IF NOT EXISTS osm_type TEXT;
+ALTER TABLE osm_addresses ADD COLUMN IF NOT EXISTS osm_id BIGINT;
+CREATE INDEX IF NOT EXISTS idx_osm_addresses_geom ON osm_addresses USING GIST (geom);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_osm_addresses_osm ON osm_addresses(osm_type, osm_id);
+"""
+
+# один индексный KNN-запрос: ближайшие дома и улицы, выбор — в _pick()
+REVERSE_SQL = """
+SELECT kind, housenumber, street, city, postcode, display_name,
+       ST_Y(ST_ClosestPoint(geom::geometry, p::geometry)) AS lat,
+       ST_X(ST_ClosestPoint(geom::geometry, p::geometry)) AS lon,
+       ST_Distance(geom, p) AS dist
+FROM osm_addresses, (SELECT ST_SetSRID(ST_MakePoint($1,$2),4326)::geography AS p) q
+WHERE ST_DWithin(geom, p, $3)
+ORDER BY geom <-> p
+LIMIT 8
+"""
+
+STAGE_COLUMNS = ["osm_type", "osm_id", "kind", "housenumber", "street", "city", "postcode", "name", "wkt", "geojson"]
+
+STAGE_SQL = """
+CREATE TEMP TABLE osm_stage(
+  osm_type TEXT, osm_id BIGINT,
+  kind TEXT, housenumber TEXT, street TEXT, city TEXT, postcode TEXT, name TEXT,
+  wkt TEXT, geojson TEXT
+) ON COMMIT PRESERVE ROWS;
+"""
+
+# DISTINCT ON: один объект дважды в выгрузке не должен ронять ON CONFLICT DO UPDATE
+MERGE_SQL = """
+INSERT INTO osm_addresses(osm_type, osm_id, kind, housenumber, street, city, postcode, display_name, geom)
+SELECT osm_type, osm_id, kind, housenumber, street, city, postcode,
+       CASE WHEN kind='house'
+            THEN concat_ws(', ', housenumber, street, city)
+            ELSE concat_ws(', ', COALESCE(name, street), city) END,
+       CASE WHEN kind='house' THEN ST_PointOnSurface(g)::geography ELSE g::geography END
+FROM (
+  SELECT DISTINCT ON (s.osm_type, s.osm_id) s.*,
+         CASE WHEN s.wkt IS NOT NULL THEN ST_GeomFromText(s.wkt, 4326)
+              ELSE ST_SetSRID(ST_GeomFromGeoJSON(s.geojson), 4326) END AS g
+  FROM osm_stage s
+  ORDER BY s.osm_type, s.osm_id
+) x
+WHERE g IS NOT NULL AND NOT ST_IsEmpty(g)
+ON CONFLICT (osm_type, osm_id) DO UPDATE
+SET kind = EXCLUDED.kind, housenumber = EXCLUDED.housenumber, street = EXCLUDED.street,
+    city = EXCLUDED.city, postcode = EXCLUDED.postcode, display_name = EXCLUDED.display_name,
+    geom = EXCLUDED.geom
+"""
+
+
+async def ensure_schema(conn):
+  await conn.execute(SCHEMA)
+
+
+def _pick(rows) -> Optional[Any]:
+  house = next((r for r in rows if r["kind"] == "house"), None)
+  if house and house["dist"] <= GEO_REVERSE_HOUSE_METERS:
+    return house
+  return next((r for r in rows if r["kind"] == "street"), None)
+
+
+async def reverse(conn, lat: float, lon: float) -> Optional[dict[str, Any]]:
+  rows = await conn.fetch(REVERSE_SQL, lon, lat, max(GEO_REVERSE_HOUSE_METERS, GEO_REVERSE_STREET_METERS))
+  r = _pick(rows)
+  if not r:
+    return None
+  # формат как у Nominatim /reverse — miniapp берёт display_name
+  address = {"house_number": r["housenumber"], "road": r["street"], "city": r["city"], "postcode": r["postcode"]}
+  return {
+    "place_id": "osm-local",
+    "lat": str(r["lat"]),
+    "lon": str(r["lon"]),
+    "display_name": r["display_name"],
+    "address": {k: v for k, v in address.items() if v},
+  }
+
+
+########################
+# Import
+########################
+def _row(tags, osm_type: Optional[str], osm_id: Optional[int], is_way: bool,
+         wkt: Optional[str] = None, geojson: Optional[str] = None):
+  hn = tags.get("addr:housenumber")
+  street = tags.get("addr:street")
+  name = tags.get("name")
+  if hn and (street or tags.get("addr:place")):
+    kind = "house"
+    street = street or tags.get("addr:place")
+  elif tags.get("highway") and name and is_way:
+    # highway-точки (остановки, переходы, светофоры) — не улицы
+    kind = "street"
+    street = name
+  else:
+    return None
+  row = (kind, hn if kind == "house" else None, street, tags.get("addr:city"), tags.get("addr:postcode"), name, wkt, geojson)
+  if osm_type is None or osm_id is None:
+    digest = hashlib.blake2b("\x1f".join(x or "" for x in row).encode(), digest_size=8).digest()
+    osm_type, osm_id = "hash", int.from_bytes(digest, "big", signed=True)
+  return (osm_type, osm_id) + row
+
+
+OSM_TYPES = {"n": "node", "w": "way", "r": "relation", "node": "node", "way": "way", "relation": "relation"}
+
+
+def _feature_key(f: dict[str, Any], props: dict[str, Any]) -> tuple[Optional[str], Optional[int]]:
+  # osmtogeojson / Overpass: "way/123" в id или @id; ogr2ogr: osm_id (+ osm_way_id у мультиполигонов)
+  for v in (props.get("@id"), f.get("id"), props.get("id")):
+    if isinstance(v, str) and "/" in v:
+      t, _, i = v.partition("/")
+      if t in OSM_TYPES and i.lstrip("-").isdigit():
+        return OSM_TYPES[t], int(i)
+  try:
+    if props.get("osm_way_id") is not None:
+      return "way", int(props["osm_way_id"])
+    if props.get("osm_id") is not None:
+      gt = (f.get("geometry") or {}).get("type")
+      t = props.get("osm_type") or ("node" if gt == "Point" else "relation" if gt == "MultiPolygon" else "way")
+      return OSM_TYPES.get(t, t), int(props["osm_id"])
+  except (TypeError, ValueError):
+    pass
+  return None, None
+
+
+def _iter_geojson(path: str) -> Iterator[tuple]:
+  def feature_row(f):
+    geom = f.get("geometry")
+    if not geom:
+      return None
+    props = f.get("properties") or {}
+    osm_type, osm_id = _feature_key(f, props)
+    is_way = osm_type == "way" if osm_type else geom.get("type") not in ("Point", "MultiPoint")
+    return _row(props, osm_type, osm_id, is_way, geojson=json.dumps(geom))
+
+  with open(path, encoding="utf-8") as fh:
+    head = fh.read(1)
+    fh.seek(0)
+    if head == "{" and not path.endswith((".geojsonseq", ".geojsonl", ".jsonl")):
+      # FeatureCollection целиком (для больших выгрузок — GeoJSONSeq)
+      for f in json.load(fh).get("features") or []:
+        row = feature_row(f)
+        if row:
+          yield row
+      return
+    for line in fh:
+      line = line.strip().lstrip("\x1e")
+      if not line:
+        continue
+      row = feature_row(json.loads(line))
+      if row:
+        yield row
+
+
+def _iter_pbf(path: str) -> Iterator[tuple]:
+  try:
+    import osmium
+  except ImportError:
+    raise SystemExit("pyosmium is required for .pbf import: pip install osmium")
+
+  wkt = osmium.geom.WKTFactory()
+  fp = (osmium.FileProcessor(path)
+        .with_locations()
+        .with_filter(osmium.filter.KeyFilter("addr:housenumber", "highway")))
+  for obj in fp:
+    tags = dict(obj.tags)
+    try:
+      if obj.is_node():
+        osm_type, geom = "node", wkt.create_point(obj)
+      elif obj.is_way():
+        osm_type, geom = "way", wkt.create_linestring(obj)
+      else:
+        continue
+    except Exception:
+      continue
+    row = _row(tags, osm_type, obj.id, osm_type == "way", wkt=geom)
+    if row:
+      yield row
+
+
+def _batches(it: Iterator[tuple], size: int) -> Iterator[list[tuple]]:
+  buf = []
+  for row in it:
+    buf.append(row)
+    if len(buf) >= size:
+      yield buf
+      buf = []
+  if buf:
+    yield buf
+
+
+async def import_file(path: str, replace: bool = False) -> int:
+  import asyncpg
+  from . import db
+
+  rows_iter = _iter_pbf(path) if path.endswith(".pbf") else _iter_geojson(path)
+  conn = await asyncpg.connect(dsn=db.dsn())
+  try:
+    await ensure_schema(conn)
+    await conn.execute(STAGE_SQL)
+    total = 0
+    t0 = time.monotonic()
+    for batch in _batches(rows_iter, OSM_IMPORT_BATCH):
+      await conn.copy_records_to_table("osm_stage", records=batch, columns=STAGE_COLUMNS)
+      total += len(batch)
+      print(f"staged {total} rows ({time.monotonic() - t0:.1f}s)", file=sys.stderr)
+
+    async with conn.transaction():
+      if replace:
+        # полная перезаливка: индекс строим один раз после вставки
+        await conn.execute("TRUNCATE osm_addresses")
+        await conn.execute("DROP INDEX IF EXISTS idx_osm_addresses_geom")
+      await conn.execute(MERGE_SQL)
+      if replace:
+        await conn.execute("CREATE INDEX idx_osm_addresses_geom ON osm_addresses USING GIST (geom)")
+    await conn.execute("ANALYZE osm_addresses")
+    print(f"imported {total} rows in {time.monotonic() - t0:.1f}s", file=sys.stderr)
+    return total
+  finally:
+    await conn.close()
+
+
+def main():
+  ap = argparse.ArgumentParser(description="Import OSM addresses/streets for offline reverse geocoding")
+  ap.add_argument("path", help=".osm.pbf, .geojson or .geojsonseq")
+  ap.add_argument("--replace", action="store_true",
+                  help="truncate osm_addresses before import (without it objects are upserted by OSM id)")
+  args = ap.parse_args()
+  asyncio.run(import_file(args.path, replace=args.replace))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,217 @@
+import os, hmac, json, math, time, hashlib, ipaddress
+from collections import OrderedDict
+from typing import Any, Optional
+from urllib.parse import parse_qs, parse_qsl
+
+from fastapi import HTTPException
+
+from . import coord
+
+# Token bucket'ы в памяти процесса: по клиенту и по маршруту в целом.
+# Клиент — IP из X-Forwarded-For, но только от доверенного прокси (Caddy); tg_id — только
+# проверенный: от бота с internal token или из подписанного initData мини-приложения.
+# Память ограничена: LRU на RL_MAX_BUCKETS, простаивающие bucket'ы вытесняются
+# (простоявший дольше времени наполнения bucket и так полный — терять нечего).
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN","")
+RL_ENABLED = os.getenv("RL_ENABLED","1") == "1"
+RL_MAX_BUCKETS = int(os.getenv("RL_MAX_BUCKETS","50000"))
+RL_IDLE_SECONDS = float(os.getenv("RL_IDLE_SECONDS","300"))
+# сколько запросов одновременно в обработке, после чего режем низкий приоритет
+RL_SHED_INFLIGHT = int(os.getenv("RL_SHED_INFLIGHT","200"))
+# адреса прокси, которым верим X-Forwarded-For (по умолчанию — приватные сети docker)
+RL_TRUSTED_PROXIES = [ipaddress.ip_network(x.strip()) for x in os.getenv(
+  "RL_TRUSTED_PROXIES","127.0.0.0/8,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,::1/128,fc00::/7").split(",") if x.strip()]
+TG_BOT_TOKEN = os.getenv("TG_BOT_TOKEN","")
+TG_INIT_DATA_MAX_AGE_SECONDS = int(os.getenv("TG_INIT_DATA_MAX_AGE_SECONDS","86400"))
+
+
+def _share(rps: float, burst: float) -> tuple[float, float]:
+  # запросы клиента распределяются по воркерам — каждому своя доля лимита
+  return rps / coord.WEB_CONCURRENCY, coord.worker_share(burst)
+
+
+# name, prefix, priority, (rps, burst) на клиента, (rps, burst) на маршрут целиком
+ROUTES = [
+  ("geo", "/api/geo/", "low",
+   _share(float(os.getenv("RL_GEO_RPS","2")), float(os.getenv("RL_GEO_BURST","10"))),
+   _share(float(os.getenv("RL_GEO_ROUTE_RPS","50")), float(os.getenv("RL_GEO_ROUTE_BURST","100")))),
+  ("nearby", "/api/drivers/nearby", "low",
+   _share(float(os.getenv("RL_NEARBY_RPS","1")), float(os.getenv("RL_NEARBY_BURST","5"))),
+   _share(float(os.getenv("RL_NEARBY_ROUTE_RPS","200")), float(os.getenv("RL_NEARBY_ROUTE_BURST","400")))),
+  ("orders", "/api/orders/create", "high",
+   _share(float(os.getenv("RL_ORDERS_RPS","0.2")), float(os.getenv("RL_ORDERS_BURST","3"))),
+   _share(float(os.getenv("RL_ORDERS_ROUTE_RPS","20")), float(os.getenv("RL_ORDERS_ROUTE_BURST","40")))),
+]
+
+stats: dict[str, Any] = {"inflight": 0, "limited": {}, "shed": {}, "buckets": 0}
+
+
+class Buckets:
+  def __init__(self, max_size: int):
+    self.max_size = max_size
+    self.items: OrderedDict[tuple, list[float]] = OrderedDict()  # key -> [tokens, last_ts]
+
+  def take(self, key: tuple, rps: float, burst: float, now: float) -> float:
+    # 0 — пропускаем; >0 — сколько секунд ждать до следующего токена
+    b = self.items.get(key)
+    if b is None:
+      self._evict(now)
+      b = self.items[key] = [burst, now]
+    else:
+      self.items.move_to_end(key)
+      b[0] = min(burst, b[0] + (now - b[1]) * rps)
+      b[1] = now
+    if b[0] >= 1.0:
+      b[0] -= 1.0
+      return 0.0
+    return (1.0 - b[0]) / rps if rps > 0 else 60.0
+
+  def _evict(self, now: float):
+    while self.items:
+      key, (_, last) = next(iter(self.items.items()))
+      if len(self.items) < self.max_size and now - last < RL_IDLE_SECONDS:
+        break
+      self.items.popitem(last=False)
+
+
+buckets = Buckets(RL_MAX_BUCKETS)
+
+
+def _route(path: str):
+  for r in ROUTES:
+    if path.startswith(r[1]):
+      return r
+  return None
+
+
+def _trusted(addr: str) -> bool:
+  try:
+    ip = ipaddress.ip_address(addr)
+  except ValueError:
+    return False
+  return any(ip in net for net in RL_TRUSTED_PROXIES)
+
+
+def client_ip(scope) -> Optional[str]:
+  # справа налево по цепочке прокси: первый недоверенный адрес и есть клиент;
+  # левые элементы X-Forwarded-For клиент может подставить сам
+  client = scope.get("client")
+  peer = client[0] if client else None
+  if peer is None or not _trusted(peer):
+    return peer
+  fwd = dict(scope.get("headers") or []).get(b"x-forwarded-for")
+  if not fwd:
+    return peer
+  for addr in reversed([x.strip() for x in fwd.decode("latin-1").split(",")]):
+    if addr and not _trusted(addr):
+      return addr
+  return peer
+
+
+def init_data_user(init_data: str) -> Optional[int]:
+  # Telegram WebApp initData: hash = HMAC(HMAC("WebAppData", bot_token), data_check_string)
+  if not TG_BOT_TOKEN or not init_data:
+    return None
+  pairs = dict(parse_qsl(init_data, keep_blank_values=True))
+  got = pairs.pop("hash", "")
+  check = "\n".join(f"{k}={v}" for k, v in sorted(pairs.items()))
+  secret = hmac.new(b"WebAppData", TG_BOT_TOKEN.encode(), hashlib.sha256).digest()
+  if not hmac.compare_digest(hmac.new(secret, check.encode(), hashlib.sha256).hexdigest(), got):
+    return None
+  try:
+    if time.time() - int(pairs.get("auth_date","0")) > TG_INIT_DATA_MAX_AGE_SECONDS:
+      return None
+    return int(json.loads(pairs.get("user") or "{}")["id"])
+  except (ValueError, KeyError, TypeError):
+    return None
+
+
+def _client_key(scope, internal: bool) -> Optional[str]:
+  headers = dict(scope.get("headers") or [])
+  if internal:
+    # бот сам подставляет пользователя — ему верим по internal token
+    qs = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    for name in ("tg_id", "tg_user_id"):
+      if qs.get(name):
+        return f"tg:{qs[name][0]}"
+    tg = headers.get(b"x-tg-id")
+    return f"tg:{tg.decode('latin-1')}" if tg else None
+  tg_user = init_data_user(headers.get(b"x-telegram-init-data", b"").decode("latin-1"))
+  if tg_user is not None:
+    return f"tg:{tg_user}"
+  ip = client_ip(scope)
+  return f"ip:{ip}" if ip else None
+
+
+def _is_internal(scope) -> bool:
+  token = dict(scope.get("headers") or []).get(b"x-internal-token", b"")
+  return bool(INTERNAL_TOKEN) and token.decode("latin-1") == INTERNAL_TOKEN
+
+
+def _count(kind: str, name: str):
+  stats[kind][name] = stats[kind].get(name, 0) + 1
+
+
+async def _reject(send, status: int, retry_after: float, detail: str):
+  body = json.dumps({"detail": detail}).encode()
+  await send({
+    "type": "http.response.start",
+    "status": status,
+    "headers": [
+      (b"content-type", b"application/json"),
+      (b"content-length", str(len(body)).encode()),
+      (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+    ],
+  })
+  await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http" or not RL_ENABLED:
+      return await self.app(scope, receive, send)
+
+    route = _route(scope["path"])
+    if route:
+      name, _, priority, per_client, per_route = route
+      if priority == "low" and stats["inflight"] >= RL_SHED_INFLIGHT:
+        _count("shed", name)
+        return await _reject(send, 503, 1, "overloaded")
+
+      now = time.monotonic()
+      # сначала bucket клиента: отказанный по своему лимиту запрос не тратит общий бюджет маршрута.
+      # Внутренние вызовы (бот) идут от одного адреса за всех — для них лимит по tg_id, если передан
+      wait = 0.0
+      key = _client_key(scope, _is_internal(scope))
+      if key:
+        wait = buckets.take((name, key), per_client[0], per_client[1], now)
+      if not wait:
+        wait = buckets.take((name, "*"), per_route[0], per_route[1], now)
+      stats["buckets"] = len(buckets.items)
+      if wait:
+        _count("limited", name)
+        return await _reject(send, 429, wait, "rate limited")
+
+    stats["inflight"] += 1
+    try:
+      await self.app(scope, receive, send)
+    finally:
+      stats["inflight"] -= 1
+
+
+def enforce_user(route_name: str, user_key: Any):
+  # лимит на пользователя внутри обработчика (когда id есть только в теле запроса)
+  if not RL_ENABLED:
+    return
+  route = next((r for r in ROUTES if r[0] == route_name), None)
+  if not route:
+    return
+  rps, burst = route[3]
+  wait = buckets.take((route_name, f"user:{user_key}"), rps, burst, time.monotonic())
+  if wait:
+    _count("limited", route_name)
+    raise HTTPException(status_code=429, detail="rate limited",
+                        headers={"Retry-After": str(max(1, math.ceil(wait)))})
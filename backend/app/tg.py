@@ -0,0 +1,81 @@
+import os, logging
+from typing import Any, Optional
+
+import httpx
+
+from . import tracing
+
+# Вызовы Telegram Bot API из backend'а: общий клиент с keep-alive, send возвращает message_id
+# (нужен для последующего editMessageText).
+TG_BOT_TOKEN = os.getenv("TG_BOT_TOKEN","")
+
+log = logging.getLogger("taxi.tg")
+
+stats: dict[str, int] = {"sent": 0, "edited": 0, "failed": 0, "edit_retry": 0}
+
+# результат edit(): правка прошла / сообщения для правки нет (нужно новое) / повторить позже / бросить
+EDIT_OK, EDIT_GONE, EDIT_RETRY, EDIT_FAILED = "ok", "gone", "retry", "failed"
+EDIT_GONE_ERRORS = ("message to edit not found", "message can't be edited", "message_id_invalid")
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http() -> httpx.AsyncClient:
+  global _client
+  if _client is None:
+    _client = httpx.AsyncClient(timeout=15)
+  return _client
+
+
+async def close():
+  global _client
+  if _client is not None:
+    await _client.aclose()
+    _client = None
+
+
+async def _call(method: str, payload: dict[str, Any]) -> dict[str, Any]:
+  if not TG_BOT_TOKEN:
+    return {"ok": False, "description": "no token"}
+  try:
+    with tracing.span(f"telegram.{method}", "client"):
+      r = await _http().post(f"https://api.telegram.org/bot{TG_BOT_TOKEN}/{method}", json=payload)
+    data = r.json()
+  except Exception:
+    log.exception("telegram %s failed", method)
+    return {"ok": False, "description": "request failed"}
+  return data
+
+
+async def send(chat_id: int, text: str) -> Optional[int]:
+  if not chat_id:
+    return None
+  data = await _call("sendMessage", {"chat_id": chat_id, "text": text, "disable_web_page_preview": True})
+  if not data.get("ok"):
+    stats["failed"] += 1
+    return None
+  stats["sent"] += 1
+  return int(data["result"]["message_id"])
+
+
+async def edit(chat_id: int, message_id: int, text: str) -> tuple[str, float]:
+  # (EDIT_*, retry_after в секундах — для EDIT_RETRY)
+  data = await _call("editMessageText", {
+    "chat_id": chat_id, "message_id": message_id, "text": text, "disable_web_page_preview": True,
+  })
+  if data.get("ok"):
+    stats["edited"] += 1
+    return EDIT_OK, 0.0
+  desc = str(data.get("description","")).lower()
+  # тот же текст — сообщение уже актуально
+  if "message is not modified" in desc:
+    return EDIT_OK, 0.0
+  code = data.get("error_code")
+  # 429, 5xx и сетевые ошибки — временные: правку повторяют, а не шлют новое сообщение
+  if code == 429 or (isinstance(code, int) and code >= 500) or desc == "request failed":
+    stats["edit_retry"] += 1
+    return EDIT_RETRY, float((data.get("parameters") or {}).get("retry_after") or 0)
+  stats["failed"] += 1
+  if any(e in desc for e in EDIT_GONE_ERRORS):
+    return EDIT_GONE, 0.0
+  return EDIT_FAILED, 0.0
@@ -0,0 +1,93 @@
+import os, json, asyncio
+from collections import deque
+from typing import Any
+
+from fastapi import FastAPI, HTTPException, Request
+
+# Локальная замена OTLP-коллектора: принимает OTLP/HTTP JSON (POST /v1/traces) от backend и bot_tg,
+# пишет спаны построчно в JSONL и собирает трассу целиком по trace_id (сервисы вперемешку).
+#   docker compose --profile tracing up -d  ->  TRACE_OTLP_URL=http://trace_collector:4318/v1/traces
+#   GET /traces?min_ms=5000      — медленные корневые запросы
+#   GET /traces/<trace_id>       — все спаны трассы по времени, со смещением от начала
+TRACE_COLLECTOR_FILE = os.getenv("TRACE_COLLECTOR_FILE","/data/traces.jsonl")
+TRACE_COLLECTOR_KEEP = int(os.getenv("TRACE_COLLECTOR_KEEP","100000"))
+
+app = FastAPI(title="Trace collector")
+
+_spans: deque = deque(maxlen=TRACE_COLLECTOR_KEEP)
+
+
+def _value(v: dict[str, Any]) -> Any:
+  if "intValue" in v:
+    return int(v["intValue"])
+  for k in ("stringValue", "doubleValue", "boolValue"):
+    if k in v:
+      return v[k]
+  return None
+
+
+def _attrs(items: list[dict[str, Any]]) -> dict[str, Any]:
+  return {a["key"]: _value(a.get("value") or {}) for a in items or []}
+
+
+def flatten(body: dict[str, Any]) -> list[dict[str, Any]]:
+  out = []
+  for rs in body.get("resourceSpans") or []:
+    service = _attrs((rs.get("resource") or {}).get("attributes")).get("service.name","unknown")
+    for ss in rs.get("scopeSpans") or []:
+      for sp in ss.get("spans") or []:
+        start, end = int(sp["startTimeUnixNano"]), int(sp["endTimeUnixNano"])
+        status = sp.get("status") or {}
+        out.append({
+          "trace_id": sp["traceId"], "span_id": sp["spanId"], "parent_id": sp.get("parentSpanId") or None,
+          "service": service, "name": sp.get("name",""), "kind": sp.get("kind", 1),
+          "start": start / 1e9, "duration_ms": round((end - start) / 1e6, 2),
+          "attrs": _attrs(sp.get("attributes")),
+          "error": status.get("message") if status.get("code") == 2 else None,
+        })
+  return out
+
+
+def _append_file(lines: str):
+  with open(TRACE_COLLECTOR_FILE, "a", encoding="utf-8") as f:
+    f.write(lines)
+
+
+@app.post("/v1/traces")
+async def ingest(request: Request):
+  if "json" not in request.headers.get("content-type",""):
+    raise HTTPException(status_code=415, detail="only OTLP/HTTP JSON is supported")
+  spans = flatten(json.loads(await request.body()))
+  _spans.extend(spans)
+  if TRACE_COLLECTOR_FILE:
+    await asyncio.to_thread(_append_file, "".join(json.dumps(s, ensure_ascii=False) + "\n" for s in spans))
+  return {"partialSuccess": {}}
+
+
+@app.get("/traces")
+async def slow_roots(min_ms: float = 0, limit: int = 50):
+  # корень — спан без родителя или с родителем, который сюда не экспортировался (бот без TRACE_OTLP_URL)
+  known = {s["span_id"] for s in _spans}
+  roots = [s for s in _spans if s["parent_id"] not in known and s["duration_ms"] >= min_ms]
+  return sorted(roots, key=lambda s: s["start"], reverse=True)[:limit]
+
+
+@app.get("/traces/{trace_id}")
+async def trace(trace_id: str):
+  spans = sorted((s for s in _spans if s["trace_id"] == trace_id), key=lambda s: s["start"])
+  if not spans:
+    raise HTTPException(status_code=404, detail="trace not found")
+  t0 = spans[0]["start"]
+  by_id = {s["span_id"]: s for s in spans}
+
+  def depth(s: dict[str, Any]) -> int:
+    d = 0
+    while s["parent_id"] in by_id and d < 64:
+      s, d = by_id[s["parent_id"]], d + 1
+    return d
+
+  return {
+    "trace_id": trace_id,
+    "duration_ms": round(max(s["start"] * 1000 + s["duration_ms"] for s in spans) - t0 * 1000, 2),
+    "spans": [{**s, "offset_ms": round((s["start"] - t0) * 1000, 2), "depth": depth(s)} for s in spans],
+  }
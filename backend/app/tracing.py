@@ -0,0 +1,293 @@
+import os, json, time, random, asyncio, logging, contextvars
+from contextlib import contextmanager
+from typing import Any, Optional
+
+import httpx
+
+# Трассировка запроса сквозь сервисы: bot_tg -> backend -> Postgres / Taxomet / геокодер / Telegram.
+# Контекст — заголовок W3C traceparent (00-<trace_id>-<span_id>-<flags>). Решение о сэмплировании
+# принимает корень (бот) и передаёт флагом; запрос без заголовка сэмплируется с TRACE_SAMPLE_RATE.
+# У несэмплированного запроса текущий спан None — span() ничего не создаёт.
+# Спаны копятся в памяти и уходят пачками в фоне: JSONL-файл (TRACE_FILE) и/или
+# OTLP/HTTP JSON (TRACE_OTLP_URL, например http://trace_collector:4318/v1/traces).
+# Бот своего экспортёра не держит: его спаны приходят в POST /api/traces (ingest) и уходят отсюда же.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE","0.05"))
+TRACE_FILE = os.getenv("TRACE_FILE","")
+TRACE_OTLP_URL = os.getenv("TRACE_OTLP_URL","")
+TRACE_SERVICE = os.getenv("TRACE_SERVICE","backend")
+TRACE_FLUSH_SECONDS = float(os.getenv("TRACE_FLUSH_SECONDS","2"))
+TRACE_BUFFER_MAX = int(os.getenv("TRACE_BUFFER_MAX","20000"))
+TRACE_STATEMENT_MAX = int(os.getenv("TRACE_STATEMENT_MAX","300"))
+
+ENABLED = bool(TRACE_FILE or TRACE_OTLP_URL)
+
+KINDS = {"internal": 1, "server": 2, "client": 3}
+
+log = logging.getLogger("taxi.tracing")
+
+stats: dict[str, int] = {"requests": 0, "sampled": 0, "spans": 0, "exported": 0, "dropped": 0, "export_errors": 0}
+
+
+class Span:
+  __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start", "end", "attrs", "error", "service")
+
+  def __init__(self, trace_id: str, parent_id: Optional[str], name: str, kind: str, attrs: dict[str, Any]):
+    self.trace_id = trace_id
+    self.span_id = _id(8)
+    self.parent_id = parent_id
+    self.name = name
+    self.kind = kind
+    self.start = time.time()
+    self.end = 0.0
+    self.attrs = attrs
+    self.error: Optional[str] = None
+    self.service = TRACE_SERVICE
+
+  def set(self, **attrs: Any):
+    self.attrs.update(attrs)
+
+  def traceparent(self) -> str:
+    return f"00-{self.trace_id}-{self.span_id}-01"
+
+  def as_dict(self) -> dict[str, Any]:
+    return {
+      "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+      "service": self.service, "name": self.name, "kind": self.kind,
+      "start": round(self.start, 6), "duration_ms": round((self.end - self.start) * 1000, 2),
+      "attrs": self.attrs, "error": self.error,
+    }
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("trace_span", default=None)
+_done: list[Span] = []
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _id(nbytes: int) -> str:
+  return f"{random.getrandbits(nbytes * 8):0{nbytes * 2}x}"
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple[str, str, bool]]:
+  # (trace_id, parent span_id, sampled) или None, если заголовка нет / он битый
+  if not value:
+    return None
+  parts = value.strip().split("-")
+  if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+    return None
+  try:
+    flags = int(parts[3][:2], 16)
+    int(parts[1], 16), int(parts[2], 16)
+  except ValueError:
+    return None
+  if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+    return None
+  return parts[1], parts[2], bool(flags & 1)
+
+
+def current() -> Optional[Span]:
+  return _current.get()
+
+
+def headers() -> dict[str, str]:
+  # для исходящих вызовов своих сервисов; во внешние API контекст не отдаём
+  s = _current.get()
+  return {"traceparent": s.traceparent()} if s else {}
+
+
+def _finish(s: Span):
+  s.end = s.end or time.time()
+  if len(_done) >= TRACE_BUFFER_MAX:
+    stats["dropped"] += 1
+    return
+  stats["spans"] += 1
+  _done.append(s)
+
+
+@contextmanager
+def root(name: str, traceparent: Optional[str] = None, kind: str = "server", **attrs: Any):
+  # входящий запрос: продолжить трассу вызывающего или начать новую (по TRACE_SAMPLE_RATE)
+  if not ENABLED:
+    yield None
+    return
+  stats["requests"] += 1
+  parent = parse_traceparent(traceparent)
+  if parent is not None:
+    sampled = parent[2]
+  else:
+    sampled = random.random() < TRACE_SAMPLE_RATE
+  if not sampled:
+    token = _current.set(None)
+    try:
+      yield None
+    finally:
+      _current.reset(token)
+    return
+  stats["sampled"] += 1
+  s = Span(parent[0] if parent else _id(16), parent[1] if parent else None, name, kind, attrs)
+  token = _current.set(s)
+  try:
+    yield s
+  except BaseException as e:
+    s.error = repr(e)[:300]
+    raise
+  finally:
+    _current.reset(token)
+    _finish(s)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attrs: Any):
+  parent = _current.get()
+  if parent is None:
+    yield None
+    return
+  s = Span(parent.trace_id, parent.span_id, name, kind, attrs)
+  token = _current.set(s)
+  try:
+    yield s
+  except BaseException as e:
+    s.error = repr(e)[:300]
+    raise
+  finally:
+    _current.reset(token)
+    _finish(s)
+
+
+def ingest(items: list[dict[str, Any]]) -> int:
+  # готовые спаны другого сервиса (bot_tg): формат — его Span.as_dict()
+  n = 0
+  for it in items:
+    try:
+      s = Span(str(it["trace_id"]), it.get("parent_id"), str(it["name"]), str(it.get("kind") or "internal"),
+               dict(it.get("attrs") or {}))
+      s.span_id = str(it["span_id"])
+      s.start, s.end = float(it["start"]), float(it["end"])
+      s.error = it.get("error")
+      s.service = str(it.get("service") or "unknown")
+    except (KeyError, TypeError, ValueError):
+      continue
+    _finish(s)
+    n += 1
+  return n
+
+
+def on_query(record):
+  # asyncpg query logger: вызывается через call_soon с контекстом запроса — родитель виден
+  parent = _current.get()
+  if parent is None:
+    return
+  s = Span(parent.trace_id, parent.span_id, "db.query", "client",
+           {"db.statement": " ".join(record.query.split())[:TRACE_STATEMENT_MAX]})
+  s.end = time.time()
+  s.start = s.end - record.elapsed
+  if record.exception is not None:
+    s.error = repr(record.exception)[:300]
+  _finish(s)
+
+
+class TracingMiddleware:
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http" or not ENABLED or scope["path"] == "/api/traces":
+      return await self.app(scope, receive, send)
+
+    tp = None
+    for k, v in scope.get("headers") or []:
+      if k == b"traceparent":
+        tp = v.decode("latin-1")
+        break
+    with root(f'{scope["method"]} {scope["path"]}', tp, **{"http.method": scope["method"], "http.path": scope["path"]}) as s:
+      if s is None:
+        return await self.app(scope, receive, send)
+
+      async def send_traced(message):
+        if message["type"] == "http.response.start":
+          s.attrs["http.status"] = message["status"]
+          message.setdefault("headers", [])
+          message["headers"] = list(message["headers"]) + [(b"x-trace-id", s.trace_id.encode())]
+        await send(message)
+
+      try:
+        await self.app(scope, receive, send_traced)
+      finally:
+        # шаблон маршрута известен только после роутинга
+        route = scope.get("route")
+        if route is not None and getattr(route, "path", None):
+          s.name = f'{scope["method"]} {route.path}'
+
+
+def _attr(k: str, v: Any) -> dict[str, Any]:
+  if isinstance(v, bool):
+    val = {"boolValue": v}
+  elif isinstance(v, int):
+    val = {"intValue": str(v)}
+  elif isinstance(v, float):
+    val = {"doubleValue": v}
+  else:
+    val = {"stringValue": str(v)}
+  return {"key": k, "value": val}
+
+
+def otlp_body(spans: list[Span]) -> dict[str, Any]:
+  # resource — на сервис: в пачке есть и спаны бота (ingest)
+  by_service: dict[str, list[dict[str, Any]]] = {}
+  for s in spans:
+    item: dict[str, Any] = {
+      "traceId": s.trace_id, "spanId": s.span_id, "name": s.name, "kind": KINDS.get(s.kind, 1),
+      "startTimeUnixNano": str(int(s.start * 1e9)), "endTimeUnixNano": str(int(s.end * 1e9)),
+      "attributes": [_attr(k, v) for k, v in s.attrs.items()],
+      "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+    }
+    if s.parent_id:
+      item["parentSpanId"] = s.parent_id
+    by_service.setdefault(s.service, []).append(item)
+  return {"resourceSpans": [{
+    "resource": {"attributes": [_attr("service.name", service)]},
+    "scopeSpans": [{"scope": {"name": "taxi"}, "spans": out}],
+  } for service, out in by_service.items()]}
+
+
+def _append_file(lines: str):
+  with open(TRACE_FILE, "a", encoding="utf-8") as f:
+    f.write(lines)
+
+
+async def flush():
+  global _client
+  if not _done:
+    return
+  batch = _done[:]
+  del _done[:]
+  try:
+    if TRACE_FILE:
+      lines = "".join(json.dumps(s.as_dict(), ensure_ascii=False) + "\n" for s in batch)
+      await asyncio.to_thread(_append_file, lines)
+    if TRACE_OTLP_URL:
+      if _client is None:
+        _client = httpx.AsyncClient(timeout=5)
+      r = await _client.post(TRACE_OTLP_URL, json=otlp_body(batch))
+      r.raise_for_status()
+    stats["exported"] += len(batch)
+  except Exception:
+    # трассы — диагностика: при недоступном коллекторе пачку выбрасываем, а не копим
+    stats["export_errors"] += 1
+    stats["dropped"] += len(batch)
+    log.warning("trace export failed", exc_info=True)
+
+
+async def run():
+  if not ENABLED:
+    return
+  while True:
+    await asyncio.sleep(TRACE_FLUSH_SECONDS)
+    await flush()
+
+
+async def close():
+  global _client
+  await flush()
+  if _client is not None:
+    await _client.aclose()
+    _client = None
@@ -0,0 +1,346 @@
+import os, sys, csv, json, time, codecs, asyncio, argparse
+from collections import deque
+from typing import Any, AsyncIterator, Optional
+
+from .users import normalize_phone
+
+# Массовый импорт пользователей и водителей (онбординг парка): CSV или JSONL потоком,
+# телефоны — по правилам normalize_phone, строки пачками через COPY во временную таблицу,
+# слияние в users/drivers — одним set-based запросом. Ошибки — построчно (номер строки файла).
+#   docker compose exec backend python -m app.user_import /data/drivers.csv [--dry-run]
+# Поля: tg_id, vk_id, phone, full_name, username, role (client|driver), driver_id.
+# Ключ пользователя — tg_id, иначе vk_id; водитель — driver_id (по умолчанию = tg_id, как в /api/drivers/location).
+USER_IMPORT_BATCH = int(os.getenv("USER_IMPORT_BATCH","5000"))
+USER_IMPORT_MAX_ERRORS = int(os.getenv("USER_IMPORT_MAX_ERRORS","1000"))
+
+FIELDS = ["tg_id", "vk_id", "phone", "full_name", "username", "role", "driver_id"]
+STAGE_COLUMNS = ["line_no"] + FIELDS
+
+STAGE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS user_import_stage(
+  line_no INT, tg_id BIGINT, vk_id BIGINT, phone TEXT, full_name TEXT, username TEXT, role TEXT, driver_id BIGINT
+) ON COMMIT DROP;
+"""
+
+# конфликты, которые не выразить в ON CONFLICT: повтор ключа в файле (берём последнюю строку),
+# vk_id / tg_id водителя, уже занятые другим пользователем / водителем
+CONFLICTS_SQL = """
+WITH s AS (
+  SELECT *,
+         row_number() OVER (PARTITION BY tg_id IS NULL, COALESCE(tg_id, vk_id) ORDER BY line_no DESC) AS key_rank,
+         CASE WHEN vk_id IS NOT NULL
+              THEN row_number() OVER (PARTITION BY vk_id ORDER BY line_no DESC) END AS vk_rank,
+         CASE WHEN role = 'driver'
+              THEN row_number() OVER (PARTITION BY role, COALESCE(driver_id, tg_id) ORDER BY line_no DESC) END AS driver_rank
+  FROM user_import_stage
+)
+SELECT line_no,
+       CASE
+         WHEN key_rank > 1 THEN 'duplicate user in file, later line wins'
+         WHEN vk_rank > 1 THEN 'vk_id repeated in file, later line wins'
+         WHEN driver_rank > 1 THEN 'duplicate driver_id in file, later line wins'
+         WHEN tg_id IS NOT NULL AND vk_id IS NOT NULL AND EXISTS (
+           SELECT 1 FROM users u WHERE u.vk_id = s.vk_id AND u.tg_id IS DISTINCT FROM s.tg_id)
+           THEN 'vk_id belongs to another user'
+         WHEN role = 'driver' AND tg_id IS NOT NULL AND EXISTS (
+           SELECT 1 FROM drivers d WHERE d.tg_id = s.tg_id AND d.driver_id <> COALESCE(s.driver_id, s.tg_id))
+           THEN 'tg_id belongs to another driver'
+       END AS error
+FROM s
+"""
+
+# роль из файла: пустая не затирает существующую; 'client' по умолчанию — только новым (CLIENT_ROLE_SQL)
+MERGE_SQL = """
+WITH by_tg AS (
+  INSERT INTO users(tg_id, vk_id, phone, full_name, username, role, updated_at)
+  SELECT tg_id, vk_id, phone, full_name, username, role, now()
+  FROM user_import_stage WHERE tg_id IS NOT NULL
+  ON CONFLICT (tg_id) DO UPDATE SET
+    vk_id = COALESCE(EXCLUDED.vk_id, users.vk_id),
+    phone = EXCLUDED.phone,
+    full_name = COALESCE(EXCLUDED.full_name, users.full_name),
+    username = COALESCE(EXCLUDED.username, users.username),
+    role = CASE WHEN $1 THEN COALESCE(EXCLUDED.role, users.role) ELSE COALESCE(users.role, EXCLUDED.role) END,
+    updated_at = now()
+  RETURNING id, role, (xmax = 0) AS inserted
+), by_vk AS (
+  INSERT INTO users(vk_id, phone, full_name, username, role, updated_at)
+  SELECT vk_id, phone, full_name, username, role, now()
+  FROM user_import_stage WHERE tg_id IS NULL
+  ON CONFLICT (vk_id) DO UPDATE SET
+    phone = EXCLUDED.phone,
+    full_name = COALESCE(EXCLUDED.full_name, users.full_name),
+    username = COALESCE(EXCLUDED.username, users.username),
+    role = CASE WHEN $1 THEN COALESCE(EXCLUDED.role, users.role) ELSE COALESCE(users.role, EXCLUDED.role) END,
+    updated_at = now()
+  RETURNING id, role, (xmax = 0) AS inserted
+), drv AS (
+  INSERT INTO drivers(driver_id, tg_id, phone, name)
+  SELECT COALESCE(driver_id, tg_id), tg_id, phone, full_name
+  FROM user_import_stage WHERE role = 'driver'
+  ON CONFLICT (driver_id) DO UPDATE SET
+    tg_id = COALESCE(EXCLUDED.tg_id, drivers.tg_id),
+    phone = EXCLUDED.phone,
+    name = COALESCE(EXCLUDED.name, drivers.name)
+  RETURNING (xmax = 0) AS inserted
+), u AS (
+  SELECT * FROM by_tg UNION ALL SELECT * FROM by_vk
+)
+SELECT
+  (SELECT count(*) FILTER (WHERE inserted) FROM u) AS users_inserted,
+  (SELECT count(*) FILTER (WHERE NOT inserted) FROM u) AS users_updated,
+  (SELECT count(*) FILTER (WHERE inserted) FROM drv) AS drivers_inserted,
+  (SELECT count(*) FILTER (WHERE NOT inserted) FROM drv) AS drivers_updated,
+  (SELECT COALESCE(array_agg(id), '{}') FROM u WHERE inserted AND role IS NULL) AS new_without_role
+"""
+
+CLIENT_ROLE_SQL = "UPDATE users SET role = 'client' WHERE id = ANY($1::bigint[])"
+
+
+def _int(v: Any) -> Optional[int]:
+  if v is None or (isinstance(v, str) and not v.strip()):
+    return None
+  return int(v)
+
+
+def _text(v: Any) -> Optional[str]:
+  if v is None:
+    return None
+  v = str(v).strip()
+  return v or None
+
+
+def parse_row(line_no: int, raw: dict[str, Any]) -> tuple:
+  # ValueError — строка в отчёт об ошибках
+  tg_id, vk_id, driver_id = _int(raw.get("tg_id")), _int(raw.get("vk_id")), _int(raw.get("driver_id"))
+  if tg_id is None and vk_id is None:
+    raise ValueError("tg_id or vk_id required")
+  phone = normalize_phone(str(raw.get("phone") or ""))
+  role = _text(raw.get("role"))
+  role = role.lower() if role else None
+  if role not in (None, "client", "driver"):
+    raise ValueError("role must be client|driver")
+  if role == "driver" and driver_id is None and tg_id is None:
+    raise ValueError("driver needs driver_id or tg_id")
+  return (line_no, tg_id, vk_id, phone, _text(raw.get("full_name")), _text(raw.get("username")), role, driver_id)
+
+
+def _bad_bytes(v: Any) -> bool:
+  # поток декодируется с errors="surrogateescape": невалидные байты UTF-8 -> U+DC80..U+DCFF
+  if isinstance(v, dict):
+    return any(_bad_bytes(x) for x in v.values())
+  if isinstance(v, list):
+    return any(_bad_bytes(x) for x in v)
+  return isinstance(v, str) and any("\udc80" <= ch <= "\udcff" for ch in v)
+
+
+class _Records:
+  # текст кусками -> законченные записи (номер последней строки записи, запись).
+  # У CSV запись кончается на переводе строки вне кавычек (чётное число '"' с начала записи)
+  def __init__(self, quoted: bool):
+    self.quoted = quoted
+    self.buf = ""
+    self.scan = 0
+    self.quotes = 0
+    self.lines = 0
+
+  def feed(self, text: str, final: bool = False) -> list[tuple[int, str]]:
+    self.buf += text
+    out: list[tuple[int, str]] = []
+    start = 0
+    while True:
+      nl = self.buf.find("\n", self.scan)
+      if nl < 0:
+        break
+      self.quotes += self.buf.count('"', self.scan, nl)
+      self.lines += 1
+      self.scan = nl + 1
+      if self.quoted and self.quotes % 2:
+        continue
+      out.append((self.lines, self.buf[start:self.scan]))
+      start, self.quotes = self.scan, 0
+    if final and start < len(self.buf):
+      self.lines += 1
+      out.append((self.lines, self.buf[start:]))
+      start = self.scan = len(self.buf)
+    self.buf = self.buf[start:]
+    self.scan -= start
+    return out
+
+
+class _Feed:
+  # итератор строк для csv.reader, который можно пополнять: reader зовётся, только когда здесь
+  # лежит целая запись, поэтому «конец» посреди записи он не увидит
+  def __init__(self):
+    self.items: deque[str] = deque()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self) -> str:
+    if not self.items:
+      raise StopIteration
+    return self.items.popleft()
+
+
+async def iter_stream(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[tuple[int, Any]]:
+  # (номер строки файла, dict | Exception) по мере прихода байтов — файл целиком нигде не копится.
+  # Битая строка CSV/JSON или не-UTF-8 байты — ошибка этой строки
+  decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="surrogateescape")
+  records = _Records(quoted=fmt == "csv")
+  feed = _Feed()
+  reader = csv.DictReader(feed)
+  header = fmt != "csv"
+
+  async def decoded():
+    async for chunk in chunks:
+      yield decoder.decode(chunk), False
+    yield decoder.decode(b"", True), True
+
+  async for text, final in decoded():
+    for line_no, rec in records.feed(text, final):
+      if not rec.strip():
+        continue
+      if fmt == "jsonl":
+        line = rec.strip()
+        if _bad_bytes(line):
+          yield line_no, ValueError("bad encoding: not UTF-8")
+          continue
+        try:
+          obj = json.loads(line)
+          yield line_no, obj if isinstance(obj, dict) else ValueError("row must be a JSON object")
+        except ValueError as e:
+          yield line_no, ValueError(f"bad json: {e}")
+        continue
+      feed.items.append(rec)
+      if not header:
+        header = True
+        try:
+          reader.fieldnames
+        except csv.Error as e:
+          yield line_no, ValueError(f"bad csv header: {e}")
+          return
+        continue
+      try:
+        row = next(reader)
+      except csv.Error as e:
+        feed.items.clear()
+        yield line_no, ValueError(f"bad csv: {e}")
+        continue
+      if _bad_bytes(row) or _bad_bytes(reader.fieldnames):
+        yield line_no, ValueError("bad encoding: not UTF-8")
+        continue
+      yield line_no, row
+
+
+async def file_chunks(path: str, size: int = 1 << 20) -> AsyncIterator[bytes]:
+  with open(path, "rb") as f:
+    while True:
+      chunk = f.read(size)
+      if not chunk:
+        return
+      yield chunk
+
+
+class Report:
+  def __init__(self):
+    self.rows = 0
+    self.rejected = 0
+    self.errors: list[dict[str, Any]] = []
+    self.result: dict[str, Any] = {}
+
+  def error(self, line_no: int, msg: str):
+    self.rejected += 1
+    if len(self.errors) < USER_IMPORT_MAX_ERRORS:
+      self.errors.append({"line": line_no, "error": msg})
+
+  def as_dict(self) -> dict[str, Any]:
+    return {
+      "ok": True,
+      "rows": self.rows,
+      "merged": self.rows - self.rejected,
+      "rejected": self.rejected,
+      "errors": sorted(self.errors, key=lambda e: e["line"]),
+      "errors_truncated": self.rejected > len(self.errors),
+      **self.result,
+    }
+
+
+async def import_rows(conn, raw_rows: AsyncIterator[tuple[int, Any]], dry_run: bool = False,
+                      set_role: bool = True) -> dict[str, Any]:
+  # set_role=False — роль из файла только для новых пользователей, существующим не меняем
+  rep = Report()
+  t0 = time.monotonic()
+  tr = conn.transaction()
+  await tr.start()
+  try:
+    await conn.execute(STAGE_SQL)
+    batch: list[tuple] = []
+    async for line_no, raw in raw_rows:
+      rep.rows += 1
+      try:
+        if isinstance(raw, Exception):
+          raise raw
+        batch.append(parse_row(line_no, raw))
+      except (ValueError, TypeError) as e:
+        rep.error(line_no, str(e))
+      if len(batch) >= USER_IMPORT_BATCH:
+        await conn.copy_records_to_table("user_import_stage", records=batch, columns=STAGE_COLUMNS)
+        batch = []
+    if batch:
+      await conn.copy_records_to_table("user_import_stage", records=batch, columns=STAGE_COLUMNS)
+
+    bad = [(r["line_no"], r["error"]) for r in await conn.fetch(CONFLICTS_SQL) if r["error"]]
+    for line_no, msg in bad:
+      rep.error(line_no, msg)
+    if bad:
+      await conn.execute("DELETE FROM user_import_stage WHERE line_no = ANY($1::int[])", [b[0] for b in bad])
+    res = dict(await conn.fetchrow(MERGE_SQL, set_role))
+    new_without_role = res.pop("new_without_role")
+    if new_without_role:
+      await conn.execute(CLIENT_ROLE_SQL, new_without_role)
+    rep.result = res
+  except BaseException:
+    await tr.rollback()
+    raise
+  if dry_run:
+    await tr.rollback()
+  else:
+    await tr.commit()
+  rep.result["dry_run"] = dry_run
+  rep.result["elapsed_ms"] = round((time.monotonic() - t0) * 1000, 1)
+  return rep.as_dict()
+
+
+def detect_format(name: str, fmt: Optional[str] = None) -> str:
+  if fmt:
+    return fmt
+  return "jsonl" if name.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+async def import_file(path: str, fmt: Optional[str] = None, dry_run: bool = False, set_role: bool = True):
+  import asyncpg
+  from . import db
+
+  conn = await asyncpg.connect(dsn=db.dsn())
+  try:
+    return await import_rows(conn, iter_stream(file_chunks(path), detect_format(path, fmt)), dry_run, set_role)
+  finally:
+    await conn.close()
+
+
+def main():
+  ap = argparse.ArgumentParser(description="Bulk import users/drivers from CSV or JSONL")
+  ap.add_argument("path", help=".csv or .jsonl")
+  ap.add_argument("--format", choices=["csv", "jsonl"])
+  ap.add_argument("--dry-run", action="store_true", help="validate and merge in a rolled back transaction")
+  ap.add_argument("--keep-roles", action="store_true", help="do not change role of existing users")
+  args = ap.parse_args()
+  rep = asyncio.run(import_file(args.path, args.format, args.dry_run, not args.keep_roles))
+  json.dump(rep, sys.stdout, ensure_ascii=False, indent=2)
+  print()
+  sys.exit(1 if rep["rejected"] else 0)
+
+
+if __name__ == "__main__":
+  main()
@@ -1,31 +1,32 @@
 import os, re
 import asyncpg
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Request
 from pydantic import BaseModel
 
+from . import db
+
 router = APIRouter()
 
 INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN","")
-DB_DSN = os.getenv("DB_DSN","")
-POSTGRES_HOST = os.getenv("POSTGRES_HOST","postgres")
-POSTGRES_PORT = int(os.getenv("POSTGRES_PORT","5432"))
-POSTGRES_DB = os.getenv("POSTGRES_DB","taxi")
-POSTGRES_USER = os.getenv("POSTGRES_USER","taxi")
-POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD","")
-
-def _dsn():
-    if DB_DSN:
-        return DB_DSN
-    return f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
 _pool: asyncpg.Pool | None = None
 
+def set_pool(p: asyncpg.Pool):
+    # backend отдаёт свой пул — один пул на воркер вместо двух
+    global _pool
+    _pool = p
+
 async def pool() -> asyncpg.Pool:
     global _pool
     if _pool is None:
-        _pool = await asyncpg.create_pool(dsn=_dsn(), min_size=1, max_size=10)
+        _pool = await asyncpg.create_pool(dsn=db.dsn(), min_size=db.DB_POOL_MIN_SIZE, max_size=db.DB_POOL_MAX_SIZE,
+                                          init=db.init_connection)
     return _pool
 
+# горячий путь бота: поиск пользователя на каждое сообщение
+USER_BY_TG_SQL = db.hot_read("SELECT * FROM users WHERE tg_id=$1", -1)
+USER_BY_VK_SQL = db.hot_read("SELECT * FROM users WHERE vk_id=$1", -1)
+
 def _require_internal(token: str | None):
     if not INTERNAL_TOKEN:
         raise HTTPException(status_code=500, detail="INTERNAL_TOKEN is not set on backend")
@@ -75,7 +76,7 @@ async def _get_or_create_user_by(pool: asyncpg.Pool, tg_id: int | None, vk_id: i
         raise HTTPException(status_code=400, detail="tg_id or vk_id required")
 
     if tg_id:
-        row = await pool.fetchrow("SELECT * FROM users WHERE tg_id=$1", tg_id)
+        row = await pool.fetchrow(USER_BY_TG_SQL, tg_id)
         if row:
             return row
         row = await pool.fetchrow(
@@ -84,7 +85,7 @@ async def _get_or_create_user_by(pool: asyncpg.Pool, tg_id: int | None, vk_id: i
         )
         return row
 
-    row = await pool.fetchrow("SELECT * FROM users WHERE vk_id=$1", vk_id)
+    row = await pool.fetchrow(USER_BY_VK_SQL, vk_id)
     if row:
         return row
     row = await pool.fetchrow(
@@ -117,7 +118,7 @@ async def by_vk(vk_id: int):
     return _row_to_out(row)
 
 @router.post("/api/users/upsert_phone", response_model=UserOut)
-async def upsert_phone(payload: PhoneIn, x_internal_token: str | None = None):
+async def upsert_phone(payload: PhoneIn, x_internal_token: str | None = Header(None)):
     _require_internal(x_internal_token)
     p = await pool()
     try:
@@ -134,7 +135,7 @@ async def upsert_phone(payload: PhoneIn, x_internal_token: str | None = None):
     return _row_to_out(row)
 
 @router.post("/api/users/set_role", response_model=UserOut)
-async def set_role(payload: RoleIn, x_internal_token: str | None = None):
+async def set_role(payload: RoleIn, x_internal_token: str | None = Header(None)):
     _require_internal(x_internal_token)
     role = (payload.role or "").strip().lower()
     if role not in ("client","driver"):
@@ -145,7 +146,7 @@ async def set_role(payload: RoleIn, x_internal_token: str | None = None):
     return _row_to_out(row)
 
 @router.post("/api/users/ui_last")
-async def ui_last(payload: UiLastIn, x_internal_token: str | None = None):
+async def ui_last(payload: UiLastIn, x_internal_token: str | None = Header(None)):
     _require_internal(x_internal_token)
     p = await pool()
     row = await _get_or_create_user_by(p, payload.tg_id, payload.vk_id, None, None)
@@ -154,3 +155,16 @@ async def ui_last(payload: UiLastIn, x_internal_token: str | None = None):
         int(payload.ui_chat_id), int(payload.ui_message_id), row["id"]
     )
     return {"ok": True}
+
+@router.post("/api/users/import")
+async def users_import(request: Request, format: str = "csv", dry_run: bool = False, keep_roles: bool = False,
+                       x_internal_token: str | None = Header(None)):
+    # тело — CSV/JSONL: разбирается и уходит в COPY по мере чтения, целиком нигде не копится
+    _require_internal(x_internal_token)
+    if format not in ("csv", "jsonl"):
+        raise HTTPException(status_code=400, detail="format must be csv|jsonl")
+    from . import user_import  # user_import сам импортирует normalize_phone отсюда
+
+    p = await pool()
+    async with p.acquire() as conn:
+        return await user_import.import_rows(conn, user_import.iter_stream(request.stream(), format), dry_run, not keep_roles)
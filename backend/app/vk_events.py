@@ -0,0 +1,164 @@
+import os, time, asyncio, logging
+from collections import OrderedDict, deque
+from typing import Any, Optional
+
+import httpx
+
+from . import jsonfast
+
+# Конвейер VK Callback API: обработчик /vk/callback только проверяет секрет, кладёт сырое тело
+# в ограниченную очередь и сразу отвечает "ok" (VK ждёт ответа ~несколько секунд и иначе повторяет).
+# Фоновые воркеры разбирают события, отбрасывают повторные доставки (event_id) и пачками
+# передают их VK-боту (bot_vk /events), где живёт логика диалогов.
+# Обратное направление — уведомления клиентам VK: bot_vk /notify (там они пакуются в execute).
+VK_EVENTS_URL = os.getenv("VK_EVENTS_URL","")  # пусто — события только считаются
+VK_NOTIFY_URL = os.getenv("VK_NOTIFY_URL","")
+VK_CALLBACK_QUEUE_MAX = int(os.getenv("VK_CALLBACK_QUEUE_MAX","5000"))
+# >1 ускоряет пересылку, но сообщения одного пользователя могут прийти боту не по порядку
+VK_CALLBACK_WORKERS = int(os.getenv("VK_CALLBACK_WORKERS","1"))
+VK_CALLBACK_BATCH = int(os.getenv("VK_CALLBACK_BATCH","50"))
+VK_CALLBACK_RETRIES = int(os.getenv("VK_CALLBACK_RETRIES","3"))
+VK_DEDUP_SIZE = int(os.getenv("VK_DEDUP_SIZE","20000"))
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN","")
+
+log = logging.getLogger("taxi.vk_events")
+
+_queue: Optional[asyncio.Queue] = None
+# время постановки в очередь, в том же порядке (очередь FIFO): голова — самое старое событие
+_enqueued: deque[float] = deque()
+_seen: OrderedDict[str, None] = OrderedDict()
+_client: Optional[httpx.AsyncClient] = None
+
+stats: dict[str, Any] = {
+  "accepted": 0, "rejected_full": 0, "retried_deliveries": 0, "duplicates": 0, "bad": 0,
+  "forwarded": 0, "forward_errors": 0, "dropped": 0, "discarded": 0,
+  "lag_ms_last": 0.0, "lag_ms_max": 0.0,
+  "notify_sent": 0, "notify_failed": 0,
+}
+
+
+def queue() -> asyncio.Queue:
+  global _queue
+  if _queue is None:
+    _queue = asyncio.Queue(VK_CALLBACK_QUEUE_MAX)
+  return _queue
+
+
+def snapshot() -> dict[str, Any]:
+  return {
+    **stats,
+    "queued": queue().qsize(),
+    "oldest_ms": round((time.monotonic() - _enqueued[0]) * 1000, 2) if _enqueued else 0.0,
+  }
+
+
+def enqueue(body: bytes) -> bool:
+  # False — очередь полна: не отвечаем "ok", VK доставит повторно позже
+  try:
+    queue().put_nowait(body)
+  except asyncio.QueueFull:
+    stats["rejected_full"] += 1
+    return False
+  _enqueued.append(time.monotonic())
+  stats["accepted"] += 1
+  return True
+
+
+def _duplicate(event: dict[str, Any]) -> bool:
+  event_id = event.get("event_id")
+  if not event_id:
+    return False
+  if event_id in _seen:
+    _seen.move_to_end(event_id)
+    return True
+  _seen[event_id] = None
+  if len(_seen) > VK_DEDUP_SIZE:
+    _seen.popitem(last=False)
+  return False
+
+
+def _http() -> httpx.AsyncClient:
+  global _client
+  if _client is None:
+    _client = httpx.AsyncClient(timeout=10, headers={"x-internal-token": INTERNAL_TOKEN})
+  return _client
+
+
+async def _forward(events: list[dict[str, Any]]):
+  if not VK_EVENTS_URL:
+    stats["discarded"] += len(events)
+    return
+  for attempt in range(VK_CALLBACK_RETRIES):
+    try:
+      r = await _http().post(VK_EVENTS_URL, content=jsonfast.dumps({"events": events}),
+                             headers={"content-type": "application/json"})
+      r.raise_for_status()
+      stats["forwarded"] += len(events)
+      return
+    except Exception:
+      stats["forward_errors"] += 1
+      await asyncio.sleep(0.5 * 2 ** attempt)
+  stats["dropped"] += len(events)
+  log.error("vk events dropped after %s attempts: %s", VK_CALLBACK_RETRIES, len(events))
+
+
+async def _worker():
+  q = queue()
+  while True:
+    batch = [await q.get()]
+    while len(batch) < VK_CALLBACK_BATCH and not q.empty():
+      batch.append(q.get_nowait())
+    first = _enqueued.popleft()
+    for _ in range(len(batch) - 1):
+      _enqueued.popleft()
+    lag_ms = round((time.monotonic() - first) * 1000, 2)
+    stats["lag_ms_last"] = lag_ms
+    stats["lag_ms_max"] = max(stats["lag_ms_max"], lag_ms)
+
+    events = []
+    for body in batch:
+      try:
+        event = jsonfast.loads(body)
+      except Exception:
+        stats["bad"] += 1
+        continue
+      if _duplicate(event):
+        stats["duplicates"] += 1
+        continue
+      event.pop("secret", None)
+      events.append(event)
+    try:
+      if events:
+        await _forward(events)
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      log.exception("vk events batch failed")
+    finally:
+      for _ in batch:
+        q.task_done()
+
+
+async def notify(peer_id: int, text: str):
+  if not VK_NOTIFY_URL or not peer_id:
+    return
+  try:
+    r = await _http().post(VK_NOTIFY_URL, content=jsonfast.dumps({"messages": [{"peer_id": peer_id, "text": text}]}),
+                           headers={"content-type": "application/json"})
+    r.raise_for_status()
+    ok = all(x.get("ok") for x in r.json().get("results", []))
+  except Exception:
+    log.exception("vk notify failed: %s", peer_id)
+    ok = False
+  stats["notify_sent" if ok else "notify_failed"] += 1
+
+
+async def run():
+  await asyncio.gather(*(_worker() for _ in range(VK_CALLBACK_WORKERS)))
+
+
+async def close():
+  global _client
+  if _client is not None:
+    await _client.aclose()
+    _client = None
@@ -1,4 +1,4 @@
-import os, json, re, uuid
+import os, json, re, uuid, asyncio
 import httpx
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.filters import CommandStart
@@ -7,6 +7,8 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 
+from . import tracing
+
 TG_BOT_TOKEN = os.getenv("TG_BOT_TOKEN","")
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL","https://taxi.brakonder.ru")
 BACKEND_INTERNAL_URL = os.getenv("BACKEND_INTERNAL_URL","http://backend:8000")
@@ -20,11 +22,18 @@ VPN_BOT_LINK = os.getenv("VPN_BOT_LINK","https://t.me/brakoknder_pn_bot")
 
 NEARBY_RADIUS_METERS = int(os.getenv("NEARBY_RADIUS_METERS","10"))
 
+# Текстовый заказ: таймаут геокодинга одной точки (дальше — сырой текст без координат)
+GEO_STOP_TIMEOUT_SECONDS = float(os.getenv("GEO_STOP_TIMEOUT_SECONDS","4"))
+ORDER_MAX_STOPS = int(os.getenv("ORDER_MAX_STOPS","6"))
+
 if not TG_BOT_TOKEN:
     raise SystemExit("TG_BOT_TOKEN is required")
 
 bot = Bot(TG_BOT_TOKEN)
 dp = Dispatcher()
+if tracing.ENABLED:
+    dp.update.outer_middleware(tracing.update_middleware)
+    bot.session.middleware(tracing.request_middleware)
 
 class Reg(StatesGroup):
     wait_phone = State()
@@ -81,19 +90,35 @@ def normalize_phone_digits(phone: str) -> str | None:
         return None
     return digits
 
-async def backend_get(path: str):
-    headers={"x-internal-token": INTERNAL_TOKEN}
-    async with httpx.AsyncClient(timeout=20) as client:
-        r = await client.get(f"{BACKEND_INTERNAL_URL}{path}", headers=headers)
-        r.raise_for_status()
-        return r.json()
+async def backend_get(path: str, params: dict | None = None):
+    with tracing.span("backend GET", "client", **{"http.path": path}):
+        headers={"x-internal-token": INTERNAL_TOKEN, **tracing.headers()}
+        async with httpx.AsyncClient(timeout=20) as client:
+            r = await client.get(f"{BACKEND_INTERNAL_URL}{path}", params=params, headers=headers)
+            r.raise_for_status()
+            return r.json()
 
 async def backend_post(path: str, payload: dict):
-    headers={"x-internal-token": INTERNAL_TOKEN}
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(f"{BACKEND_INTERNAL_URL}{path}", json=payload, headers=headers)
-        r.raise_for_status()
-        return r.json()
+    with tracing.span("backend POST", "client", **{"http.path": path}):
+        headers={"x-internal-token": INTERNAL_TOKEN, **tracing.headers()}
+        async with httpx.AsyncClient(timeout=30) as client:
+            r = await client.post(f"{BACKEND_INTERNAL_URL}{path}", json=payload, headers=headers)
+            r.raise_for_status()
+            return r.json()
+
+async def geocode_stop(q: str) -> dict:
+    # одна точка маршрута; при таймауте/ошибке/пустом ответе — сырой текст без координат
+    try:
+        res = await asyncio.wait_for(backend_get("/api/geo/search", {"q": q, "limit": 1}), GEO_STOP_TIMEOUT_SECONDS)
+    except Exception:
+        res = []
+    if not res:
+        return {"address": q, "lat": None, "lon": None}
+    obj = res[0]
+    try:
+        return {"address": obj.get("display_name") or q, "lat": float(obj.get("lat")), "lon": float(obj.get("lon"))}
+    except (TypeError, ValueError):
+        return {"address": q, "lat": None, "lon": None}
 
 async def get_user(tg_id: int):
     return await backend_get(f"/api/users/by_tg/{tg_id}")
@@ -203,7 +228,8 @@ async def order_text(cb: types.CallbackQuery, state: FSMContext):
     await cb.answer()
     await cb.message.answer(
         "Напиши заказ текстом в формате:\n"
-        "`Откуда -> Куда | Комментарий`\n\n"
+        "`Откуда -> Куда | Комментарий`\n"
+        "Промежуточные точки: `Откуда -> Заезд -> Куда`\n\n"
         "Пример:\n"
         "`Вилючинск, Профсоюзная 10 -> Петропавловск-Камчатский, Аэропорт | Детское кресло`",
         parse_mode="Markdown"
@@ -226,39 +252,33 @@ async def handle_order_text(m: types.Message, state: FSMContext):
     if "->" not in text:
         await m.answer("Формат неверный. Нужно `Откуда -> Куда | Комментарий`", parse_mode="Markdown")
         return
-    a, b = [x.strip() for x in text.split("->", 1)]
-    if not a or not b:
-        await m.answer("Нужно указать и Откуда, и Куда.")
+    stops = [x.strip() for x in text.split("->")]
+    if any(not x for x in stops):
+        await m.answer("Нужно указать и Откуда, и Куда (и промежуточные точки, если есть).")
+        return
+    if len(stops) > ORDER_MAX_STOPS:
+        await m.answer(f"Слишком много точек. Максимум: {ORDER_MAX_STOPS}.")
         return
 
-    # geo resolve through backend
-    try:
-        g_from = await backend_get(f"/api/geo/search?q={httpx.QueryParams({'q':a}).get('q')}&limit=1")
-    except Exception:
-        g_from = []
-    try:
-        g_to = await backend_get(f"/api/geo/search?q={httpx.QueryParams({'q':b}).get('q')}&limit=1")
-    except Exception:
-        g_to = []
-
-    if not g_from or not g_to:
+    # все точки геокодим параллельно: задержка = один запрос, а не N
+    points = await asyncio.gather(*(geocode_stop(x) for x in stops))
+    if all(p["lat"] is None for p in points):
         await m.answer("Не смог найти адрес(а). Попробуй написать иначе (город, улица, дом).")
         return
 
-    from_obj = g_from[0]
-    to_obj = g_to[0]
+    from_obj, to_objs = points[0], points[1:]
 
     extern_id = f"tg-{m.from_user.id}-{uuid.uuid4().hex[:10]}"
     payload = {
         "phone": phone,  # digits only
         "client_name": user.get("full_name") or m.from_user.full_name,
         "comment": comment,
-        "from_address": from_obj.get("display_name") or a,
-        "from_lat": float(from_obj.get("lat")),
-        "from_lon": float(from_obj.get("lon")),
-        "to_addresses": [to_obj.get("display_name") or b],
-        "to_lats": [float(to_obj.get("lat"))],
-        "to_lons": [float(to_obj.get("lon"))],
+        "from_address": from_obj["address"],
+        "from_lat": from_obj["lat"],
+        "from_lon": from_obj["lon"],
+        "to_addresses": [x["address"] for x in to_objs],
+        "to_lats": [x["lat"] for x in to_objs],
+        "to_lons": [x["lon"] for x in to_objs],
         "tg_user_id": int(m.from_user.id),
         "extern_id": extern_id
     }
@@ -340,8 +360,12 @@ async def webapp(m: types.Message, state: FSMContext):
     await m.answer(f"✅ Заказ создан. ID: {res.get('taxomet_order_id')}\nОжидай назначения водителя.", reply_markup=kb_main(user.get("role","client")))
 
 async def main():
-    await dp.start_polling(bot)
+    exporter = asyncio.create_task(tracing.run())
+    try:
+        await dp.start_polling(bot)
+    finally:
+        exporter.cancel()
+        await tracing.flush()
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
@@ -0,0 +1,145 @@
+import os, time, random, asyncio, logging, contextvars
+from contextlib import contextmanager
+
+import httpx
+
+# Трассировка в боте: корневой спан на каждый апдейт Telegram (здесь принимается решение
+# о сэмплировании), дочерние — вызовы backend'а (с заголовком traceparent) и Bot API.
+# Экспортёра у бота нет: готовые спаны пачками уходят в backend (POST /api/traces),
+# а тот пишет их вместе со своими (JSONL / OTLP, см. backend/app/tracing.py).
+ENABLED = os.getenv("TRACE_ENABLED","") not in ("", "0")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE","0.05"))
+TRACE_SERVICE = os.getenv("TRACE_SERVICE","bot_tg")
+TRACE_FLUSH_SECONDS = float(os.getenv("TRACE_FLUSH_SECONDS","2"))
+TRACE_BUFFER_MAX = int(os.getenv("TRACE_BUFFER_MAX","20000"))
+BACKEND_INTERNAL_URL = os.getenv("BACKEND_INTERNAL_URL","http://backend:8000")
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN","")
+
+log = logging.getLogger("bot.tracing")
+
+stats = {"updates": 0, "sampled": 0, "spans": 0, "exported": 0, "dropped": 0, "export_errors": 0}
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start", "end", "attrs", "error")
+
+    def __init__(self, trace_id: str, parent_id: str | None, name: str, kind: str, attrs: dict):
+        self.trace_id = trace_id
+        self.span_id = _id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time()
+        self.end = 0.0
+        self.attrs = attrs
+        self.error = None
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "service": TRACE_SERVICE, "name": self.name, "kind": self.kind,
+            "start": self.start, "end": self.end, "attrs": self.attrs, "error": self.error,
+        }
+
+class Unsampled:
+    # апдейт не попал в выборку: спанов нет, но backend получает traceparent с флагом 00
+    # и не сэмплирует свою часть сам
+    __slots__ = ("trace_id", "span_id")
+
+    def __init__(self):
+        self.trace_id = _id(16)
+        self.span_id = _id(8)
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-00"
+
+_current: contextvars.ContextVar[Span | Unsampled | None] = contextvars.ContextVar("trace_span", default=None)
+_done: list[Span] = []
+_client: httpx.AsyncClient | None = None
+
+def _id(nbytes: int) -> str:
+    return f"{random.getrandbits(nbytes * 8):0{nbytes * 2}x}"
+
+def headers() -> dict:
+    s = _current.get()
+    return {"traceparent": s.traceparent()} if s else {}
+
+@contextmanager
+def _run(s: Span):
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = repr(e)[:300]
+        raise
+    finally:
+        _current.reset(token)
+        s.end = time.time()
+        if len(_done) >= TRACE_BUFFER_MAX:
+            stats["dropped"] += 1
+        else:
+            stats["spans"] += 1
+            _done.append(s)
+
+@contextmanager
+def root(name: str, **attrs):
+    if not ENABLED:
+        yield None
+        return
+    stats["updates"] += 1
+    if random.random() >= TRACE_SAMPLE_RATE:
+        token = _current.set(Unsampled())
+        try:
+            yield None
+        finally:
+            _current.reset(token)
+        return
+    stats["sampled"] += 1
+    with _run(Span(_id(16), None, name, "server", attrs)) as s:
+        yield s
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attrs):
+    parent = _current.get()
+    if not isinstance(parent, Span):
+        yield None
+        return
+    with _run(Span(parent.trace_id, parent.span_id, name, kind, attrs)) as s:
+        yield s
+
+async def update_middleware(handler, event, data):
+    # outer-middleware диспетчера: весь апдейт, включая FSM и хэндлер
+    with root(f"tg.{event.event_type}", **{"tg.update_id": event.update_id}):
+        return await handler(event, data)
+
+async def request_middleware(make_request, bot, method):
+    # исходящие вызовы Bot API (answer, send_message, ...)
+    with span(f"telegram.{type(method).__name__}", "client"):
+        return await make_request(bot, method)
+
+async def flush():
+    global _client
+    if not _done:
+        return
+    batch = _done[:]
+    del _done[:]
+    try:
+        if _client is None:
+            _client = httpx.AsyncClient(timeout=5, headers={"x-internal-token": INTERNAL_TOKEN})
+        r = await _client.post(f"{BACKEND_INTERNAL_URL}/api/traces", json={"spans": [s.as_dict() for s in batch]})
+        r.raise_for_status()
+        stats["exported"] += len(batch)
+    except Exception:
+        stats["export_errors"] += 1
+        stats["dropped"] += len(batch)
+        log.warning("trace export failed", exc_info=True)
+
+async def run():
+    if not ENABLED:
+        return
+    while True:
+        await asyncio.sleep(TRACE_FLUSH_SECONDS)
+        await flush()
@@ -0,0 +1,56 @@
+import os
+from typing import Any, Optional
+
+import httpx
+
+# Клиент backend API (пользователи, заказы, геокодинг): общий пул соединений на процесс.
+BACKEND_INTERNAL_URL = os.getenv("BACKEND_INTERNAL_URL","http://backend:8000").rstrip("/")
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN","")
+
+
+class Backend:
+  def __init__(self, base_url: str = BACKEND_INTERNAL_URL,
+               transport: Optional[httpx.AsyncBaseTransport] = None, max_connections: int = 50):
+    self.client = httpx.AsyncClient(
+      base_url=base_url,
+      headers={"x-internal-token": INTERNAL_TOKEN},
+      timeout=30,
+      limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+      transport=transport,
+    )
+
+  async def close(self):
+    await self.client.aclose()
+
+  async def get(self, path: str, params: Optional[dict] = None, timeout: Optional[float] = None) -> Any:
+    r = await self.client.get(path, params=params, timeout=timeout or self.client.timeout)
+    r.raise_for_status()
+    return r.json()
+
+  async def post(self, path: str, payload: dict) -> Any:
+    r = await self.client.post(path, json=payload)
+    r.raise_for_status()
+    return r.json()
+
+  async def user(self, vk_id: int) -> dict[str, Any]:
+    return await self.get(f"/api/users/by_vk/{vk_id}")
+
+  async def set_phone(self, vk_id: int, phone: str, full_name: Optional[str] = None) -> dict[str, Any]:
+    return await self.post("/api/users/upsert_phone", {"vk_id": vk_id, "phone": phone, "full_name": full_name})
+
+  async def geocode(self, q: str, timeout: float) -> dict[str, Any]:
+    # одна точка маршрута; при ошибке/пустом ответе — сырой текст без координат
+    try:
+      res = await self.get("/api/geo/search", {"q": q, "limit": 1}, timeout=timeout)
+    except Exception:
+      res = []
+    if not res:
+      return {"address": q, "lat": None, "lon": None}
+    obj = res[0]
+    try:
+      return {"address": obj.get("display_name") or q, "lat": float(obj.get("lat")), "lon": float(obj.get("lon"))}
+    except (TypeError, ValueError):
+      return {"address": q, "lat": None, "lon": None}
+
+  async def create_order(self, payload: dict) -> dict[str, Any]:
+    return await self.post("/api/orders/create", payload)
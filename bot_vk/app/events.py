@@ -0,0 +1,98 @@
+import os, time, asyncio, logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+# Пул обработчиков событий VK: VK_WORKERS корутин, у каждой своя ограниченная очередь.
+# Событие попадает в очередь по peer/from_id — сообщения одного пользователя обрабатываются
+# по порядку, разных — параллельно. Полные очереди = backpressure для источника (long poll не
+# забирает новые события, пока не разгребёмся). Повторно доставленные event_id отбрасываются.
+VK_WORKERS = int(os.getenv("VK_WORKERS","16"))
+VK_QUEUE_MAX = int(os.getenv("VK_QUEUE_MAX","1000"))
+VK_DEDUP_SIZE = int(os.getenv("VK_DEDUP_SIZE","20000"))
+
+log = logging.getLogger("vk.events")
+
+Handler = Callable[[dict[str, Any]], Awaitable[None]]
+
+
+def shard_key(event: dict[str, Any]) -> int:
+  obj = event.get("object") or {}
+  msg = obj.get("message") or obj
+  for k in ("peer_id", "from_id", "user_id"):
+    if msg.get(k):
+      return int(msg[k])
+  return hash(event.get("event_id") or id(event))
+
+
+class EventPool:
+  def __init__(self, handler: Handler, workers: int = VK_WORKERS, queue_max: int = VK_QUEUE_MAX,
+               dedup_size: int = VK_DEDUP_SIZE):
+    self.handler = handler
+    per_queue = max(1, queue_max // max(1, workers))
+    self.queues: list[asyncio.Queue] = [asyncio.Queue(per_queue) for _ in range(workers)]
+    self.seen: OrderedDict[str, None] = OrderedDict()
+    self.dedup_size = dedup_size
+    self.tasks: list[asyncio.Task] = []
+    self.stats: dict[str, Any] = {
+      "received": 0, "duplicates": 0, "processed": 0, "errors": 0,
+      "lag_ms_last": 0.0, "lag_ms_max": 0.0, "handle_ms_ewma": 0.0,
+    }
+
+  def start(self):
+    self.tasks = [asyncio.create_task(self._worker(q)) for q in self.queues]
+
+  async def stop(self):
+    for t in self.tasks:
+      t.cancel()
+    await asyncio.gather(*self.tasks, return_exceptions=True)
+
+  async def join(self):
+    await asyncio.gather(*(q.join() for q in self.queues))
+
+  def depth(self) -> int:
+    return sum(q.qsize() for q in self.queues)
+
+  def snapshot(self) -> dict[str, Any]:
+    return {**self.stats, "queued": self.depth(), "workers": len(self.queues)}
+
+  def _duplicate(self, event: dict[str, Any]) -> bool:
+    event_id = event.get("event_id")
+    if not event_id:
+      return False
+    if event_id in self.seen:
+      self.seen.move_to_end(event_id)
+      return True
+    self.seen[event_id] = None
+    if len(self.seen) > self.dedup_size:
+      self.seen.popitem(last=False)
+    return False
+
+  async def submit(self, event: dict[str, Any], received_at: float = 0.0) -> bool:
+    # False — дубль; ждёт, если очередь шарда полна
+    self.stats["received"] += 1
+    if self._duplicate(event):
+      self.stats["duplicates"] += 1
+      return False
+    q = self.queues[shard_key(event) % len(self.queues)]
+    await q.put((received_at or time.monotonic(), event))
+    return True
+
+  async def _worker(self, q: asyncio.Queue):
+    while True:
+      received_at, event = await q.get()
+      t0 = time.monotonic()
+      lag_ms = (t0 - received_at) * 1000
+      self.stats["lag_ms_last"] = round(lag_ms, 2)
+      self.stats["lag_ms_max"] = max(self.stats["lag_ms_max"], round(lag_ms, 2))
+      try:
+        await self.handler(event)
+        self.stats["processed"] += 1
+      except asyncio.CancelledError:
+        raise
+      except Exception:
+        self.stats["errors"] += 1
+        log.exception("vk event failed: %s", event.get("type"))
+      finally:
+        ms = (time.monotonic() - t0) * 1000
+        self.stats["handle_ms_ewma"] = round(self.stats["handle_ms_ewma"] * 0.9 + ms * 0.1, 2)
+        q.task_done()
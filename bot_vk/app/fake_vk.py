@@ -0,0 +1,180 @@
+import os, json, time, asyncio, random, uuid
+from typing import Any
+from urllib.parse import parse_qsl
+
+from fastapi import FastAPI, Request
+
+# Локальная подмена VK API (и минимального backend'а) для нагрузочного теста бота без сети.
+# Генерирует диалоги users x (Заказать -> адрес), отдаёт их через Bots Long Poll, периодически
+# «теряет» key (failed=2) и повторяет уже отданные события, как VK после переподключения.
+# Отдельно: uvicorn app.fake_vk:app --port 9100 (VK_API_URL=http://127.0.0.1:9100/method,
+# BACKEND_INTERNAL_URL=http://127.0.0.1:9100); в loadtest — в процессе через httpx.ASGITransport.
+FAKE_VK_USERS = int(os.getenv("FAKE_VK_USERS","1000"))
+FAKE_VK_BATCH = int(os.getenv("FAKE_VK_BATCH","100"))
+FAKE_VK_REPLAY_RATE = float(os.getenv("FAKE_VK_REPLAY_RATE","0.05"))
+FAKE_VK_EXPIRE_EVERY = int(os.getenv("FAKE_VK_EXPIRE_EVERY","50"))
+FAKE_VK_LATENCY_MS = float(os.getenv("FAKE_VK_LATENCY_MS","20"))
+# каждый N-й peer «запретил сообщения» — messages.send отвечает ошибкой 901
+FAKE_VK_FORBIDDEN_EVERY = int(os.getenv("FAKE_VK_FORBIDDEN_EVERY","0"))
+# лимит запросов к API в секунду, сверх — ошибка 6 (как у ключа сообщества)
+FAKE_VK_RPS_LIMIT = int(os.getenv("FAKE_VK_RPS_LIMIT","20"))
+
+
+class FakeVk:
+  def __init__(self, users: int = FAKE_VK_USERS, batch: int = FAKE_VK_BATCH, replay_rate: float = FAKE_VK_REPLAY_RATE,
+               expire_every: int = FAKE_VK_EXPIRE_EVERY, latency_ms: float = FAKE_VK_LATENCY_MS,
+               forbidden_every: int = FAKE_VK_FORBIDDEN_EVERY, rps_limit: int = FAKE_VK_RPS_LIMIT, seed: int = 1):
+    self.rnd = random.Random(seed)
+    self.forbidden_every = forbidden_every
+    self.rps_limit = rps_limit
+    self.window = (0, 0)  # (секунда, запросов в ней)
+    self.batch = batch
+    self.replay_rate = replay_rate
+    self.expire_every = expire_every
+    self.latency = latency_ms / 1000
+    self.key = uuid.uuid4().hex
+    self.ts = 0  # последний отданный ts
+    self.events: list[dict[str, Any]] = []
+    # по два сообщения на пользователя, вперемешку между пользователями
+    for text in ("🚕 Заказать", None):
+      for u in range(1, users + 1):
+        self.events.append(self._message(u, text or f"Улица {u}, 1 -> Аэропорт | тест {u}"))
+    self.stats: dict[str, Any] = {"polls": 0, "replayed": 0, "expired": 0, "methods": {}, "orders": 0,
+                                  "rate_limited": 0, "forbidden": 0}
+    self.sent: dict[int, list[str]] = {}
+
+  def _message(self, peer_id: int, text: str) -> dict[str, Any]:
+    return {
+      "type": "message_new",
+      "event_id": uuid.UUID(int=self.rnd.getrandbits(128)).hex,
+      "v": "5.199",
+      "object": {"message": {"peer_id": peer_id, "from_id": peer_id, "text": text}},
+      "group_id": 1,
+    }
+
+  def count(self, method: str):
+    self.stats["methods"][method] = self.stats["methods"].get(method, 0) + 1
+
+  def over_limit(self) -> bool:
+    sec = int(time.monotonic())
+    n = self.window[1] + 1 if self.window[0] == sec else 1
+    self.window = (sec, n)
+    if self.rps_limit and n > self.rps_limit:
+      self.stats["rate_limited"] += 1
+      return True
+    return False
+
+  def send(self, p: dict[str, Any]) -> tuple[Any, Any]:
+    # (response, error) одного messages.send
+    peer_id = int(p["peer_id"])
+    if self.forbidden_every and peer_id % self.forbidden_every == 0:
+      self.stats["forbidden"] += 1
+      return False, {"method": "messages.send", "error_code": 901,
+                     "error_msg": "Can't send messages for users without permission"}
+    self.sent.setdefault(peer_id, []).append(p.get("message",""))
+    return self.rnd.randint(1, 2**31 - 1), None
+
+  def execute(self, code: str) -> dict[str, Any]:
+    # понимает ровно то, что генерирует sender.execute_code
+    prefix, suffix = "r.push(API.messages.send(", "));"
+    calls = [json.loads(line[len(prefix):-len(suffix)]) for line in code.splitlines() if line.startswith(prefix)]
+    if len(calls) > 25:
+      return {"error": {"error_code": 13, "error_msg": "Runtime error: too many API calls"}}
+    response, errors = [], []
+    for p in calls:
+      res, err = self.send(p)
+      response.append(res)
+      if err:
+        errors.append(err)
+    body: dict[str, Any] = {"response": response}
+    if errors:
+      body["execute_errors"] = errors
+    return body
+
+  def done(self) -> bool:
+    return self.stats["orders"] >= len(self.events) // 2
+
+  async def latency_sleep(self):
+    if self.latency:
+      await asyncio.sleep(self.latency * (0.5 + self.rnd.random()))
+
+  async def a_check(self, key: str, ts: int, wait: int) -> dict[str, Any]:
+    self.stats["polls"] += 1
+    if key != self.key:
+      return {"failed": 2}
+    if self.expire_every and self.stats["polls"] % self.expire_every == 0:
+      self.stats["expired"] += 1
+      self.key = uuid.uuid4().hex
+      return {"failed": 2}
+    if ts >= len(self.events):
+      await asyncio.sleep(min(wait, 1))
+      return {"ts": str(ts), "updates": []}
+    start = ts
+    if ts > 0 and self.rnd.random() < self.replay_rate:
+      # повтор части уже отданных событий
+      start = max(0, ts - self.batch)
+      self.stats["replayed"] += ts - start
+    end = min(len(self.events), ts + self.batch)
+    self.ts = max(self.ts, end)
+    return {"ts": str(end), "updates": self.events[start:end]}
+
+
+fake = FakeVk()
+app = FastAPI()
+
+
+async def _params(request: Request) -> dict[str, Any]:
+  # VK принимает и query, и x-www-form-urlencoded
+  body = (await request.body()).decode()
+  return {**request.query_params, **dict(parse_qsl(body))}
+
+
+@app.post("/method/{method}")
+async def vk_method(method: str, request: Request):
+  p = await _params(request)
+  fake.count(method)
+  await fake.latency_sleep()
+  if fake.over_limit():
+    return {"error": {"error_code": 6, "error_msg": "Too many requests per second"}}
+  if method == "groups.getLongPollServer":
+    return {"response": {"server": str(request.base_url) + "lp", "key": fake.key, "ts": str(fake.ts)}}
+  if method == "messages.send":
+    res, err = fake.send(p)
+    if err:
+      return {"error": {"error_code": err["error_code"], "error_msg": err["error_msg"]}}
+    return {"response": res}
+  if method == "execute":
+    return fake.execute(p.get("code",""))
+  return {"error": {"error_code": 3, "error_msg": f"Unknown method passed: {method}"}}
+
+
+@app.get("/lp")
+async def lp(key: str, ts: str, wait: int = 25):
+  return await fake.a_check(key, int(ts), wait)
+
+
+# минимальный backend: пользователи с телефоном, геокодер, создание заказа
+@app.get("/api/users/by_vk/{vk_id}")
+async def by_vk(vk_id: int):
+  fake.count("backend.by_vk")
+  return {"id": vk_id, "vk_id": vk_id, "phone": f"79{vk_id:09d}", "role": "client", "full_name": f"user {vk_id}"}
+
+
+@app.get("/api/geo/search")
+async def geo_search(q: str, limit: int = 1):
+  fake.count("backend.geo")
+  await fake.latency_sleep()
+  return [{"display_name": q, "lat": 53.0 + fake.rnd.random() / 10, "lon": 158.6 + fake.rnd.random() / 10}]
+
+
+@app.post("/api/orders/create")
+async def orders_create(request: Request):
+  fake.count("backend.orders")
+  await fake.latency_sleep()
+  fake.stats["orders"] += 1
+  return {"ok": True, "taxomet_order_id": fake.stats["orders"], "extern_id": (await request.json())["extern_id"]}
+
+
+@app.get("/stats")
+async def stats():
+  return {**fake.stats, "peers": len(fake.sent)}
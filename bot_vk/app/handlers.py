@@ -0,0 +1,158 @@
+import os, re, json, uuid, asyncio, logging
+from collections import OrderedDict
+from typing import Any, Optional
+
+import httpx
+
+from .backend import Backend
+from .sender import VkSender
+from .vk_api import VkApi, VkError
+
+# Диалог VK-бота (аналог bot_tg): телефон -> меню -> заказ текстом «Откуда -> Куда | Комментарий».
+# Состояние диалога — в памяти процесса, по peer_id, ограничено LRU.
+GEO_STOP_TIMEOUT_SECONDS = float(os.getenv("GEO_STOP_TIMEOUT_SECONDS","4"))
+ORDER_MAX_STOPS = int(os.getenv("ORDER_MAX_STOPS","6"))
+VK_STATE_MAX = int(os.getenv("VK_STATE_MAX","50000"))
+
+log = logging.getLogger("vk.handlers")
+
+WAIT_PHONE = "wait_phone"
+WAIT_ORDER = "wait_order"
+
+BTN_ORDER = "🚕 Заказать"
+BTN_MENU = "Меню"
+
+ORDER_HELP = (
+  "Напиши заказ текстом в формате:\n"
+  "Откуда -> Куда | Комментарий\n"
+  "Промежуточные точки: Откуда -> Заезд -> Куда\n\n"
+  "Пример:\n"
+  "Вилючинск, Профсоюзная 10 -> Петропавловск-Камчатский, Аэропорт | Детское кресло"
+)
+
+
+def keyboard(*labels: str) -> str:
+  return json.dumps({
+    "one_time": False,
+    "buttons": [[{"action": {"type": "text", "label": x}, "color": "primary"}] for x in labels],
+  }, ensure_ascii=False)
+
+
+def normalize_phone_digits(phone: str) -> Optional[str]:
+  digits = re.sub(r"\D+","", phone or "")
+  if len(digits) == 11 and digits.startswith("8"):
+    digits = "7"+digits[1:]
+  if len(digits) == 10 and digits.startswith("9"):
+    digits = "7"+digits
+  if len(digits) != 11 or not digits.startswith("7"):
+    return None
+  return digits
+
+
+class Bot:
+  def __init__(self, vk: VkApi, backend: Backend, sender: Optional[VkSender] = None):
+    self.vk = vk
+    self.backend = backend
+    self.sender = sender
+    self.state: OrderedDict[int, str] = OrderedDict()
+    self.stats: dict[str, int] = {"reply_errors": 0}
+
+  def _set_state(self, peer_id: int, value: Optional[str]):
+    self.state.pop(peer_id, None)
+    if value:
+      self.state[peer_id] = value
+      if len(self.state) > VK_STATE_MAX:
+        self.state.popitem(last=False)
+
+  async def reply(self, peer_id: int, text: str, keyboard: Optional[str] = None):
+    try:
+      if self.sender:
+        await self.sender.send(peer_id, text, keyboard)
+      else:
+        await self.vk.send_message(peer_id, text, keyboard)
+    except VkError as e:
+      # например, 901 — пользователь запретил сообщения от сообщества; диалог не ломаем
+      self.stats["reply_errors"] += 1
+      log.warning("reply to %s failed: %s", peer_id, e)
+
+  async def handle(self, event: dict[str, Any]):
+    if event.get("type") != "message_new":
+      return
+    msg = (event.get("object") or {}).get("message") or {}
+    peer_id, from_id = int(msg.get("peer_id") or 0), int(msg.get("from_id") or 0)
+    if from_id <= 0 or peer_id != from_id:
+      # сообщения сообществ и бесед не обслуживаем
+      return
+    await self.on_message(peer_id, (msg.get("text") or "").strip())
+
+  async def on_message(self, peer_id: int, text: str):
+    user = await self.backend.user(peer_id)
+    state = self.state.get(peer_id)
+
+    if not user.get("phone"):
+      phone = normalize_phone_digits(text) if state == WAIT_PHONE else None
+      if not phone:
+        self._set_state(peer_id, WAIT_PHONE)
+        await self.reply(peer_id, "Чтобы пользоваться ботом, нужен номер телефона.\nНапиши его сообщением (11 цифр).")
+        return
+      user = await self.backend.set_phone(peer_id, phone)
+      self._set_state(peer_id, None)
+      await self.menu(peer_id, user)
+      return
+
+    if text == BTN_ORDER:
+      self._set_state(peer_id, WAIT_ORDER)
+      await self.reply(peer_id, ORDER_HELP, keyboard(BTN_MENU))
+      return
+    if state == WAIT_ORDER and text != BTN_MENU:
+      await self.order(peer_id, user, text)
+      return
+    self._set_state(peer_id, None)
+    await self.menu(peer_id, user)
+
+  async def menu(self, peer_id: int, user: dict[str, Any]):
+    await self.reply(peer_id, f"Готово ✅\nТелефон: {user.get('phone') or '—'}\n\nВыбирай действие:",
+                     keyboard(BTN_ORDER))
+
+  async def order(self, peer_id: int, user: dict[str, Any], text: str):
+    comment = ""
+    if "|" in text:
+      text, comment = [x.strip() for x in text.split("|", 1)]
+    if "->" not in text:
+      await self.reply(peer_id, "Формат неверный. Нужно: Откуда -> Куда | Комментарий")
+      return
+    stops = [x.strip() for x in text.split("->")]
+    if any(not x for x in stops):
+      await self.reply(peer_id, "Нужно указать и Откуда, и Куда (и промежуточные точки, если есть).")
+      return
+    if len(stops) > ORDER_MAX_STOPS:
+      await self.reply(peer_id, f"Слишком много точек. Максимум: {ORDER_MAX_STOPS}.")
+      return
+
+    points = await asyncio.gather(*(self.backend.geocode(x, GEO_STOP_TIMEOUT_SECONDS) for x in stops))
+    if all(p["lat"] is None for p in points):
+      await self.reply(peer_id, "Не смог найти адрес(а). Попробуй написать иначе (город, улица, дом).")
+      return
+    from_obj, to_objs = points[0], points[1:]
+
+    payload = {
+      "phone": user["phone"],
+      "client_name": user.get("full_name") or "",
+      "comment": comment,
+      "from_address": from_obj["address"],
+      "from_lat": from_obj["lat"],
+      "from_lon": from_obj["lon"],
+      "to_addresses": [x["address"] for x in to_objs],
+      "to_lats": [x["lat"] for x in to_objs],
+      "to_lons": [x["lon"] for x in to_objs],
+      "vk_user_id": peer_id,
+      "extern_id": f"vk-{peer_id}-{uuid.uuid4().hex[:10]}",
+    }
+    try:
+      res = await self.backend.create_order(payload)
+    except httpx.HTTPStatusError as e:
+      await self.reply(peer_id, f"Ошибка создания заказа: {e.response.text[:1200]}")
+      return
+    self._set_state(peer_id, None)
+    await self.reply(peer_id, f"✅ Заказ создан. ID: {res.get('taxomet_order_id')}\nОжидай назначения водителя.",
+                     keyboard(BTN_ORDER))
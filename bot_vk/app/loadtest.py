@@ -0,0 +1,83 @@
+import sys, time, asyncio, argparse
+
+import httpx
+
+from . import fake_vk, longpoll
+from .backend import Backend
+from .events import EventPool
+from .handlers import Bot
+from .sender import VkSender
+from .vk_api import VkApi
+
+# Нагрузочный прогон бота против fake VK в том же процессе (без сети):
+#   python -m app.loadtest --users 2000 --workers 16 --latency-ms 20 --batch 20
+
+
+async def run(users: int, workers: int, latency_ms: float, batch: int, replay_rate: float, timeout: float,
+              batched: bool = True, forbidden_every: int = 0, rps_limit: int = 20) -> int:
+  fake_vk.fake = fake = fake_vk.FakeVk(users=users, batch=batch, latency_ms=latency_ms, replay_rate=replay_rate,
+                                       forbidden_every=forbidden_every, rps_limit=rps_limit)
+  transport = httpx.ASGITransport(app=fake_vk.app)
+  vk = VkApi(token="test", base_url="http://fake-vk/method", transport=transport)
+  backend = Backend(base_url="http://fake-vk", transport=transport)
+  sender = VkSender(vk) if batched else None
+  bot = Bot(vk, backend, sender)
+  pool = EventPool(bot.handle, workers=workers)
+  pool.start()
+
+  t0 = time.monotonic()
+  poller = asyncio.create_task(longpoll.run(vk, pool, group_id=1, wait=1))
+  try:
+    while not fake.done() and time.monotonic() - t0 < timeout:
+      await asyncio.sleep(0.05)
+    await asyncio.wait_for(pool.join(), max(1.0, timeout - (time.monotonic() - t0)))
+    if sender:
+      await sender.flush()
+  finally:
+    poller.cancel()
+    await pool.stop()
+    await vk.close()
+    await backend.close()
+  elapsed = time.monotonic() - t0
+
+  s = pool.snapshot()
+  delivered = sum(len(x) for x in fake.sent.values())
+  print(f"users={users} workers={workers} latency_ms={latency_ms} batched={batched}")
+  print(f"elapsed={elapsed:.2f}s events={s['processed']} ({s['processed'] / elapsed:.0f}/s) "
+        f"errors={s['errors']} duplicates_dropped={s['duplicates']} replayed={fake.stats['replayed']}")
+  print(f"lag_ms_max={s['lag_ms_max']} handle_ms_ewma={s['handle_ms_ewma']} "
+        f"reconnects={longpoll.stats['reconnects']} orders={fake.stats['orders']}")
+  print(f"replies delivered={delivered} reply_errors={bot.stats['reply_errors']} "
+        f"forbidden={fake.stats['forbidden']} vk_rate_limited={fake.stats['rate_limited']}")
+  if sender:
+    print(f"sender={sender.stats}")
+  print(f"calls={fake.stats['methods']}")
+
+  problems = []
+  if not fake.done() or s["errors"]:
+    problems.append("not all orders were created")
+  if sender and (sender.stats["sent"] != delivered or sender.stats["failed"] != fake.stats["forbidden"]):
+    problems.append("per-message results of execute were mapped incorrectly")
+  for p in problems:
+    print(f"FAILED: {p}", file=sys.stderr)
+  return 1 if problems else 0
+
+
+def main():
+  ap = argparse.ArgumentParser(description="VK bot load test against in-process fake VK API")
+  ap.add_argument("--users", type=int, default=1000)
+  ap.add_argument("--workers", type=int, default=16)
+  ap.add_argument("--latency-ms", type=float, default=20)
+  ap.add_argument("--batch", type=int, default=20, help="событий на один ответ long poll")
+  ap.add_argument("--replay-rate", type=float, default=0.05)
+  ap.add_argument("--timeout", type=float, default=120)
+  ap.add_argument("--no-batch", action="store_true", help="отвечать по одному messages.send, без execute")
+  ap.add_argument("--forbidden-every", type=int, default=0, help="каждый N-й пользователь запретил сообщения")
+  ap.add_argument("--rps-limit", type=int, default=20, help="лимит fake VK API, запросов/с")
+  a = ap.parse_args()
+  sys.exit(asyncio.run(run(a.users, a.workers, a.latency_ms, a.batch, a.replay_rate, a.timeout,
+                           not a.no_batch, a.forbidden_every, a.rps_limit)))
+
+
+if __name__ == "__main__":
+  main()
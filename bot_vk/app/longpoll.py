@@ -0,0 +1,53 @@
+import os, asyncio, logging
+from typing import Any
+
+from .events import EventPool
+from .vk_api import VkApi
+
+# Bots Long Poll: groups.getLongPollServer -> цикл a_check. failed=1 — сдвигаем ts,
+# failed=2 — новый key со старым ts, failed=3 — новые key и ts. После переподключения VK может повторить события —
+# их отсекает дедупликация по event_id в EventPool.
+VK_GROUP_ID = int(os.getenv("VK_GROUP_ID","0"))
+VK_LP_WAIT = int(os.getenv("VK_LP_WAIT","25"))
+VK_LP_RETRY_SECONDS = float(os.getenv("VK_LP_RETRY_SECONDS","3"))
+
+log = logging.getLogger("vk.longpoll")
+
+stats: dict[str, Any] = {"polls": 0, "events": 0, "reconnects": 0, "errors": 0, "ts": None}
+
+
+async def _server(vk: VkApi, group_id: int) -> dict[str, Any]:
+  stats["reconnects"] += 1
+  return await vk.call("groups.getLongPollServer", group_id=group_id)
+
+
+async def run(vk: VkApi, pool: EventPool, group_id: int = VK_GROUP_ID, wait: int = VK_LP_WAIT):
+  lp = None
+  while True:
+    try:
+      if lp is None:
+        lp = await _server(vk, group_id)
+      data = await vk.poll(lp["server"], lp["key"], str(lp["ts"]), wait)
+      stats["polls"] += 1
+      failed = data.get("failed")
+      if failed == 1:
+        lp["ts"] = data["ts"]
+      elif failed == 2:
+        ts = lp["ts"]
+        lp = await _server(vk, group_id)
+        lp["ts"] = ts
+      elif failed == 3:
+        lp = None
+      else:
+        lp["ts"] = data["ts"]
+        stats["ts"] = data["ts"]
+        for event in data.get("updates") or []:
+          stats["events"] += 1
+          await pool.submit(event)
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      stats["errors"] += 1
+      log.exception("long poll failed")
+      lp = None
+      await asyncio.sleep(VK_LP_RETRY_SECONDS)
@@ -1,10 +1,86 @@
-import os
-from fastapi import FastAPI
+import os, time, asyncio
+from fastapi import FastAPI, Header, HTTPException, Request
+
+from . import longpoll
+from .backend import Backend
+from .events import EventPool
+from .handlers import Bot
+from .sender import VkSender
+from .vk_api import VkApi, VkError, VK_GROUP_TOKEN
+
+# VK-бот: Bots Long Poll -> пул обработчиков -> backend API (пользователи, заказы).
+# Без VK_GROUP_TOKEN/VK_GROUP_ID long poll не запускается; события тогда приходят
+# от backend'а (Callback API -> /events).
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN","")
+
 app = FastAPI()
 
-# Это "задел". Сейчас VK обработка идёт в backend (/vk/callback).
-# Здесь потом добавим LongPoll / Messages API / единый роутинг.
+
+@app.on_event("startup")
+async def startup():
+  app.state.vk = VkApi()
+  app.state.backend = Backend()
+  app.state.sender = VkSender(app.state.vk)
+  app.state.bot = Bot(app.state.vk, app.state.backend, app.state.sender)
+  app.state.events = EventPool(app.state.bot.handle)
+  app.state.events.start()
+  app.state.tasks = []
+  if VK_GROUP_TOKEN and longpoll.VK_GROUP_ID:
+    app.state.tasks.append(asyncio.create_task(longpoll.run(app.state.vk, app.state.events)))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+  for t in app.state.tasks:
+    t.cancel()
+  await app.state.events.stop()
+  await app.state.sender.flush()
+  await app.state.vk.close()
+  await app.state.backend.close()
+
 
 @app.get("/health")
 async def health():
-  return {"ok": True, "vk_stub": True, "note": "enable profile vk later"}
+  return {
+    "ok": True,
+    "longpoll": bool(app.state.tasks),
+    "events": app.state.events.snapshot(),
+    "poll": longpoll.stats,
+    "sender": app.state.sender.stats,
+  }
+
+
+def must_internal(token: str | None):
+  if not INTERNAL_TOKEN or token != INTERNAL_TOKEN:
+    raise HTTPException(status_code=401, detail="internal token invalid")
+
+
+@app.post("/events")
+async def events(request: Request, x_internal_token: str | None = Header(None)):
+  must_internal(x_internal_token)
+  body = await request.json()
+  now = time.monotonic()
+  accepted = 0
+  # submit ждёт места в очереди — ответ задерживается, backend копит у себя и притормаживает VK
+  for event in body.get("events") or []:
+    accepted += await app.state.events.submit(event, now)
+  return {"ok": True, "accepted": accepted}
+
+
+async def _notify_one(peer_id: int, text: str) -> dict:
+  try:
+    return {"ok": True, "message_id": await app.state.sender.send(peer_id, text)}
+  except VkError as e:
+    return {"ok": False, "error_code": e.code, "error": e.msg}
+  except Exception as e:
+    return {"ok": False, "error": str(e)}
+
+
+@app.post("/notify")
+async def notify(request: Request, x_internal_token: str | None = Header(None)):
+  # уведомления от backend'а: все сообщения запроса уходят через общий пакетный sender
+  must_internal(x_internal_token)
+  body = await request.json()
+  items = body.get("messages") or []
+  results = await asyncio.gather(*(_notify_one(int(m["peer_id"]), str(m["text"])) for m in items))
+  return {"ok": True, "results": results}
@@ -0,0 +1,124 @@
+import os, json, time, random, asyncio, logging
+from typing import Any, Optional
+
+from .vk_api import VkApi, VkError
+
+# Исходящие сообщения VK пачками: до 25 вызовов messages.send в одном execute
+# (лимит VK на число вызовов API внутри execute). Пачка уходит, когда набралась целиком
+# или через VK_SEND_FLUSH_MS после первого сообщения. Ответ execute — массив результатов,
+# где у неудачных вызовов false, а их ошибки по порядку лежат в execute_errors:
+# каждая send() получает свой message_id или свой VkError.
+VK_SEND_BATCH = min(25, int(os.getenv("VK_SEND_BATCH","25")))
+VK_SEND_FLUSH_MS = float(os.getenv("VK_SEND_FLUSH_MS","50"))
+VK_SEND_RPS = float(os.getenv("VK_SEND_RPS","15"))  # у ключа сообщества лимит 20 запросов/с
+VK_SEND_INFLIGHT = int(os.getenv("VK_SEND_INFLIGHT","4"))
+VK_SEND_RETRIES = int(os.getenv("VK_SEND_RETRIES","3"))
+
+VK_TOO_MANY_REQUESTS = 6
+
+log = logging.getLogger("vk.sender")
+
+
+def execute_code(calls: list[dict[str, Any]]) -> str:
+  # параметры — JSON-литералы, VKScript их понимает как объекты
+  lines = ["var r = [];"]
+  for p in calls:
+    lines.append(f"r.push(API.messages.send({json.dumps(p, ensure_ascii=False)}));")
+  lines.append("return r;")
+  return "\n".join(lines)
+
+
+class VkSender:
+  def __init__(self, vk: VkApi, batch: int = VK_SEND_BATCH, flush_ms: float = VK_SEND_FLUSH_MS,
+               rps: float = VK_SEND_RPS, inflight: int = VK_SEND_INFLIGHT):
+    self.vk = vk
+    self.batch = batch
+    self.flush_s = flush_ms / 1000
+    self.interval = 1 / rps if rps > 0 else 0.0
+    self.sem = asyncio.Semaphore(inflight)
+    self.pending: list[tuple[dict[str, Any], asyncio.Future]] = []
+    self.timer: Optional[asyncio.TimerHandle] = None
+    self.next_call = 0.0
+    self.tasks: set[asyncio.Task] = set()
+    self.stats: dict[str, Any] = {"messages": 0, "sent": 0, "failed": 0, "calls": 0, "call_errors": 0,
+                                  "rate_limited": 0, "batch_avg": 0.0}
+
+  async def send(self, peer_id: int, text: str, keyboard: Optional[str] = None) -> int:
+    params: dict[str, Any] = {"peer_id": peer_id, "message": text, "random_id": random.randint(1, 2**31 - 1)}
+    if keyboard:
+      params["keyboard"] = keyboard
+    fut = asyncio.get_running_loop().create_future()
+    self.pending.append((params, fut))
+    self.stats["messages"] += 1
+    if len(self.pending) >= self.batch:
+      self._flush()
+    elif self.timer is None:
+      self.timer = asyncio.get_running_loop().call_later(self.flush_s, self._flush)
+    return await fut
+
+  def _flush(self):
+    if self.timer is not None:
+      self.timer.cancel()
+      self.timer = None
+    while self.pending:
+      chunk, self.pending = self.pending[:self.batch], self.pending[self.batch:]
+      t = asyncio.get_running_loop().create_task(self._execute(chunk))
+      self.tasks.add(t)
+      t.add_done_callback(self.tasks.discard)
+
+  async def flush(self):
+    self._flush()
+    if self.tasks:
+      await asyncio.gather(*self.tasks, return_exceptions=True)
+
+  async def _throttle(self):
+    now = time.monotonic()
+    wait = self.next_call - now
+    self.next_call = max(now, self.next_call) + self.interval
+    if wait > 0:
+      await asyncio.sleep(wait)
+
+  async def _call(self, chunk: list[tuple[dict[str, Any], asyncio.Future]]) -> dict[str, Any]:
+    for attempt in range(VK_SEND_RETRIES):
+      await self._throttle()
+      self.stats["calls"] += 1
+      try:
+        if len(chunk) == 1:
+          return {"response": [await self.vk.call("messages.send", **chunk[0][0])]}
+        return await self.vk.call_raw("execute", code=execute_code([p for p, _ in chunk]))
+      except VkError as e:
+        # лимит частоты — пачка целиком не выполнена, повторять безопасно (random_id те же)
+        if e.code != VK_TOO_MANY_REQUESTS or attempt == VK_SEND_RETRIES - 1:
+          raise
+        self.stats["rate_limited"] += 1
+        await asyncio.sleep(0.5 * 2 ** attempt)
+    raise RuntimeError("unreachable")
+
+  async def _execute(self, chunk: list[tuple[dict[str, Any], asyncio.Future]]):
+    async with self.sem:
+      self.stats["batch_avg"] = round(self.stats["batch_avg"] * 0.9 + len(chunk) * 0.1, 2)
+      try:
+        body = await self._call(chunk)
+      except Exception as e:
+        # весь вызов не прошёл — ошибка у каждого сообщения пачки
+        self.stats["call_errors"] += 1
+        self.stats["failed"] += len(chunk)
+        for _, fut in chunk:
+          if not fut.done():
+            fut.set_exception(e)
+        return
+
+    results = body.get("response") or []
+    errors = iter(body.get("execute_errors") or [])
+    for i, (_, fut) in enumerate(chunk):
+      res = results[i] if i < len(results) else False
+      if res is False or res is None:
+        # ошибки идут по порядку неудачных вызовов — берём свою, даже если send() уже отменён
+        err = next(errors, {}) or {}
+        self.stats["failed"] += 1
+        if not fut.done():
+          fut.set_exception(VkError(int(err.get("error_code", 0)), str(err.get("error_msg","unknown execute error"))))
+      else:
+        self.stats["sent"] += 1
+        if not fut.done():
+          fut.set_result(int(res))
@@ -0,0 +1,58 @@
+import os, random
+from typing import Any, Optional
+
+import httpx
+
+# Клиент VK API: один httpx.AsyncClient с keep-alive на процесс.
+# transport подменяется в нагрузочном тесте (локальный fake VK без сети).
+VK_API_URL = os.getenv("VK_API_URL","https://api.vk.com/method").rstrip("/")
+VK_API_VERSION = os.getenv("VK_API_VERSION","5.199")
+VK_GROUP_TOKEN = os.getenv("VK_GROUP_TOKEN","")
+
+
+class VkError(Exception):
+  def __init__(self, code: int, msg: str):
+    super().__init__(f"VK error {code}: {msg}")
+    self.code = code
+    self.msg = msg
+
+
+class VkApi:
+  def __init__(self, token: str = VK_GROUP_TOKEN, base_url: str = VK_API_URL,
+               transport: Optional[httpx.AsyncBaseTransport] = None, max_connections: int = 50):
+    self.token = token
+    self.base_url = base_url
+    self.client = httpx.AsyncClient(
+      timeout=httpx.Timeout(35, connect=5),
+      limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+      transport=transport,
+    )
+
+  async def close(self):
+    await self.client.aclose()
+
+  async def call_raw(self, method: str, **params) -> dict[str, Any]:
+    # тело ответа целиком (execute кладёт ошибки отдельных вызовов в execute_errors)
+    data = {k: v for k, v in params.items() if v is not None}
+    data.update(access_token=self.token, v=VK_API_VERSION)
+    r = await self.client.post(f"{self.base_url}/{method}", data=data)
+    r.raise_for_status()
+    body = r.json()
+    if "error" in body:
+      err = body["error"]
+      raise VkError(int(err.get("error_code", 0)), str(err.get("error_msg","")))
+    return body
+
+  async def call(self, method: str, **params) -> Any:
+    return (await self.call_raw(method, **params)).get("response")
+
+  async def poll(self, server: str, key: str, ts: str, wait: int) -> dict[str, Any]:
+    # сам long poll — не метод API, а GET на выданный сервер
+    r = await self.client.get(server, params={"act": "a_check", "key": key, "ts": ts, "wait": wait},
+                              timeout=wait + 10)
+    r.raise_for_status()
+    return r.json()
+
+  async def send_message(self, peer_id: int, text: str, keyboard: Optional[str] = None) -> Any:
+    return await self.call("messages.send", peer_id=peer_id, message=text, keyboard=keyboard,
+                           random_id=random.randint(1, 2**31 - 1))
@@ -45,7 +45,10 @@
   let fromMarker = null;
   let toMarker = null;
 
-  let driverMarkers = [];
+  // водители — один GeoJSON-источник с кластеризацией (без DOM-маркеров)
+  const DRIVERS_SRC = "drivers";
+  const driverFeatures = new Map(); // driver_id -> Feature
+  const driversData = {type: "FeatureCollection", features: []};
 
   function setStatus(text, kind){
     statusBadge.textContent = text;
@@ -84,13 +87,18 @@
     resultsList.style.display = "block";
   }
 
+  // подписанный initData: backend по нему ведёт лимиты на пользователя, а не на IP
+  function apiHeaders(){
+    return tg && tg.initData ? {"X-Telegram-Init-Data": tg.initData} : {};
+  }
+
   async function apiGet(path, params){
     const u = new URL(API_BASE + path);
     for (const [k,v] of Object.entries(params||{})){
       if (v === undefined || v === null) continue;
       u.searchParams.set(k, String(v));
     }
-    const r = await fetch(u.toString(), {credentials:"omit"});
+    const r = await fetch(u.toString(), {credentials:"omit", headers: apiHeaders()});
     if (!r.ok) throw new Error(await r.text());
     return await r.json();
   }
@@ -103,8 +111,34 @@
     return await apiGet("/api/geo/search", {q, limit: 6});
   }
 
+  // бинарная лента машин (format=packed), раскладка — backend/app/nearby_feed.py
+  function decodeDriversPacked(buf){
+    const dv = new DataView(buf);
+    const magic = String.fromCharCode(dv.getUint8(0), dv.getUint8(1), dv.getUint8(2), dv.getUint8(3));
+    if (magic !== "DRV1") throw new Error("bad drivers feed");
+    const n = dv.getUint16(4, true);
+    let off = 12;
+    const ids = [], lats = [], lons = [], ages = [], etas = [];
+    for (let i = 0; i < n; i++){ ids.push(Number(dv.getBigInt64(off, true))); off += 8; }
+    for (let i = 0; i < n; i++){ lats.push(dv.getInt32(off, true) / 1e6); off += 4; }
+    for (let i = 0; i < n; i++){ lons.push(dv.getInt32(off, true) / 1e6); off += 4; }
+    for (let i = 0; i < n; i++){ ages.push(dv.getUint16(off, true)); off += 2; }
+    for (let i = 0; i < n; i++){ etas.push(dv.getUint16(off, true)); off += 2; }
+    const drivers = [];
+    for (let i = 0; i < n; i++){
+      drivers.push({driver_id: ids[i], lat: lats[i], lon: lons[i], age_seconds: ages[i], eta_seconds: etas[i]});
+    }
+    return {ok: true, drivers};
+  }
+
   async function driversNearby(lat, lon){
-    return await apiGet("/api/drivers/nearby", {lat, lon});
+    const u = new URL(API_BASE + "/api/drivers/nearby");
+    u.searchParams.set("lat", String(lat));
+    u.searchParams.set("lon", String(lon));
+    u.searchParams.set("format", "packed");
+    const r = await fetch(u.toString(), {credentials:"omit", headers: apiHeaders()});
+    if (!r.ok) throw new Error(await r.text());
+    return decodeDriversPacked(await r.arrayBuffer());
   }
 
   function updateInputs(){
@@ -156,24 +190,91 @@
     if (fromPoint){
       try{
         const drv = await driversNearby(fromPoint.lat, fromPoint.lon);
-        setDrivers(drv);
+        setDrivers(drv?.drivers);
       }catch(e){/*ignore*/}
     }
   }
 
+  function ensureDriversLayer(){
+    if (!map.isStyleLoaded() || map.getSource(DRIVERS_SRC)) return;
+    map.addSource(DRIVERS_SRC, {
+      type: "geojson",
+      data: driversData,
+      cluster: true,
+      clusterMaxZoom: 13,
+      clusterRadius: 40
+    });
+    map.addLayer({
+      id: "drivers-clusters",
+      type: "circle",
+      source: DRIVERS_SRC,
+      filter: ["has", "point_count"],
+      paint: {
+        "circle-color": "#0f172a",
+        "circle-opacity": 0.85,
+        "circle-radius": ["step", ["get", "point_count"], 14, 10, 18, 50, 24],
+        "circle-stroke-width": 2,
+        "circle-stroke-color": "#ffffff"
+      }
+    });
+    map.addLayer({
+      id: "drivers-count",
+      type: "symbol",
+      source: DRIVERS_SRC,
+      filter: ["has", "point_count"],
+      layout: {"text-field": "{point_count_abbreviated}", "text-size": 12},
+      paint: {"text-color": "#ffffff"}
+    });
+    map.addLayer({
+      id: "drivers-point",
+      type: "circle",
+      source: DRIVERS_SRC,
+      filter: ["!", ["has", "point_count"]],
+      paint: {
+        "circle-color": "#0f172a",
+        "circle-radius": 7,
+        "circle-stroke-width": 2,
+        "circle-stroke-color": "#ffffff"
+      }
+    });
+  }
+
   function setDrivers(drivers){
-    driverMarkers.forEach(m=>m.remove());
-    driverMarkers = [];
     const arr = Array.isArray(drivers) ? drivers : [];
     setDriversCount(arr.length);
 
+    // инкрементально: переиспользуем Feature-объекты, setData — только если что-то поменялось
+    let changed = arr.length !== driverFeatures.size;
+    const seen = new Set();
     for (const d of arr){
-      const m = new maplibregl.Marker({color:"#0f172a"})
-        .setLngLat([d.lon, d.lat])
-        .setPopup(new maplibregl.Popup().setText(`Водитель ${d.driver_id} • ${d.age_seconds}s`))
-        .addTo(map);
-      driverMarkers.push(m);
+      seen.add(d.driver_id);
+      const f = driverFeatures.get(d.driver_id);
+      if (!f){
+        driverFeatures.set(d.driver_id, {
+          type: "Feature",
+          id: d.driver_id,
+          geometry: {type: "Point", coordinates: [d.lon, d.lat]},
+          properties: {driver_id: d.driver_id, age_seconds: d.age_seconds, eta_seconds: d.eta_seconds}
+        });
+        changed = true;
+        continue;
+      }
+      const c = f.geometry.coordinates;
+      if (c[0] !== d.lon || c[1] !== d.lat){
+        c[0] = d.lon; c[1] = d.lat;
+        changed = true;
+      }
+      f.properties.age_seconds = d.age_seconds;
+      f.properties.eta_seconds = d.eta_seconds;
+    }
+    for (const id of Array.from(driverFeatures.keys())){
+      if (!seen.has(id)){ driverFeatures.delete(id); changed = true; }
     }
+    if (!changed) return;
+
+    driversData.features = Array.from(driverFeatures.values());
+    const src = map.getSource(DRIVERS_SRC);
+    if (src) src.setData(driversData);
   }
 
   function buildPayload(){
@@ -233,7 +334,30 @@
   });
   map.addControl(new maplibregl.NavigationControl({visualizePitch:true}));
 
+  map.on("load", ensureDriversLayer);
+  map.on("styledata", ensureDriversLayer);
+
+  map.on("click", "drivers-clusters", async (e)=>{
+    const f = e.features && e.features[0];
+    if (!f) return;
+    try{
+      const zoom = await map.getSource(DRIVERS_SRC).getClusterExpansionZoom(f.properties.cluster_id);
+      map.easeTo({center: f.geometry.coordinates, zoom});
+    }catch(err){/*ignore*/}
+  });
+  map.on("click", "drivers-point", (e)=>{
+    const f = e.features && e.features[0];
+    if (!f) return;
+    new maplibregl.Popup()
+      .setLngLat(f.geometry.coordinates)
+      .setText(`Водитель ${f.properties.driver_id} • подача ~${Math.max(1, Math.round(f.properties.eta_seconds / 60))} мин`)
+      .addTo(map);
+  });
+
   map.on("click", async (e)=>{
+    // клик по машине/кластеру обрабатывают слои водителей
+    if (map.getLayer("drivers-point") &&
+        map.queryRenderedFeatures(e.point, {layers: ["drivers-point", "drivers-clusters"]}).length) return;
     try{
       const lat = e.lngLat.lat;
       const lon = e.lngLat.lng;
@@ -312,11 +436,16 @@
     if (!fromPoint) return;
     try{
       const drv = await driversNearby(fromPoint.lat, fromPoint.lon);
-      setDrivers(drv);
+      setDrivers(drv?.drivers);
     }catch(e){/*ignore*/}
   }, 5000);
 
   // init
   clearAll();
 
+  // кэш статики/стиля/тайлов для повторных открытий (см. sw.js)
+  if ("serviceWorker" in navigator){
+    navigator.serviceWorker.register("./sw.js").catch((e)=>console.warn("sw", e));
+  }
+
 })();
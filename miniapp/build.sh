@@ -0,0 +1,28 @@
+#!/bin/sh
+# Сборка статики MiniApp при деплое (сервис miniapp_build в docker-compose, перед caddy):
+# копия miniapp/ -> OUT, ?v= у app.js/styles.css в index.html и APP_HASH/CSS_HASH/BUILD в sw.js —
+# хэши содержимого. Забыть «поднять версию» нельзя: caddy отдаёт ?v= как immutable на год.
+set -eu
+
+SRC="${1:-/src}"
+OUT="${2:-/out}"
+
+h() { cat "$@" | sha256sum | cut -c1-12; }
+
+find "$OUT" -mindepth 1 -delete
+cp -a "$SRC"/. "$OUT"/
+rm -f "$OUT/build.sh"
+
+APP="$(h "$OUT/app.js")"
+CSS="$(h "$OUT/styles.css")"
+sed -i \
+  -e "s/app\.js?v=[A-Za-z0-9_-]*/app.js?v=$APP/" \
+  -e "s/styles\.css?v=[A-Za-z0-9_-]*/styles.css?v=$CSS/" \
+  "$OUT/index.html"
+BUILD="$(h "$OUT/index.html" "$OUT/config.js")"
+sed -i \
+  -e "s/^const APP_HASH = .*/const APP_HASH = \"$APP\";/" \
+  -e "s/^const CSS_HASH = .*/const CSS_HASH = \"$CSS\";/" \
+  -e "s/^const BUILD = .*/const BUILD = \"$BUILD\";/" \
+  "$OUT/sw.js"
+echo "miniapp build $BUILD (app.js $APP, styles.css $CSS)"
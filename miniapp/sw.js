@@ -0,0 +1,121 @@
+// Service worker MiniApp: оболочка (index.html, config.js) — stale-while-revalidate (повторное открытие
+// рисуется из кэша без похода в сеть), js/css — cache-first по URL с хэшем содержимого, стиль/тайлы —
+// stale-while-revalidate с ограничением размера кэша.
+// APP_HASH / CSS_HASH / BUILD проставляет build.sh при деплое (те же хэши, что в ?v= index.html):
+// новый деплой меняет байты sw.js -> браузер ставит новый worker, он прекэширует новую оболочку
+// в новый кэш, а старый удаляется при активации.
+const APP_HASH = "dev";
+const CSS_HASH = "dev";
+const BUILD = "dev";
+const STATIC_CACHE = `taxi-static-${BUILD}`;
+const MAP_CACHE = "taxi-map-v1";
+const MAP_CACHE_MAX_ENTRIES = 600;
+// обход ключей кэша тайлов дорогой — подрезаем раз в столько записей, а не после каждой
+const MAP_CACHE_TRIM_EVERY = 50;
+
+const MAPLIBRE_VERSION = "4.7.1";
+const STATIC_ASSETS = [
+  "./",
+  "./index.html",
+  "./config.js",
+  `./app.js?v=${APP_HASH}`,
+  `./styles.css?v=${CSS_HASH}`,
+  `https://unpkg.com/maplibre-gl@${MAPLIBRE_VERSION}/dist/maplibre-gl.js`,
+  `https://unpkg.com/maplibre-gl@${MAPLIBRE_VERSION}/dist/maplibre-gl.css`,
+];
+
+let mapPuts = 0;
+
+self.addEventListener("install", (event)=>{
+  event.waitUntil((async ()=>{
+    const cache = await caches.open(STATIC_CACHE);
+    await cache.addAll(STATIC_ASSETS.map(u => new Request(u, {mode: u.startsWith("http") ? "cors" : "same-origin", cache: "reload"})));
+    await self.skipWaiting();
+  })());
+});
+
+self.addEventListener("activate", (event)=>{
+  event.waitUntil((async ()=>{
+    const keys = await caches.keys();
+    await Promise.all(keys
+      .filter(k => k.startsWith("taxi-static-") && k !== STATIC_CACHE)
+      .map(k => caches.delete(k)));
+    await self.clients.claim();
+  })());
+});
+
+function isMapResource(url){
+  const p = url.pathname;
+  return /\/style\.json$/.test(p)
+    || /\.(pbf|mvt|png|jpg|jpeg|webp)$/.test(p)
+    || p.includes("/tiles/")
+    || p.includes("/sprite")
+    || p.includes("/fonts/");
+}
+
+function isStatic(url){
+  if (url.origin === "https://unpkg.com") return url.pathname.includes("/maplibre-gl@");
+  return url.origin === self.location.origin && /\.(js|css)$/.test(url.pathname) && !url.pathname.endsWith("/sw.js");
+}
+
+function isShell(req, url){
+  return req.mode === "navigate" || (url.origin === self.location.origin && url.pathname.endsWith("/config.js"));
+}
+
+async function trimCache(cache, max){
+  const keys = await cache.keys();
+  // keys() в порядке добавления — удаляем самые старые
+  for (let i = 0; i < keys.length - max; i++){
+    await cache.delete(keys[i]);
+  }
+}
+
+async function cacheFirst(request){
+  const cache = await caches.open(STATIC_CACHE);
+  const hit = await cache.match(request);
+  if (hit) return hit;
+  const resp = await fetch(request);
+  if (resp.ok) cache.put(request, resp.clone());
+  return resp;
+}
+
+async function staleWhileRevalidate(event, cacheName, maxEntries, key = event.request){
+  const cache = await caches.open(cacheName);
+  const hit = await cache.match(key);
+  const update = fetch(event.request).then(async (resp)=>{
+    if (resp.ok){
+      await cache.put(key, resp.clone());
+      if (maxEntries && ++mapPuts % MAP_CACHE_TRIM_EVERY === 0) await trimCache(cache, maxEntries);
+    }
+    return resp;
+  });
+  if (hit){
+    event.waitUntil(update.catch(()=>{}));
+    return hit;
+  }
+  return update;
+}
+
+self.addEventListener("fetch", (event)=>{
+  const req = event.request;
+  if (req.method !== "GET") return;
+  const url = new URL(req.url);
+
+  // API и telegram-web-app.js — всегда сеть
+  if (url.origin === self.location.origin && url.pathname.startsWith("/api/")) return;
+  if (url.hostname === "telegram.org") return;
+
+  if (isShell(req, url)){
+    // Telegram открывает оболочку с параметрами в query — в кэше она одна, под адресом без query
+    const key = req.mode === "navigate" ? url.origin + url.pathname : req;
+    event.respondWith(staleWhileRevalidate(event, STATIC_CACHE, 0, key));
+    return;
+  }
+  if (isStatic(url)){
+    event.respondWith(cacheFirst(req));
+    return;
+  }
+  if (isMapResource(url)){
+    event.respondWith(staleWhileRevalidate(event, MAP_CACHE, MAP_CACHE_MAX_ENTRIES));
+  }
+});